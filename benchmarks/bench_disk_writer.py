@@ -0,0 +1,111 @@
+"""CPU cost of streaming a download to disk, old loop vs the write-behind writer.
+
+Serves a random product from the stand-in hub in a child process, so the
+server's CPU time isn't counted, and downloads it with:
+
+    iter_content   the original ``iter_content(chunk_size=10000)`` + ``f.write`` loop
+    write-behind   ``http_download.stream_response_to_file`` (readinto buffers
+                   + ``disk_writer.WriteBehindWriter``)
+
+and reports CPU seconds per GB (``time.process_time``) and MB/s for each.
+
+Usage::
+
+    python benchmarks/bench_disk_writer.py --size-mb 512 --runs 3
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sentinel_downloader import http_download  # noqa: E402
+from sentinel_downloader import http_session  # noqa: E402
+from sentinel_downloader.test.stand_in_server import StandInHub  # noqa: E402
+
+PRODUCT_ID = "bench"
+
+
+def serve(size, url_queue, stop_event):
+    with StandInHub({PRODUCT_ID: os.urandom(size)}) as hub:
+        url_queue.put(f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value")
+        stop_event.wait()
+
+
+def iter_content_download(url, file_path):
+    r = http_session.get_session().get(url, stream=True)
+    with r, open(file_path, "wb") as f:
+        for chunk in r.iter_content(chunk_size=10000):
+            if chunk:
+                f.write(chunk)
+        http_download.sync_file(f)
+
+
+def write_behind_download(url, file_path):
+    r = http_session.get_session().get(url, stream=True)
+    with r, open(file_path, "wb") as f:
+        http_download.stream_response_to_file(r, f)
+
+
+def measure(download, url, file_path, size, runs):
+    cpu_seconds = []
+    wall_seconds = []
+
+    for _ in range(runs):
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        download(url, file_path)
+        cpu_seconds.append(time.process_time() - cpu_start)
+        wall_seconds.append(time.perf_counter() - wall_start)
+
+        if os.path.getsize(file_path) != size:
+            raise RuntimeError(f"{download.__name__} wrote an incomplete file")
+        os.remove(file_path)
+
+    gigabytes = size / 1024 ** 3
+    cpu = min(cpu_seconds)
+    wall = min(wall_seconds)
+    return cpu / gigabytes, size / 1024 ** 2 / wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+
+    url_queue = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(size, url_queue, stop_event))
+    server.start()
+
+    try:
+        url = url_queue.get(timeout=60)
+
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = Path(directory, "bench.zip")
+
+            print(f"{args.size_mb} MB, best of {args.runs}")
+            for name, download in (
+                ("iter_content", iter_content_download),
+                ("write-behind", write_behind_download),
+            ):
+                cpu_per_gb, mb_per_second = measure(
+                    download, url, file_path, size, args.runs
+                )
+                print(
+                    f"{name:>14}: {cpu_per_gb:6.2f} CPU s/GB {mb_per_second:8.1f} MB/s"
+                )
+    finally:
+        stop_event.set()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""Throughput, CPU and latency of every download path, checked against a baseline.
+
+Runs the stand-in hub (``sentinel_downloader/test/stand_in_server.py``) in a
+child process, so its CPU time isn't counted, and measures:
+
+    single        ``http_download.download_to_file``, one stream
+    segmented     ``http_download.download_to_file`` with concurrent byte ranges
+    fullproduct   ``S2Downloader.download_fullproduct`` (checksum lookup + MD5)
+    asf           ``S1Downloader.asf_download_zip`` from the emulated datapool
+    bands         ``S2Downloader.download_bands`` through the Nodes tree
+    tci_batch     ``S2Downloader.download_tci_batch`` over many products
+    remote_zip    ``S2Downloader.extract_product_members`` with Range requests
+    online_check  ``S2Downloader.check_products_online``
+    search        ``S2Downloader.search_for_products_by_tile``
+
+For each it reports MB/s, CPU seconds per GB transferred (``time.process_time``)
+and wall latency per operation, best of ``--runs``. ``--save-baseline`` writes
+the results to the baseline file; later runs compare against it and exit with
+status 1 when a metric is worse than the baseline by more than ``--tolerance``.
+Baselines are machine specific, save one on the machine that runs the checks.
+
+Usage::
+
+    python benchmarks/bench_downloads.py --save-baseline
+    python benchmarks/bench_downloads.py --latency-ms 20 --only tci_batch,bands
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sentinel_downloader import http_download  # noqa: E402
+from sentinel_downloader import node_resolver  # noqa: E402
+from sentinel_downloader import s1_downloader  # noqa: E402
+from sentinel_downloader import s2_downloader  # noqa: E402
+from sentinel_downloader.test.stand_in_server import StandInHub  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+PRODUCT_ID = "5f0c6c8e-bc41-4c43-adae-be4dfa03ad5f"
+PRODUCT_NAME = "S2A_MSIL1C_20190620T181921_N0207_R127_T12UXA_20190620T231306"
+BANDS_ID = "bd22f901-a796-4553-acc9-73cbc34e0f40"
+BANDS_SAFE = "S2A_MSIL2A_20190620T181921_N0212_R127_T12UXA_20190620T231306.SAFE"
+BANDS_GRANULE = "L2A_T12UXA_A020859_20190620T182912"
+BANDS = ["B02", "B03", "B04", "B08"]
+ASF_NAME = "S1B_IW_GRDH_1SSV_20161014T012841_20161014T012906_002496_00435F_BB18"
+TILES = ["12UUA", "12UUB", "12UVA", "12UVB", "12UWA", "12UWB"]
+
+# Higher is better for throughput, lower for the rest
+HIGHER_IS_BETTER = {"mb_per_s"}
+
+
+def tci_id(i):
+    return f"{i:08d}-b95f-44f6-aa7e-bccbe4b00c4f"
+
+
+def product_zip(size):
+    """A stored (uncompressed) SAFE-like zip of random members, about ``size`` bytes."""
+    buffer = io.BytesIO()
+    member_size = max(size // 16, 1)
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr(f"{PRODUCT_NAME}.SAFE/manifest.safe", b"<manifest/>" * 100)
+        for i in range(16):
+            zf.writestr(
+                f"{PRODUCT_NAME}.SAFE/GRANULE/IMG_DATA/T12UXA_B{i:02d}.jp2",
+                os.urandom(member_size),
+            )
+    return buffer.getvalue()
+
+
+def serve(args, url_queue, stop_event):
+    size = args.size_mb * 1024 * 1024
+
+    with StandInHub({PRODUCT_ID: product_zip(size)}) as hub:
+        hub.latency = args.latency_ms / 1000
+        hub.throttle = args.throttle_mb * 1024 * 1024 if args.throttle_mb else None
+        hub.asf_products[ASF_NAME] = os.urandom(size)
+
+        band_size = args.band_mb * 1024 * 1024
+        hub.nodes[BANDS_ID] = {
+            BANDS_SAFE: {
+                "GRANULE": {
+                    BANDS_GRANULE: {
+                        "IMG_DATA": {
+                            "R10m": {
+                                f"T12UXA_20190620T181921_{band}_10m.jp2": os.urandom(band_size)
+                                for band in BANDS
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+        tci = os.urandom(args.tci_kb * 1024)
+        for i in range(args.tci_count):
+            date = f"201906{i % 28 + 1:02d}T{i:06d}"
+            hub.products[tci_id(i)] = b""
+            hub.nodes[tci_id(i)] = {
+                f"S2B_MSIL1C_{date}_N0207_R027_T12UUA_{date}.SAFE": {
+                    "GRANULE": {
+                        f"L1C_T12UUA_A012065_{date}": {
+                            "IMG_DATA": {f"T12UUA_{date}_TCI.jp2": tci}
+                        }
+                    }
+                }
+            }
+
+        for i in range(args.search_entries):
+            tile = random.choice(TILES)
+            hub.add_search_entry(
+                tci_id(i),
+                f"S2B_MSIL1C_20190628T182929_N0207_R027_T{tile}_20190628T{i:06d}",
+                cloudcoverpercentage=random.uniform(0, 100),
+                orbitnumber=12065,
+            )
+
+        url_queue.put((hub.base_url, hub.asf_url))
+        stop_event.wait()
+
+
+class Context:
+    def __init__(self, args, base_url, asf_url, directory):
+        self.args = args
+        self.base_url = base_url
+        self.size = args.size_mb * 1024 * 1024
+        self.s2_dl = s2_downloader.S2Downloader(
+            username="user", password="pass", hub_url=base_url
+        )
+
+        config_path = Path(directory, "config.json")
+        config_path.write_text(
+            json.dumps(
+                {
+                    "SENTINEL_USER": "user",
+                    "SENTINEL_PASS": "pass",
+                    "ESA_SCIHUB_USER": "user",
+                    "ESA_SCIHUB_PASS": "pass",
+                    "ESA_SCIHUB_URL": base_url,
+                    "ASF_USER": "user",
+                    "ASF_PASS": "pass",
+                    "S1": {"DOWNLOAD": "USGS_ASF"},
+                }
+            )
+        )
+        self.s1_dl = s1_downloader.S1Downloader(str(config_path))
+        self.s1_dl.asf_url = asf_url
+
+    @property
+    def value_url(self):
+        return f"{self.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+
+
+def bench_single(ctx, directory):
+    size = http_download.download_to_file(ctx.value_url, Path(directory, "single.zip"))
+    return size, 1
+
+
+def bench_segmented(ctx, directory):
+    size = http_download.download_to_file(
+        ctx.value_url, Path(directory, "segmented.zip"), segments=ctx.args.segments
+    )
+    return size, 1
+
+
+def bench_fullproduct(ctx, directory):
+    task_status = ctx.s2_dl.download_fullproduct(
+        PRODUCT_ID, PRODUCT_NAME, directory, segments=ctx.args.segments
+    )
+    check(task_status)
+    return os.path.getsize(task_status.data), 1
+
+
+def bench_asf(ctx, directory):
+    product = {
+        "name": ASF_NAME,
+        "product_type": "GRD",
+        "polarization_mode": "VV",
+        "sensor_mode": "IW",
+        "detailed_metadata": {"format": "SAFE"},
+    }
+    task_status = ctx.s1_dl.asf_download_zip(product, directory)
+    check(task_status)
+    return os.path.getsize(task_status.data), 1
+
+
+def bench_bands(ctx, directory):
+    task_status = ctx.s2_dl.download_bands(BANDS_ID, BANDS, directory)
+    check(task_status)
+    return sum(os.path.getsize(path) for path in task_status.data), 1
+
+
+def bench_tci_batch(ctx, directory):
+    uuids = [tci_id(i) for i in range(ctx.args.tci_count)]
+    size = 0
+    for _, task_status in ctx.s2_dl.download_tci_batch(uuids, directory):
+        check(task_status)
+        size += os.path.getsize(task_status.data)
+    return size, len(uuids)
+
+
+def bench_remote_zip(ctx, directory):
+    task_status = ctx.s2_dl.extract_product_members(
+        PRODUCT_ID, ["manifest.safe", "T12UXA_B00.jp2"], directory
+    )
+    check(task_status)
+    return sum(os.path.getsize(path) for path in task_status.data), 1
+
+
+def bench_online_check(ctx, directory):
+    ids = [tci_id(i) for i in range(ctx.args.tci_count)]
+    online = ctx.s2_dl.check_products_online(ids)
+    if len(online) != len(ids):
+        raise RuntimeError(f"{len(online)} of {len(ids)} products checked")
+    return 0, 1
+
+
+def bench_search(ctx, directory):
+    ctx.s2_dl.search_for_products_by_tile(TILES[:3], ("20190601", "20190701"))
+    return 0, 1
+
+
+BENCHMARKS = {
+    "single": bench_single,
+    "segmented": bench_segmented,
+    "fullproduct": bench_fullproduct,
+    "asf": bench_asf,
+    "bands": bench_bands,
+    "tci_batch": bench_tci_batch,
+    "remote_zip": bench_remote_zip,
+    "online_check": bench_online_check,
+    "search": bench_search,
+}
+
+
+def check(task_status):
+    if not task_status.status:
+        raise RuntimeError(f"{task_status.message}: {task_status.data}")
+
+
+def measure(benchmark, ctx, runs):
+    cpu_seconds = []
+    wall_seconds = []
+
+    for _ in range(runs):
+        # Every run starts cold, nothing cached from the previous one
+        node_resolver.get_node_cache().clear()
+
+        with tempfile.TemporaryDirectory() as directory:
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+            size, operations = benchmark(ctx, directory)
+            cpu_seconds.append(time.process_time() - cpu_start)
+            wall_seconds.append(time.perf_counter() - wall_start)
+
+    cpu = min(cpu_seconds)
+    wall = min(wall_seconds)
+    result = {"latency_ms": wall / operations * 1000}
+    if size:
+        result["mb_per_s"] = size / 1024 ** 2 / wall
+        result["cpu_s_per_gb"] = cpu / (size / 1024 ** 3)
+
+    return result
+
+
+def regressions(results, baseline, tolerance):
+    """Return a message for every metric worse than the baseline by more than ``tolerance``."""
+    messages = []
+
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            expected = baseline.get(name, {}).get(metric)
+            if not expected:
+                continue
+
+            if metric in HIGHER_IS_BETTER:
+                worse = value < expected * (1 - tolerance)
+            else:
+                worse = value > expected * (1 + tolerance)
+
+            if worse:
+                messages.append(
+                    f"{name} {metric}: {value:.2f}, baseline {expected:.2f} "
+                    f"(tolerance {tolerance:.0%})"
+                )
+
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=128)
+    parser.add_argument("--band-mb", type=int, default=8)
+    parser.add_argument("--tci-count", type=int, default=32)
+    parser.add_argument("--tci-kb", type=int, default=512)
+    parser.add_argument("--search-entries", type=int, default=500)
+    parser.add_argument("--segments", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--latency-ms", type=float, default=0, help="Delay before every response"
+    )
+    parser.add_argument(
+        "--throttle-mb", type=float, default=0, help="MB/s limit per response"
+    )
+    parser.add_argument("--only", help="Comma separated benchmarks to run")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    url_queue = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(args, url_queue, stop_event))
+    server.start()
+
+    results = {}
+    try:
+        base_url, asf_url = url_queue.get(timeout=120)
+
+        with tempfile.TemporaryDirectory() as directory:
+            ctx = Context(args, base_url, asf_url, directory)
+
+            print(f"best of {args.runs}, latency {args.latency_ms} ms")
+            for name in names:
+                results[name] = measure(BENCHMARKS[name], ctx, args.runs)
+                metrics = results[name]
+                line = f"{name:>13}: {metrics['latency_ms']:9.1f} ms/op"
+                if "mb_per_s" in metrics:
+                    line += (
+                        f" {metrics['mb_per_s']:8.1f} MB/s"
+                        f" {metrics['cpu_s_per_gb']:6.2f} CPU s/GB"
+                    )
+                print(line)
+    finally:
+        stop_event.set()
+        server.join()
+
+    if args.save_baseline:
+        baseline = {}
+        if args.baseline.is_file():
+            baseline = json.loads(args.baseline.read_text())
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not args.baseline.is_file():
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0
+
+    messages = regressions(results, json.loads(args.baseline.read_text()), args.tolerance)
+    for message in messages:
+        print(f"REGRESSION {message}")
+
+    return 1 if messages else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""Plan the hub searches for a list of AOI polygons.
+
+Field boundary lists hold many small, adjacent or overlapping polygons, and
+a search per polygon returns nearly the same Sentinel products (each covering
+thousands of square kilometres) over and over. ``plan_queries`` groups
+polygons lying close together and searches each group by the convex hull of
+its polygons, a single simple geometry. ``PolygonMatcher`` then tests every
+product footprint against the input polygons, so a product is reported once
+with the polygons it actually covers, and products only touching a hull are
+dropped.
+"""
+import logging
+from collections import namedtuple
+
+from .footprint_index import geometry_rings, rings_bounds, rings_intersect
+
+logger = logging.getLogger(__name__)
+
+# Polygons whose bounds are further apart than this (in degrees) are never
+# searched together
+DEFAULT_MAX_GAP = 0.1
+# A group's hull may be at most this many times the area of its polygons
+DEFAULT_MAX_AREA_RATIO = 4.0
+# A single polygon with more vertices is searched by its hull, long
+# footprint clauses can exceed the query length limit
+MAX_QUERY_VERTICES = 100
+
+QueryPlan = namedtuple("QueryPlan", ["geometry", "members"])
+QueryPlan.__doc__ = """One hub search of a plan.
+
+Args:
+    geometry (str): WKT polygon searched.
+    members (list): Indices of the input polygons it covers.
+"""
+
+
+def convex_hull(points):
+    """Convex hull of (x, y) points, counter clockwise and closed."""
+    points = sorted(set(points))
+    if len(points) < 3:
+        return points + points[:1]
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower, upper = [], []
+    for point in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], point) <= 0:
+            lower.pop()
+        lower.append(point)
+    for point in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], point) <= 0:
+            upper.pop()
+        upper.append(point)
+
+    hull = lower[:-1] + upper[:-1]
+    return hull + hull[:1]
+
+
+def ring_area(ring):
+    return abs(
+        sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:]))
+    ) / 2.0
+
+
+def ring_wkt(ring):
+    return "POLYGON(({}))".format(", ".join(f"{x} {y}" for x, y in ring))
+
+
+def bounds_gap(first, second):
+    """Distance between two (min_x, max_x, min_y, max_y) bounds along the
+    axis they are furthest apart, 0 when they overlap."""
+    return max(
+        first[0] - second[1], second[0] - first[1], first[2] - second[3], second[2] - first[3], 0
+    )
+
+
+class Group:
+    """Polygons searched together, by their hull."""
+
+    def __init__(self, index, rings):
+        self.members = [index]
+        self.vertices = sum(len(ring) for ring in rings)
+        self.area = sum(ring_area(ring) for ring in rings)
+        self.bounds = rings_bounds(rings)
+        self.hull = convex_hull([point for ring in rings for point in ring])
+
+    def merged_hull(self, other):
+        return convex_hull(self.hull + other.hull)
+
+    def absorb(self, other, hull):
+        self.members += other.members
+        self.vertices += other.vertices
+        self.area += other.area
+        self.bounds = rings_bounds([hull])
+        self.hull = hull
+
+
+def plan_queries(
+    polygons, max_gap=DEFAULT_MAX_GAP, max_area_ratio=DEFAULT_MAX_AREA_RATIO
+):
+    """Group the WKT ``polygons`` into as few ``QueryPlan`` searches as possible.
+
+    Two groups are merged while their bounds are at most ``max_gap`` apart
+    and the hull around both is at most ``max_area_ratio`` times their summed
+    area. Polygons that can't be parsed are searched on their own, as given.
+    """
+    plans = []
+    groups = []
+
+    for index, polygon in enumerate(polygons):
+        try:
+            rings = geometry_rings(polygon)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            logger.warning(f"Can't plan polygon {index}, searching it as given")
+            plans.append(QueryPlan(polygon, [index]))
+            continue
+        groups.append(Group(index, rings))
+
+    # A grown group can reach groups it was too far from, repeat until stable
+    merged = True
+    while merged:
+        merged = False
+        for i, group in enumerate(groups):
+            j = i + 1
+            while j < len(groups):
+                other = groups[j]
+                if bounds_gap(group.bounds, other.bounds) <= max_gap:
+                    hull = group.merged_hull(other)
+                    if ring_area(hull) <= max_area_ratio * (group.area + other.area):
+                        group.absorb(other, hull)
+                        del groups[j]
+                        merged = True
+                        continue
+                j += 1
+
+    for group in groups:
+        if len(group.members) == 1 and group.vertices <= MAX_QUERY_VERTICES:
+            geometry = polygons[group.members[0]]
+        else:
+            geometry = ring_wkt(group.hull)
+        plans.append(QueryPlan(geometry, sorted(group.members)))
+
+    plans.sort(key=lambda plan: plan.members[0])
+    logger.info(f"Planned {len(plans)} searches for {len(polygons)} polygons")
+    return plans
+
+
+class PolygonMatcher:
+    """Find the input polygons a product footprint covers.
+
+    Args:
+        polygons (list): WKT polygons, the input of ``plan_queries``.
+    """
+
+    def __init__(self, polygons):
+        self.polygons = []
+        # Polygons that can't be parsed are assumed covered by what their
+        # search returns
+        self.unparsed = set()
+        for index, polygon in enumerate(polygons):
+            try:
+                rings = geometry_rings(polygon)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self.unparsed.add(index)
+                continue
+            self.polygons.append((index, rings, rings_bounds(rings)))
+
+    def covered(self, footprint, members=()):
+        """Indices of the polygons ``footprint`` (WKT) intersects.
+
+        ``members`` are the polygons of the search that returned the product,
+        all of them are assumed covered when the footprint can't be parsed.
+        """
+        try:
+            rings = geometry_rings(footprint)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return sorted(members)
+
+        bounds = rings_bounds(rings)
+        covered = {
+            index
+            for index, polygon_rings, polygon_bounds in self.polygons
+            if bounds_gap(bounds, polygon_bounds) == 0
+            and rings_intersect(rings, polygon_rings)
+        }
+        covered.update(self.unparsed.intersection(members))
+        return sorted(covered)
@@ -0,0 +1,209 @@
+"""Concurrent download of many products with per-host concurrency caps.
+
+SciHub allows at most 2 concurrent downloads per user while ASF tolerates
+more, so a single global worker count either breaks the SciHub limit or leaves
+ASF bandwidth unused. ``BulkDownloader`` schedules each product under both a
+per-host and a global ``asyncio.Semaphore`` and runs the blocking transfers in
+a thread pool.
+
+Sentinel-1 products may fail over or hedge between ASF and SciHub, so their
+host is only known per attempt. Every product therefore takes a global slot
+first, then the transfer thread takes the slot of each host it uses. One
+order for all products, a product never holds a host slot while waiting for a
+global one.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from .utils import TaskStatus
+
+logger = logging.getLogger(__name__)
+
+ASF_HOST = "datapool.asf.alaska.edu"
+
+DEFAULT_HOST_LIMITS = {
+    "scihub.copernicus.eu": 2,
+    ASF_HOST: 4,
+}
+
+BulkDownloadResult = namedtuple(
+    "BulkDownloadResult", ["product_id", "host", "task_status", "bytes", "seconds"]
+)
+
+BulkDownloadReport = namedtuple(
+    "BulkDownloadReport", ["results", "total_bytes", "seconds", "throughput"]
+)
+
+
+class BulkDownloader:
+    """Download product records concurrently, bounded per host and globally.
+
+    Product records are the dicts produced by ``api_wrapper.query_by_polygon``
+    (``uuid``, ``name`` and ``platform_name`` keys are used). Sentinel-1
+    products are fetched through an ``S1Downloader`` configured with
+    ``USGS_ASF`` as its primary source, if given, which fails over to SciHub
+    when ASF is unavailable. Everything else is fetched from the SciHub
+    ``$value`` endpoint of ``s2_downloader``.
+
+    Args:
+        s2_downloader (S2Downloader): Provides SciHub url and credentials.
+        s1_downloader (S1Downloader): Optional, used for ASF downloads.
+        max_concurrent (int): Global limit on transfers in flight.
+        host_limits (dict): Host name -> concurrent transfers, merged over
+            ``DEFAULT_HOST_LIMITS``. Hosts not listed use ``max_concurrent``.
+    """
+
+    def __init__(
+        self, s2_downloader, s1_downloader=None, max_concurrent=4, host_limits=None
+    ):
+        self.s2_downloader = s2_downloader
+        self.s1_downloader = s1_downloader
+        self.max_concurrent = max_concurrent
+
+        self.host_limits = dict(DEFAULT_HOST_LIMITS)
+        if host_limits:
+            self.host_limits.update(host_limits)
+
+    def plan(self, product, directory):
+        """Return (host, destination path, blocking download callable) for a
+        product.
+
+        The callable takes a ``host_slot(host)`` context manager factory and
+        holds the slot of every host it uses. For Sentinel-1 the host is only
+        the preferred one.
+        """
+        product_id = product.get("uuid", product.get("entity_id"))
+        full_file_path = Path(directory, product["name"] + ".zip")
+
+        if (
+            product.get("platform_name") == "Sentinel-1"
+            and self.s1_downloader is not None
+            and self.s1_downloader.primary_dl_src == "USGS_ASF"
+        ):
+            def s1_download(host_slot):
+                return self.s1_downloader.s1_download_wrapper(
+                    product, directory, host_slot=host_slot
+                )
+
+            return ASF_HOST, full_file_path, s1_download
+
+        s2_dl = self.s2_downloader
+        host = urlsplit(s2_dl.copernicus_url).hostname
+
+        def download(host_slot):
+            with host_slot(host):
+                return s2_dl.download_fullproduct(product_id, product["name"], directory)
+
+        return host, full_file_path, download
+
+    def host_semaphore(self, host_sems, host):
+        """The host's semaphore, created on first use. Only call on the event loop."""
+        if host not in host_sems:
+            host_sems[host] = asyncio.Semaphore(
+                self.host_limits.get(host, self.max_concurrent)
+            )
+        return host_sems[host]
+
+    def thread_host_slot(self, loop, host_sems):
+        """Return ``host_slot(host)`` for transfer threads, holding the host's
+        semaphore of the event loop ``loop``."""
+
+        @contextlib.contextmanager
+        def host_slot(host):
+            async def acquire():
+                semaphore = self.host_semaphore(host_sems, host)
+                await semaphore.acquire()
+                return semaphore
+
+            semaphore = asyncio.run_coroutine_threadsafe(acquire(), loop).result()
+            try:
+                yield
+            finally:
+                loop.call_soon_threadsafe(semaphore.release)
+
+        return host_slot
+
+    async def download_product(self, product, directory, executor, global_limit, host_sems):
+        product_id = product.get("uuid", product.get("entity_id"))
+        host, full_file_path, download = self.plan(product, directory)
+
+        if os.path.isfile(full_file_path):
+            return BulkDownloadResult(
+                product_id,
+                host,
+                TaskStatus(True, "Requested file to download already exists.", str(full_file_path)),
+                0,
+                0.0,
+            )
+
+        loop = asyncio.get_running_loop()
+        host_slot = self.thread_host_slot(loop, host_sems)
+
+        # Host slots are taken in the transfer thread, after the global one
+        async with global_limit:
+            logger.info(f"Starting download of {product_id} from {host}")
+            start = time.monotonic()
+            task_status = await loop.run_in_executor(executor, download, host_slot)
+            seconds = time.monotonic() - start
+
+        transferred = 0
+        if task_status.status and os.path.isfile(full_file_path):
+            transferred = os.path.getsize(full_file_path)
+
+        return BulkDownloadResult(product_id, host, task_status, transferred, seconds)
+
+    async def download_all(self, products, directory, on_result=None):
+        """Download every product in ``products`` into ``directory``.
+
+        ``on_result`` is called with each ``BulkDownloadResult`` as soon as it
+        completes. Returns a ``BulkDownloadReport`` with the aggregate
+        throughput in bytes per second.
+        """
+        global_limit = asyncio.Semaphore(self.max_concurrent)
+        host_sems = {}
+        results = []
+        total_bytes = 0
+
+        start = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            tasks = [
+                asyncio.ensure_future(
+                    self.download_product(
+                        product, directory, executor, global_limit, host_sems
+                    )
+                )
+                for product in products
+            ]
+
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                results.append(result)
+                total_bytes += result.bytes
+
+                elapsed = time.monotonic() - start
+                logger.info(
+                    f"{len(results)}/{len(tasks)} done, {result.product_id}: "
+                    f"{result.task_status.message} "
+                    f"(aggregate {total_bytes / max(elapsed, 1e-6) / 1024 ** 2:.2f} MB/s)"
+                )
+
+                if on_result:
+                    on_result(result)
+
+        seconds = time.monotonic() - start
+
+        return BulkDownloadReport(
+            results, total_bytes, seconds, total_bytes / max(seconds, 1e-6)
+        )
+
+    def run(self, products, directory, on_result=None):
+        """Blocking wrapper around ``download_all`` for callers without an event loop."""
+        return asyncio.run(self.download_all(products, directory, on_result))
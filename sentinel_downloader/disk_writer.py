@@ -0,0 +1,157 @@
+"""Write-behind file writer for streamed downloads.
+
+Reading a response with ``iter_content`` allocates a new ``bytes`` object per
+chunk and writes it inline, so a slow disk stalls the socket and small chunks
+cost one Python iteration each. Here the network thread reads straight into a
+small pool of large reusable buffers and hands each full buffer to a writer
+thread, so reads never wait on storage unless every buffer is in flight.
+"""
+import os
+import queue
+import threading
+
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+DEFAULT_BUFFER_COUNT = 4
+
+
+def preallocate(file_obj, size):
+    """Reserve ``size`` bytes on disk for ``file_obj`` so writes don't fragment.
+
+    Uses ``posix_fallocate`` where available and falls back to extending the
+    file with ``truncate``.
+    """
+    file_obj.flush()
+    try:
+        os.posix_fallocate(file_obj.fileno(), 0, size)
+    except (AttributeError, OSError):
+        file_obj.truncate(size)
+
+
+def response_reader(r):
+    """Return a ``readinto(buffer)`` callable for the body of a streamed response.
+
+    Returns None when the body is content-encoded and has to be decoded by
+    ``iter_content`` instead.
+    """
+    encoding = r.headers.get("Content-Encoding", "identity").lower()
+    if encoding != "identity":
+        return None
+
+    # The underlying http.client response reads straight into the caller's
+    # buffer, urllib3's own readinto reads into a temporary bytes first
+    fp = getattr(r.raw, "_fp", None)
+    if fp is not None and hasattr(fp, "readinto"):
+        return fp.readinto
+
+    return r.raw.readinto
+
+
+def fill_buffer(readinto, buffer):
+    """Read into ``buffer`` until it is full or the stream ends.
+
+    Returns a (bytes read, exception) tuple. A read error is returned rather
+    than raised so the bytes that did arrive can still be written out.
+    """
+    view = memoryview(buffer)
+    filled = 0
+    try:
+        while filled < len(buffer):
+            n = readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+    except Exception as e:
+        return filled, e
+
+    return filled, None
+
+
+class WriteBehindWriter:
+    """Writes buffers to a file on a background thread.
+
+    Buffers come from a fixed pool: ``acquire`` blocks when every buffer is
+    queued for writing, which bounds memory use and applies back pressure to
+    the network reader. Errors raised by the writer thread are re-raised by
+    the next ``acquire``, ``flush`` or ``close``.
+
+    Args:
+        file_obj: File opened for binary writing, positioned where the first
+            buffer should go.
+        buffer_size (int): Size of each reusable buffer.
+        buffer_count (int): Number of buffers in the pool.
+    """
+
+    def __init__(
+        self, file_obj, buffer_size=DEFAULT_BUFFER_SIZE, buffer_count=DEFAULT_BUFFER_COUNT
+    ):
+        self.file_obj = file_obj
+        self.buffer_size = buffer_size
+
+        self.free = queue.Queue()
+        for _ in range(buffer_count):
+            self.free.put(bytearray(buffer_size))
+
+        self.pending = queue.Queue()
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            try:
+                if item is None:
+                    return
+
+                buffer, length = item
+                if self.error is None:
+                    try:
+                        self.file_obj.write(memoryview(buffer)[:length])
+                    except BaseException as e:
+                        self.error = e
+
+                self.free.put(buffer)
+            finally:
+                self.pending.task_done()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def acquire(self):
+        self.raise_error()
+        return self.free.get()
+
+    def release(self, buffer):
+        self.free.put(buffer)
+
+    def write(self, buffer, length):
+        """Queue the first ``length`` bytes of an acquired buffer for writing."""
+        self.pending.put((buffer, length))
+
+    def flush(self):
+        """Block until every queued buffer is written and flushed to the OS."""
+        self.pending.join()
+        self.raise_error()
+        self.file_obj.flush()
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        self.raise_error()
+        self.file_obj.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Still drain what was read so it can be resumed, but keep the
+            # original exception
+            try:
+                self.close()
+            except BaseException:
+                pass
@@ -0,0 +1,365 @@
+"""Priority download queue with failover between mirrors.
+
+Sentinel-1 products can be fetched from ASF or from SciHub. ``DownloadScheduler``
+tries the preferred source first and moves on to the next one when it fails
+or runs below a minimum throughput. The outcome of every attempt is folded
+into a per-source ``SourceHealth`` so later products are sent to whichever
+mirror has been faster and more reliable.
+
+With ``hedge_delay`` set, the next source is raced against a lagging first
+one instead of waiting for it to fail (see ``hedged_download``).
+"""
+import contextlib
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from . import metrics
+from .hedged_download import HedgeCancelled, hedged_download
+from .http_download import DownloadError
+from .utils import TaskStatus
+
+logger = logging.getLogger(__name__)
+
+ScheduledDownload = namedtuple(
+    "ScheduledDownload", ["product_id", "source", "task_status", "attempts"]
+)
+
+
+class QueuedDownload:
+    """A product waiting in the queue, and its ``ScheduledDownload`` once done."""
+
+    def __init__(self, product, dest_dir, source_slot=None):
+        self.product = product
+        self.dest_dir = dest_dir
+        self.source_slot = source_slot
+        self.result = None
+        self.done = threading.Event()
+
+
+class SlowTransfer(DownloadError):
+    """Raised from a progress callback when a transfer runs below the minimum rate."""
+
+
+class ThroughputGuard:
+    """Progress callback that aborts a transfer running below ``min_throughput``.
+
+    ``bytes_done`` counts from the first report, the bytes a resumed
+    transfer already had on disk (see ``http_download.ProgressCounter``)
+    don't make a slow source look fast.
+
+    Args:
+        min_throughput (float): Minimum average bytes per second.
+        grace (float): Seconds before the rate is first checked, so slow
+            starts (redirects, TLS, queueing at the mirror) are tolerated.
+    """
+
+    def __init__(self, min_throughput, grace=30.0):
+        self.min_throughput = min_throughput
+        self.grace = grace
+        self.start = time.monotonic()
+        self.resumed_from = None
+        self.bytes_done = 0
+
+    def __call__(self, done, total=None):
+        if self.resumed_from is None:
+            # The starting point, nothing has been transferred yet
+            self.resumed_from = done
+            return
+        self.bytes_done = done - self.resumed_from
+
+        if not self.min_throughput:
+            return
+
+        elapsed = time.monotonic() - self.start
+        if elapsed >= self.grace and self.bytes_done / elapsed < self.min_throughput:
+            raise SlowTransfer(
+                f"{self.bytes_done / elapsed:.0f} B/s is below the minimum of "
+                f"{self.min_throughput:.0f} B/s"
+            )
+
+
+class SourceHealth:
+    """Running record of how well a download source has performed.
+
+    Args:
+        name (str): Source name, e.g. ``USGS_ASF``.
+        ewma_alpha (float): Weight of the newest transfer in the throughput.
+        max_failures (int): Consecutive failures before the source is
+            deprioritised.
+        failure_cooldown (float): Seconds a deprioritised source waits
+            before it is preferred again.
+    """
+
+    def __init__(self, name, ewma_alpha=0.3, max_failures=3, failure_cooldown=300.0):
+        self.name = name
+        self.ewma_alpha = ewma_alpha
+        self.max_failures = max_failures
+        self.failure_cooldown = failure_cooldown
+
+        self.throughput = None
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_failure = None
+
+        self.lock = threading.Lock()
+
+    def record_success(self, nbytes, seconds):
+        with self.lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            if nbytes and seconds > 0:
+                self.update_throughput(nbytes / seconds)
+
+    def record_failure(self, nbytes=0, seconds=0.0):
+        """Record a failed attempt, the bytes it managed still count towards the rate."""
+        with self.lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_failure = time.monotonic()
+            if seconds > 0:
+                self.update_throughput(nbytes / seconds)
+
+    def record_cancelled(self, nbytes, seconds):
+        """Record a transfer stopped because another source won, only its rate counts."""
+        with self.lock:
+            if seconds > 0:
+                self.update_throughput(nbytes / seconds)
+
+    def update_throughput(self, rate):
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            alpha = self.ewma_alpha
+            self.throughput = alpha * rate + (1 - alpha) * self.throughput
+
+    def available(self):
+        """False while the source is cooling down after repeated failures."""
+        with self.lock:
+            if self.consecutive_failures < self.max_failures:
+                return True
+            return time.monotonic() - self.last_failure >= self.failure_cooldown
+
+    def score(self):
+        """Expected useful bytes per second: throughput scaled by success rate."""
+        with self.lock:
+            if self.throughput is None:
+                return None
+            attempts = self.successes + self.failures
+            return self.throughput * (self.successes + 1) / (attempts + 1)
+
+
+class DownloadScheduler:
+    """Download products in priority order, failing over between sources.
+
+    ``sources`` maps a source name to a callable
+    ``download(product, dest_dir, progress)`` returning a ``TaskStatus``; its
+    order is the configured preference. Each product is offered to the
+    sources in the order given by ``rank_sources``.
+
+    Products are queued with ``add`` and downloaded by ``run``, or by
+    ``submit``, which callers on several threads use to share the queue.
+
+    Args:
+        sources (OrderedDict): Source name -> download callable.
+        min_throughput (float): Bytes per second below which an attempt is
+            abandoned for the next source. None disables the check.
+        throughput_grace (float): Seconds before the throughput is checked.
+        failure_cooldown (float): See ``SourceHealth``.
+        hedge_delay (float): When set, start the second ranked source after
+            this many seconds if the first is still lagging, and keep
+            whichever finishes first. ``min_throughput`` is then the rate
+            below which the first counts as lagging.
+    """
+
+    def __init__(
+        self,
+        sources,
+        min_throughput=None,
+        throughput_grace=30.0,
+        failure_cooldown=300.0,
+        hedge_delay=None,
+    ):
+        self.sources = dict(sources)
+        self.min_throughput = min_throughput
+        self.throughput_grace = throughput_grace
+        self.hedge_delay = hedge_delay
+
+        self.health = {
+            name: SourceHealth(name, failure_cooldown=failure_cooldown)
+            for name in self.sources
+        }
+
+        self.queue = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def add(self, product, dest_dir, priority=0, source_slot=None):
+        """Queue a product, lower ``priority`` values are downloaded first.
+
+        Returns its ``QueuedDownload``, ``source_slot`` is passed on to
+        ``download``.
+        """
+        item = QueuedDownload(product, dest_dir, source_slot)
+        with self.lock:
+            heapq.heappush(self.queue, (priority, next(self.counter), item))
+        return item
+
+    def __len__(self):
+        with self.lock:
+            return len(self.queue)
+
+    def pop(self):
+        """Take the next ``QueuedDownload`` off the queue, None when empty."""
+        with self.lock:
+            if not self.queue:
+                return None
+            return heapq.heappop(self.queue)[-1]
+
+    def download_item(self, item):
+        try:
+            item.result = self.download(item.product, item.dest_dir, item.source_slot)
+        finally:
+            item.done.set()
+        return item.result
+
+    def submit(self, product, dest_dir, priority=0, source_slot=None):
+        """Queue a product and download queued products until it is done.
+
+        Each caller downloads whatever is first in the queue, so concurrent
+        callers together work through it in priority order, and one whose
+        product another caller took waits for it. Returns the product's
+        ``ScheduledDownload``.
+        """
+        item = self.add(product, dest_dir, priority, source_slot)
+
+        while not item.done.is_set():
+            queued = self.pop()
+            if queued is None:
+                item.done.wait()
+                break
+            self.download_item(queued)
+
+        return item.result
+
+    def rank_sources(self):
+        """Return source names, best first.
+
+        Sources cooling down after repeated failures go last. The rest keep
+        the configured order until every one of them has a measured
+        throughput, then they are ordered by ``SourceHealth.score``.
+        """
+        names = list(self.sources)
+        available = [name for name in names if self.health[name].available()]
+        cooling = [name for name in names if name not in available]
+
+        scores = {name: self.health[name].score() for name in available}
+        if available and all(score is not None for score in scores.values()):
+            available.sort(key=lambda name: scores[name], reverse=True)
+
+        return available + cooling
+
+    def download(self, product, dest_dir, source_slot=None):
+        """Download one product, trying each source until one succeeds.
+
+        Args:
+            source_slot (callable): Optional, ``source_slot(name)`` returns a
+                context manager held for the whole of each attempt at source
+                ``name``, e.g. a per-host concurrency slot.
+
+        Returns:
+            (ScheduledDownload): The source that succeeded (None if all
+            failed), its ``TaskStatus`` (the last failure otherwise) and the
+            list of (source, TaskStatus) attempts made.
+        """
+        if self.hedge_delay is not None and len(self.sources) > 1:
+            return self.download_hedged(product, dest_dir, source_slot)
+
+        product_id = product.get("uuid", product.get("name"))
+        attempts = []
+        task_status = TaskStatus(False, "No download sources configured", None)
+
+        for name in self.rank_sources():
+            slot = source_slot(name) if source_slot else contextlib.nullcontext()
+            with slot:
+                guard = ThroughputGuard(self.min_throughput, self.throughput_grace)
+                logger.info(f"Downloading {product_id} from {name}")
+
+                start = time.monotonic()
+                try:
+                    task_status = self.sources[name](product, dest_dir, guard)
+                except Exception as e:
+                    task_status = TaskStatus(
+                        False, "An exception occured while trying to download.", e
+                    )
+                seconds = time.monotonic() - start
+
+            attempts.append((name, task_status))
+
+            if task_status.status:
+                self.health[name].record_success(guard.bytes_done, seconds)
+                return ScheduledDownload(product_id, name, task_status, attempts)
+
+            self.health[name].record_failure(guard.bytes_done, seconds)
+            metrics.record_retry(name)
+            logger.warning(
+                f"Download of {product_id} from {name} failed "
+                f"({task_status.message} {task_status.data}), trying next source"
+            )
+
+        return ScheduledDownload(product_id, None, task_status, attempts)
+
+    def download_hedged(self, product, dest_dir, source_slot=None):
+        """``download`` racing the two best ranked sources with ``hedged_download``."""
+        product_id = product.get("uuid", product.get("name"))
+        ranked = self.rank_sources()
+
+        result = hedged_download(
+            [(name, self.sources[name]) for name in ranked],
+            product,
+            dest_dir,
+            hedge_delay=self.hedge_delay,
+            min_throughput=self.min_throughput,
+            source_slot=source_slot,
+        )
+
+        for attempt in result.attempts:
+            health = self.health[attempt.source]
+            if attempt.task_status.status:
+                health.record_success(attempt.bytes_done, attempt.seconds)
+            elif isinstance(attempt.task_status.data, HedgeCancelled):
+                health.record_cancelled(attempt.bytes_done, attempt.seconds)
+            else:
+                health.record_failure(attempt.bytes_done, attempt.seconds)
+
+        return ScheduledDownload(
+            product_id,
+            result.source,
+            result.task_status,
+            [(attempt.source, attempt.task_status) for attempt in result.attempts],
+        )
+
+    def run(self, on_result=None):
+        """Download queued products until the queue is empty.
+
+        Products added while running (e.g. from ``on_result``) are picked up
+        in priority order. Returns the list of ``ScheduledDownload`` results.
+        """
+        results = []
+
+        while True:
+            item = self.pop()
+            if item is None:
+                break
+
+            result = self.download_item(item)
+            results.append(result)
+
+            if on_result:
+                on_result(result)
+
+        return results
@@ -0,0 +1,465 @@
+"""On-disk spatial index of product footprints for repeated AOI searches.
+
+``query_by_polygon`` is run over and over for the same fields and seasons,
+and every polygon used to go to the hub even when an earlier search already
+returned every product over it. ``FootprintIndex`` keeps the products found
+by AOI searches in an SQLite R-tree keyed by footprint bounds and sensing
+time, together with the space-time boxes (area bounds x ``beginposition``
+window) that have been searched completely.
+
+A polygon search subtracts the covered boxes from the polygon's bounds and
+date window and only asks the hub for the boxes left over, each searched by
+its bounding box so the coverage it records is exact. The answer is then
+read from the index, footprints tested against the polygon itself. Sensing
+times closer to now than ``settle`` are never marked covered, products are
+still being published for them. Coverage expires after ``coverage_ttl``, the
+hub reprocesses and retracts products, so old searches are run again.
+"""
+import datetime
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from geomet import wkt
+from sentinelsat.sentinel import SentinelAPI, format_query_date
+
+from .query_cache import decode_value, encode_value
+
+logger = logging.getLogger(__name__)
+
+# Products sensed within the last three days may still show up on the hub
+DEFAULT_SETTLE = 3 * 24 * 60 * 60.0
+# Searched boxes are trusted for this long
+DEFAULT_COVERAGE_TTL = 30 * 24 * 60 * 60.0
+# More uncovered boxes than this are searched as one box around all of them
+DEFAULT_MAX_GAPS = 8
+# Products read from the index per database round trip
+READ_BATCH_SIZE = 500
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS footprint_rtree USING rtree(
+    id, min_x, max_x, min_y, max_y, min_t, max_t
+);
+CREATE TABLE IF NOT EXISTS footprints (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    sensed REAL NOT NULL,
+    footprint TEXT NOT NULL,
+    properties TEXT NOT NULL,
+    UNIQUE (key, uuid)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS coverage_rtree USING rtree(
+    id, min_x, max_x, min_y, max_y, min_t, max_t
+);
+CREATE TABLE IF NOT EXISTS coverage (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    min_x REAL NOT NULL,
+    max_x REAL NOT NULL,
+    min_y REAL NOT NULL,
+    max_y REAL NOT NULL,
+    min_t REAL NOT NULL,
+    max_t REAL NOT NULL,
+    searched REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_searched ON coverage (searched);
+"""
+
+
+def filter_key(**filters):
+    """Normalized query terms other than the area and date, products and
+    coverage are only shared between searches with the same key."""
+    return " ".join(SentinelAPI.format_query(**filters).split())
+
+
+def to_epoch(value):
+    return (value - EPOCH).total_seconds()
+
+
+def from_epoch(seconds):
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+
+def date_bound(value, now, start):
+    """Epoch seconds of one end of a ``date`` range, None if it can't be
+    resolved (date arithmetic such as ``NOW-1DAY``)."""
+    if isinstance(value, datetime.datetime):
+        return to_epoch(value)
+    if isinstance(value, datetime.date):
+        return to_epoch(datetime.datetime.combine(value, datetime.time()))
+
+    formatted = format_query_date(value)
+    if formatted == "*":
+        return 0.0 if start else now
+    if formatted == "NOW":
+        return now
+    try:
+        return to_epoch(datetime.datetime.strptime(formatted, "%Y-%m-%dT%H:%M:%SZ"))
+    except ValueError:
+        return None
+
+
+def geometry_rings(text):
+    """Outer rings of a WKT polygon or multipolygon as lists of (x, y)."""
+    if not text:
+        raise ValueError("Expected a polygon, got nothing")
+    geometry = wkt.loads(text)
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        raise ValueError(f"Expected a polygon, got {geometry['type']}")
+    return [[tuple(point[:2]) for point in polygon[0]] for polygon in polygons]
+
+
+def rings_bounds(rings):
+    xs = [x for ring in rings for x, _ in ring]
+    ys = [y for ring in rings for _, y in ring]
+    return min(xs), max(xs), min(ys), max(ys)
+
+
+def box_wkt(min_x, max_x, min_y, max_y):
+    return (
+        f"POLYGON(({min_x} {min_y}, {max_x} {min_y}, {max_x} {max_y}, "
+        f"{min_x} {max_y}, {min_x} {min_y}))"
+    )
+
+
+def point_in_ring(x, y, ring):
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def orientation(a, b, c):
+    value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return (value > 0) - (value < 0)
+
+
+def on_segment(a, b, c):
+    return min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= c[1] <= max(
+        a[1], b[1]
+    )
+
+
+def segments_intersect(a, b, c, d):
+    o1, o2 = orientation(a, b, c), orientation(a, b, d)
+    o3, o4 = orientation(c, d, a), orientation(c, d, b)
+    if o1 != o2 and o3 != o4:
+        return True
+    return (
+        (o1 == 0 and on_segment(a, b, c))
+        or (o2 == 0 and on_segment(a, b, d))
+        or (o3 == 0 and on_segment(c, d, a))
+        or (o4 == 0 and on_segment(c, d, b))
+    )
+
+
+def rings_intersect(first, second):
+    """Whether two lists of outer rings intersect, holes are ignored."""
+    for a in first:
+        for b in second:
+            a_bounds, b_bounds = rings_bounds([a]), rings_bounds([b])
+            if (
+                a_bounds[0] > b_bounds[1]
+                or b_bounds[0] > a_bounds[1]
+                or a_bounds[2] > b_bounds[3]
+                or b_bounds[2] > a_bounds[3]
+            ):
+                continue
+            if point_in_ring(*a[0], b) or point_in_ring(*b[0], a):
+                return True
+            for p1, p2 in zip(a, a[1:]):
+                for q1, q2 in zip(b, b[1:]):
+                    if segments_intersect(p1, p2, q1, q2):
+                        return True
+    return False
+
+
+def subtract_box(box, cut):
+    """Parts of ``box`` outside ``cut``, both (min_x, max_x, min_y, max_y,
+    min_t, max_t), as up to six boxes."""
+    if any(box[2 * d] >= cut[2 * d + 1] or box[2 * d + 1] <= cut[2 * d] for d in range(3)):
+        return [box]
+
+    pieces = []
+    rest = list(box)
+    for d in range(3):
+        low, high = 2 * d, 2 * d + 1
+        if rest[low] < cut[low]:
+            piece = list(rest)
+            piece[high] = cut[low]
+            pieces.append(tuple(piece))
+            rest[low] = cut[low]
+        if rest[high] > cut[high]:
+            piece = list(rest)
+            piece[low] = cut[high]
+            pieces.append(tuple(piece))
+            rest[high] = cut[high]
+    return pieces
+
+
+def enclosing_box(boxes):
+    return tuple(
+        (min if i % 2 == 0 else max)(box[i] for box in boxes) for i in range(6)
+    )
+
+
+class FootprintIndex:
+    """Product footprints and searched space-time boxes in an SQLite R-tree.
+
+    Args:
+        path (str): SQLite database file, created if missing.
+        settle (float): Seconds before now after which a search is not
+            recorded as complete.
+        max_gaps (int): Uncovered boxes searched separately before they are
+            merged into one search.
+        coverage_ttl (float): Seconds a searched box counts as covered.
+    """
+
+    def __init__(
+        self,
+        path,
+        settle=DEFAULT_SETTLE,
+        max_gaps=DEFAULT_MAX_GAPS,
+        coverage_ttl=DEFAULT_COVERAGE_TTL,
+        clock=time.time,
+    ):
+        self.path = Path(path)
+        self.settle = settle
+        self.coverage_ttl = coverage_ttl
+        self.max_gaps = max_gaps
+        self.clock = clock
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+        self.hits = 0
+        self.gap_searches = 0
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def coverage(self, key, box):
+        """Covered boxes of ``key`` overlapping ``box``, searched within
+        ``coverage_ttl``."""
+        expired = self.clock() - self.coverage_ttl
+        with self.lock:
+            return self.db.execute(
+                "SELECT c.min_x, c.max_x, c.min_y, c.max_y, c.min_t, c.max_t "
+                "FROM coverage_rtree r JOIN coverage c ON c.id = r.id "
+                "WHERE c.key = ? AND r.max_x >= ? AND r.min_x <= ? "
+                "AND r.max_y >= ? AND r.min_y <= ? AND r.max_t >= ? AND r.min_t <= ? "
+                "AND c.searched >= ?",
+                (key, box[0], box[1], box[2], box[3], box[4], box[5], expired),
+            ).fetchall()
+
+    def gaps(self, key, box):
+        """Parts of ``box`` not covered for ``key``, merged into one box when
+        there are more than ``max_gaps``."""
+        remaining = [box]
+        for covered in self.coverage(key, box):
+            remaining = [
+                piece for part in remaining for piece in subtract_box(part, covered)
+            ]
+            if not remaining:
+                break
+
+        if len(remaining) > self.max_gaps:
+            return [enclosing_box(remaining)]
+        return remaining
+
+    def add_coverage(self, key, box):
+        """Record ``box`` as searched for ``key``, up to ``settle`` before now."""
+        max_t = min(box[5], math.floor(self.clock() - self.settle))
+        if max_t <= box[4]:
+            return
+        box = box[:5] + (max_t,)
+        expired = self.clock() - self.coverage_ttl
+
+        with self.lock:
+            # Expired boxes are ignored by coverage, drop them as new ones come
+            self.db.execute(
+                "DELETE FROM coverage_rtree WHERE id IN "
+                "(SELECT id FROM coverage WHERE searched < ?)",
+                (expired,),
+            )
+            self.db.execute("DELETE FROM coverage WHERE searched < ?", (expired,))
+            row_id = self.db.execute(
+                "INSERT INTO coverage (key, min_x, max_x, min_y, max_y, min_t, max_t, "
+                "searched) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, *box, self.clock()),
+            ).lastrowid
+            self.db.execute(
+                "INSERT INTO coverage_rtree VALUES (?, ?, ?, ?, ?, ?, ?)", (row_id, *box)
+            )
+            self.db.commit()
+
+    def add_product(self, key, uuid, properties):
+        """Index a product for ``key``, False if it has no usable footprint or
+        sensing time."""
+        sensed = properties.get("beginposition")
+        footprint = properties.get("footprint")
+        if not isinstance(sensed, datetime.datetime) or not footprint:
+            return False
+        try:
+            bounds = rings_bounds(geometry_rings(footprint))
+        except (ValueError, KeyError, TypeError):
+            return False
+
+        sensed = to_epoch(sensed)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id FROM footprints WHERE key = ? AND uuid = ?", (key, uuid)
+            ).fetchone()
+            if row is not None:
+                self.db.execute("DELETE FROM footprint_rtree WHERE id = ?", row)
+                self.db.execute("DELETE FROM footprints WHERE id = ?", row)
+
+            row_id = self.db.execute(
+                "INSERT INTO footprints (key, uuid, sensed, footprint, properties) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, uuid, sensed, footprint, json.dumps(properties, default=encode_value)),
+            ).lastrowid
+            self.db.execute(
+                "INSERT INTO footprint_rtree VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (row_id, *bounds, sensed, sensed),
+            )
+        return True
+
+    def drop_missing(self, key, box, found):
+        """Remove the indexed products of ``key`` inside ``box`` that a new
+        search of it didn't return (``found``), the hub no longer has them."""
+        box_rings = geometry_rings(box_wkt(*box[:4]))
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT f.id, f.uuid, f.footprint FROM footprint_rtree r "
+                "JOIN footprints f ON f.id = r.id "
+                "WHERE f.key = ? AND r.max_x >= ? AND r.min_x <= ? "
+                "AND r.max_y >= ? AND r.min_y <= ? AND f.sensed BETWEEN ? AND ?",
+                (key, *box),
+            ).fetchall()
+            stale = [
+                (row_id,)
+                for row_id, uuid, footprint in rows
+                if uuid not in found and rings_intersect(box_rings, geometry_rings(footprint))
+            ]
+            self.db.executemany("DELETE FROM footprint_rtree WHERE id = ?", stale)
+            self.db.executemany("DELETE FROM footprints WHERE id = ?", stale)
+
+        if stale:
+            logger.info(f"Dropped {len(stale)} products no longer returned for {key}")
+
+    def products(self, key, rings, box):
+        """Yield (uuid, properties) of the indexed products of ``key`` sensed
+        in the box's time range whose footprint intersects ``rings``."""
+        with self.lock:
+            ids = [
+                row_id
+                for row_id, in self.db.execute(
+                    "SELECT f.id FROM footprint_rtree r JOIN footprints f ON f.id = r.id "
+                    "WHERE f.key = ? AND r.max_x >= ? AND r.min_x <= ? "
+                    "AND r.max_y >= ? AND r.min_y <= ? AND f.sensed BETWEEN ? AND ? "
+                    "ORDER BY f.sensed, f.uuid",
+                    (key, *box),
+                )
+            ]
+
+        for start in range(0, len(ids), READ_BATCH_SIZE):
+            batch = ids[start : start + READ_BATCH_SIZE]
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT uuid, footprint, properties FROM footprints "
+                    f"WHERE id IN ({', '.join('?' * len(batch))}) ORDER BY sensed, uuid",
+                    batch,
+                ).fetchall()
+
+            for uuid, footprint, properties in rows:
+                if rings_intersect(rings, geometry_rings(footprint)):
+                    yield uuid, json.loads(properties, object_hook=decode_value)
+
+    def query(self, search, area=None, date=None, area_relation="Intersects", **filters):
+        """Yield (uuid, properties) for an AOI search, searching only the
+        uncovered parts with ``search`` (a callable taking ``SentinelAPI.query``
+        keywords and yielding (uuid, properties)).
+
+        Searches the index can't answer, without an area or with an open or
+        relative date range, go straight to ``search``.
+        """
+        now = self.clock()
+        rings = None
+        box = None
+
+        if area is not None and date is not None and area_relation.lower() == "intersects":
+            try:
+                rings = geometry_rings(area)
+            except (ValueError, KeyError, TypeError):
+                rings = None
+            start, end = date_bound(date[0], now, True), date_bound(date[1], now, False)
+            if rings is not None and start is not None and end is not None:
+                box = rings_bounds(rings) + (start, end)
+
+        if box is None:
+            yield from search(area=area, date=date, area_relation=area_relation, **filters)
+            return
+
+        key = filter_key(**filters)
+        gaps = self.gaps(key, box)
+        if not gaps:
+            self.hits += 1
+
+        # Products that can't be indexed are passed on as they are found
+        unindexed = set()
+        for gap in gaps:
+            self.gap_searches += 1
+            logger.debug(f"Searching uncovered box {gap} for {key}")
+            found = set()
+            for uuid, properties in search(
+                area=box_wkt(*gap[:4]),
+                date=(from_epoch(gap[4]), from_epoch(gap[5])),
+                **filters,
+            ):
+                found.add(uuid)
+                if not self.add_product(key, uuid, properties) and uuid not in unindexed:
+                    unindexed.add(uuid)
+                    yield uuid, properties
+
+            # The gap may have been covered before, its coverage expired
+            self.drop_missing(key, gap, found)
+            with self.lock:
+                self.db.commit()
+            self.add_coverage(key, gap)
+
+        yield from self.products(key, rings, box)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def open_footprint_index(path, **kwargs):
+    """Return the process wide ``FootprintIndex`` for ``path``, opening it on first use."""
+    path = Path(path).resolve()
+
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = FootprintIndex(path, **kwargs)
+        else:
+            for name, value in kwargs.items():
+                setattr(index, name, value)
+        return index
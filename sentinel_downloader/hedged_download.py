@@ -0,0 +1,267 @@
+"""Hedged downloads: race a second mirror when the first one lags.
+
+The primary source is started on its own. If it has not received its first
+byte, or is running below ``min_throughput``, once ``hedge_delay`` seconds
+have passed, the secondary source is started alongside it. Whichever finishes
+first wins; the other is cancelled through its progress callback and its
+partial files are removed.
+
+Each source downloads into its own hidden directory under ``dest_dir`` so the
+two transfers never share a file, and only the winner's zip is moved into
+place. Without a winner the directories are kept, a retry resumes each
+source's ``.part`` file. The first source started also adopts a ``.part``
+left in ``dest_dir`` by a sequential download.
+"""
+import contextlib
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from .http_download import DownloadError, part_path, state_path
+from .utils import TaskStatus
+
+logger = logging.getLogger(__name__)
+
+HedgedResult = namedtuple("HedgedResult", ["source", "task_status", "attempts", "hedged"])
+
+# Outcome of one mirror: bytes_done and seconds are as of when it finished
+HedgeAttempt = namedtuple("HedgeAttempt", ["source", "task_status", "bytes_done", "seconds"])
+
+
+class HedgeCancelled(DownloadError):
+    """Raised from a progress callback to stop the losing transfer."""
+
+
+class MirrorTransfer:
+    """One source's attempt at a product, run on its own thread."""
+
+    def __init__(self, name, download, product, dest_dir, finished, source_slot=None):
+        self.name = name
+        self.download = download
+        self.source_slot = source_slot
+        self.product = product
+        self.dest_dir = Path(dest_dir)
+        self.temp_dir = Path(dest_dir, f".{product['name']}.{name}.hedge")
+        self.finished_queue = finished
+
+        self.start_time = None
+        self.first_byte_time = None
+        # Bytes on disk when the transfer started, see ThroughputGuard
+        self.resumed_from = None
+        self.bytes_done = 0
+        self.task_status = None
+
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.finished = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self.thread.start()
+
+    def progress(self, done, total=None):
+        if self.cancelled:
+            raise HedgeCancelled(f"{self.name} transfer cancelled")
+
+        if self.resumed_from is None:
+            self.resumed_from = done
+        done -= self.resumed_from
+        if done and self.first_byte_time is None:
+            self.first_byte_time = time.monotonic()
+        self.bytes_done = done
+
+    def adopt_partial(self):
+        """Move a resumable ``.part`` (and its state) from ``dest_dir`` into
+        this transfer's directory, unless it has one of its own."""
+        zip_name = self.product["name"] + ".zip"
+        theirs = part_path(self.dest_dir / zip_name)
+        ours = part_path(self.temp_dir / zip_name)
+        if not theirs.is_file() or ours.exists():
+            return
+
+        logger.info(f"{self.name} resumes {theirs}")
+        for path in (state_path(self.dest_dir / zip_name), theirs):
+            if path.is_file():
+                os.replace(path, self.temp_dir / path.name)
+
+    def run(self):
+        try:
+            os.makedirs(self.temp_dir, exist_ok=True)
+            self.adopt_partial()
+            slot = (
+                self.source_slot(self.name) if self.source_slot else contextlib.nullcontext()
+            )
+            with slot:
+                self.task_status = self.download(
+                    self.product, str(self.temp_dir), self.progress
+                )
+        except Exception as e:
+            self.task_status = TaskStatus(
+                False, "An exception occured while trying to download.", e
+            )
+        finally:
+            with self.lock:
+                self.finished = True
+                cleanup = self.cancelled
+            if cleanup:
+                self.remove_files()
+            elif not self.task_status.status:
+                # Partial files are kept for a retry to resume
+                with contextlib.suppress(OSError):
+                    self.temp_dir.rmdir()
+            self.finished_queue.put(self)
+
+    def cancel(self):
+        """Stop the transfer at its next progress update and remove its files,
+        once another source has won."""
+        with self.lock:
+            self.cancelled = True
+            cleanup = self.finished
+        if cleanup:
+            self.remove_files()
+
+    def remove_files(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def lagging(self, min_throughput):
+        """True if no data has arrived yet, or the average rate is too low."""
+        if self.first_byte_time is None:
+            return True
+
+        return bool(min_throughput) and self.bytes_done / self.elapsed() < min_throughput
+
+    def attempt(self):
+        task_status = self.task_status
+        if task_status is None:
+            # Cancelled and still unwinding
+            task_status = TaskStatus(
+                False, "Cancelled", HedgeCancelled(f"{self.name} transfer cancelled")
+            )
+        return HedgeAttempt(self.name, task_status, self.bytes_done, self.elapsed())
+
+
+def hedged_download(
+    sources,
+    product,
+    dest_dir,
+    hedge_delay=10.0,
+    min_throughput=None,
+    poll_interval=0.5,
+    source_slot=None,
+):
+    """Download ``product`` from the first source, hedging with the second.
+
+    Args:
+        sources (list): (name, download callable) pairs, primary first. The
+            callables have the ``DownloadScheduler`` source signature
+            ``download(product, dest_dir, progress)``. Only the first two are
+            used.
+        product (dict): Product record, ``name`` is used for the zip name.
+        dest_dir (str): Directory the zip is moved into.
+        hedge_delay (float): Seconds to give the primary before hedging.
+        min_throughput (float): Bytes per second the primary must sustain
+            to avoid hedging. None only hedges on a missing first byte.
+        poll_interval (float): Seconds between checks of the primary.
+        source_slot (callable): Optional, ``source_slot(name)`` returns a
+            context manager each transfer holds while it runs. A transfer
+            still waiting for its slot counts as lagging.
+
+    Returns:
+        (HedgedResult): Winning source (None if all failed), its
+        ``TaskStatus`` with the final zip path, a ``HedgeAttempt`` per source
+        started, and whether the secondary was started.
+    """
+    finished = queue.Queue()
+    transfers = [
+        MirrorTransfer(name, download, product, dest_dir, finished, source_slot)
+        for name, download in sources[:2]
+    ]
+
+    primary = transfers[0]
+    pending = transfers[1:]
+    running = [primary]
+    primary.start()
+
+    hedged = False
+    winner = None
+    failures = []
+
+    while running:
+        if pending and primary in running:
+            wait = max(0.0, primary.start_time + hedge_delay - time.monotonic())
+            timeout = max(wait, poll_interval)
+        else:
+            timeout = None
+
+        try:
+            transfer = finished.get(timeout=timeout)
+        except queue.Empty:
+            transfer = None
+
+        if transfer is not None:
+            running.remove(transfer)
+
+            if transfer.task_status.status:
+                winner = transfer
+                break
+
+            failures.append(transfer)
+            logger.warning(
+                f"{transfer.name} failed for {product['name']}: "
+                f"{transfer.task_status.message} {transfer.task_status.data}"
+            )
+
+        if not pending:
+            continue
+
+        primary_failed = primary in failures
+        if primary_failed or (
+            primary.elapsed() >= hedge_delay and primary.lagging(min_throughput)
+        ):
+            secondary = pending.pop(0)
+            logger.info(
+                f"{'Failing over' if primary_failed else 'Hedging'} {product['name']} "
+                f"to {secondary.name} after {primary.elapsed():.1f}s "
+                f"({primary.bytes_done} bytes from {primary.name})"
+            )
+            hedged = not primary_failed
+            running.append(secondary)
+            secondary.start()
+
+    for transfer in running:
+        transfer.cancel()
+
+    attempts = [t.attempt() for t in transfers if t.start_time is not None]
+
+    if winner is None:
+        task_status = failures[-1].task_status if failures else TaskStatus(
+            False, "No download sources configured", None
+        )
+        return HedgedResult(None, task_status, attempts, hedged)
+
+    zip_name = product["name"] + ".zip"
+    full_file_path = Path(dest_dir, zip_name)
+    os.replace(Path(winner.temp_dir, zip_name), full_file_path)
+    # The product is in place, nothing is left to resume
+    for transfer in transfers:
+        if transfer not in running:
+            transfer.remove_files()
+
+    logger.info(f"{winner.name} won {product['name']} in {winner.elapsed():.1f}s")
+
+    return HedgedResult(
+        winner.name,
+        TaskStatus(True, "Download successful", str(full_file_path)),
+        attempts,
+        hedged,
+    )
@@ -0,0 +1,655 @@
+"""Helpers for streaming a product from an HTTP endpoint to a file on disk.
+
+The DHuS ``$value`` endpoints serve products that are several hundred MB in
+size, and a single TCP stream rarely fills the available bandwidth. When the
+server honours ``Range`` requests the file can be split into byte ranges that
+are fetched concurrently into one preallocated file.
+
+Downloads are written to ``<file>.part`` and only renamed to their final name
+once complete, so a file under its final name is always a finished transfer.
+An interrupted transfer is resumed from the bytes already on disk; segmented
+transfers record per-segment progress in ``<file>.part.json`` after each fsync.
+
+When the expected checksum is known it is computed as the bytes stream in, so
+a corrupt transfer is rejected without reading the file back afterwards.
+
+Response bodies are read into large reusable buffers and written by a
+write-behind thread (see ``disk_writer``), and files are preallocated when the
+size is known up front.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from . import disk_writer
+from . import http_session
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = disk_writer.DEFAULT_BUFFER_SIZE
+# Segments smaller than this cost more in request overhead than they gain
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+DEFAULT_TIMEOUT = 2 * 60.0
+# How much a segment writes between fsync + progress checkpoints
+CHECKPOINT_SIZE = 32 * 1024 * 1024
+
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+UNSATISFIED_RANGE_RE = re.compile(r"bytes \*/(\d+)")
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ChecksumMismatch(DownloadError):
+    pass
+
+
+def part_path(file_path):
+    return Path(f"{file_path}.part")
+
+
+def state_path(file_path):
+    return Path(f"{file_path}.part.json")
+
+
+def parse_content_range(header):
+    """Parse a ``Content-Range`` header into a (start, end, total) tuple.
+
+    ``total`` is None when the server reports an unknown length (``*``).
+    Returns None if the header is missing or malformed.
+    """
+    if not header:
+        return None
+
+    match = CONTENT_RANGE_RE.match(header.strip())
+    if not match:
+        return None
+
+    start, end, total = match.groups()
+    return int(start), int(end), None if total == "*" else int(total)
+
+
+def split_ranges(total_size, segments, min_segment_size=MIN_SEGMENT_SIZE):
+    """Split ``total_size`` bytes into at most ``segments`` inclusive byte ranges.
+
+    Returns a list of (start, end) tuples covering the whole file.
+    """
+    if total_size <= 0:
+        return []
+
+    segments = max(1, min(segments, total_size // max(1, min_segment_size)))
+    # Ceiling division so the last segment absorbs the remainder
+    segment_size = -(-total_size // segments)
+
+    ranges = []
+    for start in range(0, total_size, segment_size):
+        ranges.append((start, min(start + segment_size, total_size) - 1))
+
+    return ranges
+
+
+def check_response(r):
+    if r.status_code not in (200, 206):
+        raise DownloadError(
+            f"Unexpected response status {r.status_code} for {r.url}"
+        )
+
+
+def sync_file(file_obj):
+    file_obj.flush()
+    os.fsync(file_obj.fileno())
+
+
+def stream_response_to_file(
+    r,
+    file_obj,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    on_chunk=None,
+    hasher=None,
+    checkpoint=None,
+    checkpoint_size=CHECKPOINT_SIZE,
+):
+    """Write the body of a streamed response to an open file, return bytes written.
+
+    The body is read into reusable ``chunk_size`` buffers and written from the
+    current file position by a ``WriteBehindWriter``. ``on_chunk`` is called
+    with the size of every buffer read and ``hasher`` (a ``hashlib`` object)
+    is updated with it. Every ``checkpoint_size`` bytes, and when the response
+    ends or fails, the file is fsynced and ``checkpoint(bytes_on_disk)`` is
+    called. The bytes and duration of the body are recorded in ``metrics``.
+    """
+    start = time.monotonic()
+
+    readinto = disk_writer.response_reader(r)
+    if readinto is None:
+        written = stream_decoded_response_to_file(
+            r, file_obj, chunk_size, on_chunk, hasher, checkpoint, checkpoint_size
+        )
+        metrics.record_transfer(r.url, written, time.monotonic() - start)
+        return written
+
+    written = 0
+    unsynced = 0
+    error = None
+
+    writer = disk_writer.WriteBehindWriter(file_obj, buffer_size=chunk_size)
+    try:
+        while error is None:
+            buffer = writer.acquire()
+            n, error = disk_writer.fill_buffer(readinto, buffer)
+
+            if not n:
+                writer.release(buffer)
+                break
+
+            if hasher:
+                hasher.update(memoryview(buffer)[:n])
+            writer.write(buffer, n)
+
+            written += n
+            unsynced += n
+            if on_chunk:
+                on_chunk(n)
+
+            if checkpoint and unsynced >= checkpoint_size:
+                writer.flush()
+                sync_file(file_obj)
+                checkpoint(written)
+                unsynced = 0
+    finally:
+        writer.close()
+        sync_file(file_obj)
+        if checkpoint:
+            checkpoint(written)
+        # Failed bodies count too, the bytes were transferred
+        metrics.record_transfer(r.url, written, time.monotonic() - start)
+
+    if error is not None:
+        raise error
+
+    # The body was read past urllib3, hand the finished connection back to the pool
+    release_conn = getattr(r.raw, "release_conn", None)
+    if release_conn is not None:
+        release_conn()
+
+    return written
+
+
+def stream_decoded_response_to_file(
+    r, file_obj, chunk_size, on_chunk, hasher, checkpoint, checkpoint_size
+):
+    """``stream_response_to_file`` for content-encoded bodies that need ``iter_content``."""
+    written = 0
+    unsynced = 0
+    try:
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            if not chunk:
+                continue
+
+            file_obj.write(chunk)
+            if hasher:
+                hasher.update(chunk)
+            written += len(chunk)
+            unsynced += len(chunk)
+            if on_chunk:
+                on_chunk(len(chunk))
+
+            if checkpoint and unsynced >= checkpoint_size:
+                sync_file(file_obj)
+                checkpoint(written)
+                unsynced = 0
+    finally:
+        sync_file(file_obj)
+        if checkpoint:
+            checkpoint(written)
+
+    return written
+
+
+def new_hasher(checksum):
+    """Return a ``hashlib`` object for an (algorithm, hex digest) tuple, or None."""
+    if checksum is None:
+        return None
+
+    return hashlib.new(checksum[0].lower())
+
+
+def hash_file(hasher, file_path, length=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Update ``hasher`` with the first ``length`` bytes (default all) of a file."""
+    remaining = length
+    with open(file_path, "rb") as f:
+        while remaining is None or remaining > 0:
+            block = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+
+    return hasher
+
+
+def verify_checksum(hasher, checksum, file_path):
+    """Compare a finished hash with the expected checksum.
+
+    On mismatch the ``.part`` file and any segment state are removed, since
+    resuming from corrupt data would only reproduce the corruption.
+    """
+    if hasher is None:
+        return
+
+    algorithm, expected = checksum
+    actual = hasher.hexdigest()
+
+    if actual.lower() != expected.lower():
+        remove_if_exists(part_path(file_path))
+        remove_if_exists(state_path(file_path))
+        raise ChecksumMismatch(
+            f"{algorithm} mismatch for {file_path}, expected {expected}, got {actual}"
+        )
+
+    logger.debug(f"{algorithm} verified for {file_path}")
+
+
+class ProgressCounter:
+    """Thread safe running total handed to a ``progress(done, total)`` callable.
+
+    The starting total is reported once before any data arrives, so a rate
+    measured from the first report leaves out bytes a resumed transfer
+    already had on disk.
+    """
+
+    def __init__(self, progress=None, done=0, total=None):
+        self.progress = progress
+        self.done = done
+        self.total = total
+        self.lock = threading.Lock()
+
+        if self.progress:
+            self.progress(done, total)
+
+    def add(self, nbytes):
+        with self.lock:
+            self.done += nbytes
+            done = self.done
+
+        if self.progress:
+            self.progress(done, self.total)
+
+
+def load_state(file_path):
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(file_path, state):
+    tmp_path = Path(f"{file_path}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+        sync_file(f)
+    os.replace(tmp_path, file_path)
+
+
+def remove_if_exists(file_path):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def download_single(
+    url,
+    file_path,
+    auth=None,
+    timeout=DEFAULT_TIMEOUT,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    progress=None,
+    checksum=None,
+):
+    """Stream ``url`` into the ``.part`` file for ``file_path``, resuming if possible.
+
+    Returns the total size of the ``.part`` file once the response ends.
+    """
+    part = part_path(file_path)
+    offset = part.stat().st_size if part.is_file() else 0
+
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+
+    r = http_session.get_session().get(
+        url=url, auth=auth, headers=headers, stream=True, timeout=timeout
+    )
+
+    with r:
+        if r.status_code == 416 and offset:
+            unsatisfied = UNSATISFIED_RANGE_RE.match(r.headers.get("Content-Range", ""))
+            hasher = new_hasher(checksum)
+            # Without a state file a full size .part may just be preallocated,
+            # only a checksum can show it really holds the file
+            if unsatisfied and int(unsatisfied.group(1)) == offset and hasher:
+                hash_file(hasher, part)
+                if hasher.hexdigest().lower() == checksum[1].lower():
+                    logger.info(f"{part} already holds the complete file")
+                    return offset
+
+            logger.info(f"{part} can't be trusted, restarting")
+            remove_if_exists(part)
+            return download_single(
+                url, file_path, auth, timeout, chunk_size, progress, checksum
+            )
+
+        check_response(r)
+
+        content_range = parse_content_range(r.headers.get("Content-Range"))
+
+        if r.status_code == 206 and content_range and content_range[0] == offset:
+            logger.info(f"Resuming {url} from byte {offset}")
+            mode = "ab"
+        else:
+            if offset:
+                logger.info(f"Server did not resume {url}, restarting from zero")
+            offset = 0
+            mode = "wb"
+
+        total = None
+        if "Content-Length" in r.headers:
+            total = offset + int(r.headers["Content-Length"])
+
+        counter = ProgressCounter(progress, offset, total)
+
+        hasher = new_hasher(checksum)
+        if hasher and offset:
+            # Only the resumed prefix is read back, the rest is hashed in flight
+            hash_file(hasher, part, offset)
+
+        checkpoint = None
+        state_file = state_path(file_path)
+
+        with open(part, mode) as f:
+            if mode == "wb" and total:
+                # A preallocated file's size no longer says how much arrived,
+                # so progress is tracked as a single segment in the state file,
+                # written first so a preallocated .part never exists without it
+                state = {"url": url, "total": total, "segments": [[0, total - 1, 0]]}
+                save_state(state_file, state)
+                disk_writer.preallocate(f, total)
+
+                def checkpoint(bytes_on_disk):
+                    state["segments"][0][2] = bytes_on_disk
+                    save_state(state_file, state)
+
+            written = stream_response_to_file(
+                r, f, chunk_size, counter.add, hasher, checkpoint
+            )
+
+    if total is not None and offset + written != total:
+        raise DownloadError(
+            f"Transfer of {url} ended early, {offset + written} of {total} bytes on disk"
+        )
+
+    remove_if_exists(state_file)
+    verify_checksum(hasher, checksum, file_path)
+
+    return offset + written
+
+
+def fetch_segment(
+    url,
+    file_path,
+    segment,
+    auth=None,
+    timeout=DEFAULT_TIMEOUT,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    checkpoint=None,
+    on_chunk=None,
+):
+    """Fetch the rest of one segment of ``url`` into the matching offset of ``file_path``.
+
+    ``segment`` is a mutable [start, end, done] list; ``done`` is advanced after
+    each fsync and ``checkpoint`` is then called so the progress can be
+    persisted.
+    """
+    start, end, done = segment
+    if start + done > end:
+        return 0
+
+    r = http_session.get_session().get(
+        url=url,
+        auth=auth,
+        headers={"Range": f"bytes={start + done}-{end}"},
+        stream=True,
+        timeout=timeout,
+    )
+
+    with r:
+        if r.status_code != 206:
+            raise DownloadError(
+                f"Expected 206 for range {start + done}-{end}, got {r.status_code}"
+            )
+
+        content_range = parse_content_range(r.headers.get("Content-Range"))
+        if content_range is None or content_range[0] != start + done:
+            raise DownloadError(
+                f"Server returned range {r.headers.get('Content-Range')} for request {start + done}-{end}"
+            )
+
+        def segment_checkpoint(bytes_on_disk):
+            segment[2] = done + bytes_on_disk
+            if checkpoint:
+                checkpoint()
+
+        with open(file_path, "r+b") as f:
+            f.seek(start + done)
+            written = stream_response_to_file(
+                r, f, chunk_size, on_chunk, checkpoint=segment_checkpoint
+            )
+
+    expected = end - start + 1
+    if done + written != expected:
+        raise DownloadError(
+            f"Segment {start}-{end} incomplete, received {done + written} of {expected} bytes"
+        )
+
+    return written
+
+
+def download_segmented(
+    url,
+    file_path,
+    auth=None,
+    segments=1,
+    timeout=DEFAULT_TIMEOUT,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    min_segment_size=MIN_SEGMENT_SIZE,
+    progress=None,
+    checksum=None,
+):
+    """Fetch ``url`` as concurrent byte ranges into the ``.part`` file for ``file_path``.
+
+    Falls back to a single stream when the server ignores ``Range``. Returns
+    the size of the completed ``.part`` file.
+
+    Segments arrive out of order so a checksum can't be computed in flight;
+    it is computed over the assembled file, which is still in the page cache.
+    """
+    part = part_path(file_path)
+    state_file = state_path(file_path)
+
+    r = http_session.get_session().get(
+        url=url,
+        auth=auth,
+        headers={"Range": "bytes=0-0"},
+        stream=True,
+        timeout=timeout,
+    )
+
+    with r:
+        check_response(r)
+
+        content_range = parse_content_range(r.headers.get("Content-Range"))
+
+        if r.status_code == 200 or content_range is None or content_range[2] is None:
+            remove_if_exists(state_file)
+
+            if r.status_code == 206:
+                # Partial response we can't place, start over as a single stream
+                remove_if_exists(part)
+                r.close()
+                return download_single(
+                    url, file_path, auth, timeout, chunk_size, progress, checksum
+                )
+
+            logger.info(f"Server ignored Range for {url}, using a single stream")
+
+            total = int(r.headers["Content-Length"]) if "Content-Length" in r.headers else None
+            counter = ProgressCounter(progress, 0, total)
+            hasher = new_hasher(checksum)
+            with open(part, "wb") as f:
+                written = stream_response_to_file(
+                    r, f, chunk_size, counter.add, hasher
+                )
+
+            verify_checksum(hasher, checksum, file_path)
+            return written
+
+    total_size = content_range[2]
+    state = load_state(state_file)
+
+    if state and state.get("url") == url and state.get("total") == total_size and part.is_file():
+        logger.info(f"Resuming segmented download of {url}")
+        ranges = state["segments"]
+    else:
+        # A .part left by a single stream download is a valid prefix
+        offset = part.stat().st_size if part.is_file() and not state else 0
+        if offset >= total_size:
+            offset = 0
+
+        ranges = [
+            [offset + start, offset + end, 0]
+            for start, end in split_ranges(total_size - offset, segments, min_segment_size)
+        ]
+
+        state = {"url": url, "total": total_size, "segments": ranges}
+        save_state(state_file, state)
+
+        with open(part, "r+b" if offset else "wb") as f:
+            disk_writer.preallocate(f, total_size)
+
+    logger.info(
+        f"Downloading {total_size} bytes from {url} in {len(ranges)} segments"
+    )
+
+    already_done = total_size - sum(end - start + 1 - done for start, end, done in ranges)
+    counter = ProgressCounter(progress, already_done, total_size)
+    state_lock = threading.Lock()
+
+    def checkpoint():
+        with state_lock:
+            save_state(state_file, state)
+
+    with ThreadPoolExecutor(max_workers=max(1, len(ranges))) as executor:
+        futures = [
+            executor.submit(
+                fetch_segment,
+                url,
+                part,
+                segment,
+                auth,
+                timeout,
+                chunk_size,
+                checkpoint,
+                counter.add,
+            )
+            for segment in ranges
+        ]
+        # Wait for every segment so progress is checkpointed before raising
+        errors = [future.exception() for future in futures]
+
+    for error in errors:
+        if error is not None:
+            raise error
+
+    remove_if_exists(state_file)
+
+    hasher = new_hasher(checksum)
+    if hasher:
+        hash_file(hasher, part)
+    verify_checksum(hasher, checksum, file_path)
+
+    return total_size
+
+
+def download_to_file(
+    url,
+    file_path,
+    auth=None,
+    segments=1,
+    timeout=DEFAULT_TIMEOUT,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    min_segment_size=MIN_SEGMENT_SIZE,
+    progress=None,
+    checksum=None,
+):
+    """Download ``url`` to ``file_path``, optionally as concurrent byte ranges.
+
+    With ``segments`` greater than 1 the server is probed with a one byte
+    ``Range`` request. If it answers 206 with a known total size, the file is
+    preallocated and the ranges are fetched concurrently. If the server ignores
+    ``Range`` (answers 200), the probe response is consumed as a regular single
+    stream so no extra request is made.
+
+    Data is written to ``<file_path>.part`` and renamed once complete. A
+    ``.part`` file left by an earlier attempt is resumed with a ``Range``
+    request instead of starting over.
+
+    Args:
+        url (str): Url of the resource to download.
+        file_path (str or Path): Destination file, replaced if it exists.
+        auth (tuple): Optional (username, password) for HTTP basic auth.
+        segments (int): Maximum number of concurrent byte ranges.
+        progress (callable): Optional ``progress(bytes_done, total_bytes)``,
+            ``total_bytes`` is None when the server does not report a size.
+        checksum (tuple): Optional (algorithm, hex digest), e.g.
+            ``("MD5", "0cc1...")``, verified before the file is renamed.
+
+    Returns:
+        int: Size of the downloaded file in bytes.
+
+    Raises:
+        DownloadError: The server responded with an unexpected status or the
+            transfer was cut short. The ``.part`` file is kept for resuming.
+        ChecksumMismatch: The downloaded bytes don't match ``checksum``. The
+            ``.part`` file is removed.
+    """
+    if segments > 1 or state_path(file_path).is_file():
+        size = download_segmented(
+            url,
+            file_path,
+            auth,
+            segments,
+            timeout,
+            chunk_size,
+            min_segment_size,
+            progress,
+            checksum,
+        )
+    else:
+        size = download_single(
+            url, file_path, auth, timeout, chunk_size, progress, checksum
+        )
+
+    os.replace(part_path(file_path), file_path)
+
+    return size
@@ -0,0 +1,146 @@
+"""Process wide pooled HTTP session shared by every downloader.
+
+Calling the module level ``requests.get`` opens a new connection, and with
+it a new TCP + TLS handshake, for every request. All downloaders in a process
+instead share one ``requests.Session`` whose adapters keep connections alive
+and bound how many connections are open to each host. Every response
+through them is recorded in ``metrics``.
+
+Hosts listed in ``host_limits`` get their own connection pool of that size
+which blocks, rather than opening extra connections, when it is exhausted.
+"""
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_POOL_CONNECTIONS = 10
+
+_lock = threading.Lock()
+_session = None
+_config = {
+    "pool_maxsize": DEFAULT_POOL_SIZE,
+    "pool_connections": DEFAULT_POOL_CONNECTIONS,
+    "host_limits": {},
+}
+# Other sessions (e.g. SentinelAPI's) that borrow the shared adapters
+_sharing_sessions = weakref.WeakSet()
+
+
+def build_adapters(pool_maxsize, pool_connections, host_limits):
+    """Return a dict of url prefix -> HTTPAdapter for the given pool settings."""
+    default_adapter = HTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize
+    )
+
+    adapters = {
+        "https://": default_adapter,
+        "http://": default_adapter,
+    }
+
+    for host, limit in host_limits.items():
+        host_adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=limit, pool_block=True
+        )
+        adapters[f"https://{host}/"] = host_adapter
+        adapters[f"http://{host}/"] = host_adapter
+
+    return adapters
+
+
+def mount_adapters(session, adapters):
+    for prefix, adapter in adapters.items():
+        session.mount(prefix, adapter)
+
+
+def add_metrics_hook(session):
+    hooks = session.hooks.setdefault("response", [])
+    if metrics.record_response not in hooks:
+        hooks.append(metrics.record_response)
+
+
+def get_session():
+    """Return the shared session, creating it on first use."""
+    global _session
+
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            mount_adapters(
+                session,
+                build_adapters(
+                    _config["pool_maxsize"],
+                    _config["pool_connections"],
+                    _config["host_limits"],
+                ),
+            )
+            add_metrics_hook(session)
+            _session = session
+
+        return _session
+
+
+def configure(pool_maxsize=None, pool_connections=None, host_limits=None):
+    """Change the pool settings of the shared session.
+
+    Settings equal to the current ones leave the pools, and their open
+    connections, as they are.
+
+    Args:
+        pool_maxsize (int): Connections kept alive per host without a limit.
+        pool_connections (int): Number of hosts to keep pools for.
+        host_limits (dict): Host name -> maximum concurrent connections,
+            e.g. ``{"scihub.copernicus.eu": 2}``.
+    """
+    with _lock:
+        config = dict(_config)
+        if pool_maxsize is not None:
+            config["pool_maxsize"] = pool_maxsize
+        if pool_connections is not None:
+            config["pool_connections"] = pool_connections
+        if host_limits is not None:
+            config["host_limits"] = dict(host_limits)
+
+        # Downloaders configure on every construction, rebuilding the
+        # adapters would drop the pooled keep-alive connections
+        if config == _config:
+            return
+        _config.update(config)
+
+        adapters = build_adapters(
+            _config["pool_maxsize"],
+            _config["pool_connections"],
+            _config["host_limits"],
+        )
+
+        # Remount in place so sessions already handed out pick up the change
+        sessions = list(_sharing_sessions)
+        if _session is not None:
+            sessions.append(_session)
+
+        for session in sessions:
+            # Drop host specific prefixes that are no longer configured
+            for prefix in list(session.adapters):
+                if prefix not in adapters and prefix not in ("https://", "http://"):
+                    del session.adapters[prefix]
+            mount_adapters(session, adapters)
+
+
+def share_adapters(session):
+    """Make ``session`` use the shared connection pools.
+
+    Used for sessions owned by other libraries, such as ``SentinelAPI.session``,
+    so their requests reuse the same keep-alive connections.
+    """
+    shared = get_session()
+
+    with _lock:
+        mount_adapters(session, dict(shared.adapters))
+        add_metrics_hook(session)
+        _sharing_sessions.add(session)
+
+    return session
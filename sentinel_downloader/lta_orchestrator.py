@@ -0,0 +1,250 @@
+"""Bring many offline products back from the Long Term Archive (LTA).
+
+Offline SciHub products have to be requested (``trigger_retrieval``) and then
+polled until they come online, and the hub only accepts a limited number of
+outstanding retrievals per user. ``LTAOrchestrator`` keeps that many in
+flight, checks the online state of every waiting product with one batched
+OData query per poll cycle, backs off exponentially between checks, and hands
+each product on as soon as it is online.
+"""
+import logging
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+TRIGGERED = "triggered"
+ONLINE = "online"
+FAILED = "failed"
+
+LTAReport = namedtuple("LTAReport", ["online", "failed", "triggered", "checks"])
+
+
+class LTARequest:
+    """Tracks one product through the retrieval states."""
+
+    def __init__(self, product):
+        self.product = product
+        self.product_id = product["uuid"]
+        self.state = QUEUED
+        # Next online check, and for queued products the earliest next trigger
+        self.next_check = 0.0
+        self.retry_at = 0.0
+        self.checks = 0
+        self.trigger_failures = 0
+        self.triggered_at = None
+
+
+class LTAOrchestrator:
+    """Trigger and poll LTA retrievals for a set of products.
+
+    Args:
+        s2_downloader (S2Downloader): Provides ``check_products_online``
+            and ``trigger_retrieval``.
+        on_online (callable): Called with each product record as it comes
+            online, e.g. ``lambda p: scheduler.add(p, dest_dir)``.
+        quota (int): Retrievals allowed in flight at once, the hub's
+            per-user LTA quota.
+        trigger_interval (float): Minimum seconds between two triggers.
+        initial_backoff (float): Seconds before a triggered product is first
+            checked again.
+        max_backoff (float): Upper bound on the seconds between checks.
+        backoff_factor (float): Growth of the delay after each check that
+            finds the product still offline.
+        quota_backoff (float): Seconds to stop triggering after the hub
+            reports the quota as exceeded.
+        max_trigger_failures (int): Failed triggers (other than quota) before
+            a product is given up on.
+    """
+
+    def __init__(
+        self,
+        s2_downloader,
+        on_online,
+        quota=20,
+        trigger_interval=1.0,
+        initial_backoff=60.0,
+        max_backoff=1800.0,
+        backoff_factor=2.0,
+        quota_backoff=600.0,
+        max_trigger_failures=3,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.s2_downloader = s2_downloader
+        self.on_online = on_online
+        self.quota = quota
+        self.trigger_interval = trigger_interval
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.backoff_factor = backoff_factor
+        self.quota_backoff = quota_backoff
+        self.max_trigger_failures = max_trigger_failures
+
+        self.clock = clock
+        self.sleep = sleep
+
+        self.requests = {}
+        self.last_trigger = None
+        self.triggers_paused_until = 0.0
+        self.total_checks = 0
+        self.total_triggers = 0
+
+    def add(self, products):
+        """Queue product records (``uuid`` is required) for retrieval."""
+        for product in products:
+            if product["uuid"] not in self.requests:
+                self.requests[product["uuid"]] = LTARequest(product)
+
+    def waiting(self):
+        return [
+            request
+            for request in self.requests.values()
+            if request.state in (QUEUED, TRIGGERED)
+        ]
+
+    def backoff(self, request):
+        delay = self.initial_backoff * self.backoff_factor ** max(0, request.checks - 1)
+        return min(delay, self.max_backoff)
+
+    def hand_off(self, request):
+        request.state = ONLINE
+        logger.info(f"{request.product_id} is online, handing off for download")
+        self.on_online(request.product)
+
+    def check_online(self, now):
+        """Check every product that is due in one batched query per batch size."""
+        due = [request for request in self.waiting() if request.next_check <= now]
+        if not due:
+            return
+
+        try:
+            online = self.s2_downloader.check_products_online(
+                [request.product_id for request in due]
+            )
+        except Exception as e:
+            logger.warning(f"Online check failed, retrying later: {e}")
+            for request in due:
+                request.next_check = now + self.initial_backoff
+            return
+
+        self.total_checks += 1
+
+        for request in due:
+            if online.get(request.product_id):
+                self.hand_off(request)
+            elif request.product_id not in online:
+                request.state = FAILED
+                logger.warning(f"{request.product_id} is not known to the hub")
+            else:
+                request.checks += 1
+                request.next_check = now + self.backoff(request)
+
+    def trigger(self, now):
+        """Trigger queued products while the quota and pacing allow."""
+        if now < self.triggers_paused_until:
+            return
+
+        in_flight = self.in_flight()
+
+        for request in self.waiting():
+            if request.state != QUEUED or request.retry_at > now:
+                continue
+            if in_flight >= self.quota:
+                return
+            if (
+                self.last_trigger is not None
+                and now - self.last_trigger < self.trigger_interval
+            ):
+                return
+
+            task_status = self.s2_downloader.trigger_retrieval(request.product_id)
+            self.last_trigger = now
+            self.total_triggers += 1
+
+            if task_status.data == 200:
+                self.hand_off(request)
+            elif task_status.status:
+                request.state = TRIGGERED
+                request.triggered_at = now
+                request.checks = 0
+                request.next_check = now + self.initial_backoff
+                in_flight += 1
+            elif task_status.data == 403:
+                logger.info(
+                    f"LTA quota reached with {in_flight} retrievals in flight, "
+                    f"pausing triggers for {self.quota_backoff:.0f}s"
+                )
+                self.triggers_paused_until = now + self.quota_backoff
+                return
+            else:
+                request.trigger_failures += 1
+                if request.trigger_failures >= self.max_trigger_failures:
+                    request.state = FAILED
+                    logger.error(
+                        f"Giving up on {request.product_id}: {task_status.message}"
+                    )
+                else:
+                    request.retry_at = now + self.initial_backoff * self.backoff_factor ** (
+                        request.trigger_failures - 1
+                    )
+
+    def poll_once(self):
+        """Run one cycle: batched online check, then triggers."""
+        now = self.clock()
+        self.check_online(now)
+        self.trigger(now)
+
+    def in_flight(self):
+        return sum(1 for r in self.requests.values() if r.state == TRIGGERED)
+
+    def next_wakeup(self, now):
+        waiting = self.waiting()
+        times = [request.next_check for request in waiting]
+
+        queued = [request.retry_at for request in waiting if request.state == QUEUED]
+        if queued and self.in_flight() < self.quota:
+            times.append(
+                max(
+                    min(queued),
+                    self.triggers_paused_until,
+                    (self.last_trigger or now) + self.trigger_interval,
+                )
+            )
+
+        return max(now, min(times)) if times else now
+
+    def run(self, products=None, timeout=None):
+        """Retrieve every queued product, returning an ``LTAReport``.
+
+        Products are first checked, online ones are handed off without a
+        trigger. Stops when every product is online or failed, or after
+        ``timeout`` seconds.
+        """
+        if products:
+            self.add(products)
+
+        start = self.clock()
+
+        while self.waiting():
+            self.poll_once()
+
+            now = self.clock()
+            if timeout is not None and now - start >= timeout:
+                logger.warning(f"{len(self.waiting())} products still offline at timeout")
+                break
+
+            if self.waiting():
+                self.sleep(max(0.0, self.next_wakeup(now) - now))
+
+        return self.report()
+
+    def report(self):
+        by_state = {state: [] for state in (QUEUED, TRIGGERED, ONLINE, FAILED)}
+        for request in self.requests.values():
+            by_state[request.state].append(request.product_id)
+
+        return LTAReport(
+            by_state[ONLINE], by_state[FAILED], self.total_triggers, self.total_checks
+        )
@@ -0,0 +1,451 @@
+"""Counters and histograms for HTTP requests, transfers and queries.
+
+Every request made through the shared session (``http_session``) records its
+status code and time to first byte, every streamed body its bytes, duration
+and throughput, and the search methods their latency and result counts. The
+values live in a process wide ``MetricsRegistry`` and are exported as
+Prometheus text (``serve_prometheus``) or dumped to a JSON file periodically
+(``MetricsReporter``), so slow mirrors and capacity limits show up per host.
+"""
+import bisect
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Only local scrapers by default, set METRICS_HOST to listen more widely
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+# Seconds, for request and query latencies
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Seconds, for whole transfers
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600)
+# Bytes per second
+THROUGHPUT_BUCKETS = tuple(
+    1024 ** 2 * mb for mb in (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+# Products returned by a query
+RESULT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class Counter:
+    """Monotonic count per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            return self.values.get(key, 0)
+
+    def samples(self):
+        """Yield (suffix, labels dict, value) for the Prometheus exposition."""
+        with self.lock:
+            values = dict(self.values)
+
+        for key, value in sorted(values.items()):
+            yield "_total", dict(zip(self.labelnames, key)), value
+
+    def to_dict(self):
+        with self.lock:
+            return [
+                {"labels": dict(zip(self.labelnames, key)), "value": value}
+                for key, value in sorted(self.values.items())
+            ]
+
+
+class Histogram:
+    """Observations counted into cumulative ``buckets``, with their sum and count."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per bucket counts (+Inf last), sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            entry = self.values.get(key)
+            return entry[2] if entry else 0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self.values.items()
+            }
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self.snapshot().items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                yield "_bucket", {**labels, "le": format_value(bound)}, cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+    def to_dict(self):
+        entries = []
+        for key, (counts, total, count) in sorted(self.snapshot().items()):
+            entries.append(
+                {
+                    "labels": dict(zip(self.labelnames, key)),
+                    "buckets": dict(
+                        zip([format_value(b) for b in self.buckets] + ["+Inf"], counts)
+                    ),
+                    "sum": total,
+                    "count": count,
+                }
+            )
+        return entries
+
+
+def format_value(value):
+    if isinstance(value, str):
+        return value
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """Named counters and histograms, created on first use."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def get_or_create(self, cls, name, help, labelnames, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.type}")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.get_or_create(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def collect(self):
+        with self.lock:
+            return sorted(self.metrics.values(), key=lambda metric: metric.name)
+
+    def clear(self):
+        with self.lock:
+            self.metrics.clear()
+
+    def render_prometheus(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.collect():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                label_text = ",".join(
+                    f'{name}="{escape_label(str(label))}"' for name, label in labels.items()
+                )
+                if label_text:
+                    label_text = "{" + label_text + "}"
+                lines.append(f"{metric.name}{suffix}{label_text} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        return {
+            "timestamp": time.time(),
+            "metrics": {
+                metric.name: {
+                    "type": metric.type,
+                    "help": metric.help,
+                    "values": metric.to_dict(),
+                }
+                for metric in self.collect()
+            },
+        }
+
+    def dump_json(self, file_path):
+        """Write ``to_dict()`` to ``file_path``, replacing it atomically."""
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, file_path)
+
+
+_default_registry = MetricsRegistry()
+
+
+def get_registry():
+    return _default_registry
+
+
+def host_of(url):
+    return urlsplit(url).netloc or "unknown"
+
+
+def record_response(r, *args, **kwargs):
+    """``requests`` response hook: status code, time to first byte and retries.
+
+    ``r.elapsed`` covers sending the request until the headers are parsed,
+    which for a streamed body is the time to first byte.
+    """
+    registry = get_registry()
+    host = host_of(r.url)
+    method = r.request.method if r.request is not None else "GET"
+
+    registry.counter(
+        "sentinel_http_requests",
+        "HTTP responses by host, method and status code",
+        ("host", "method", "status"),
+    ).inc(host=host, method=method, status=r.status_code)
+    registry.histogram(
+        "sentinel_http_time_to_first_byte_seconds",
+        "Seconds from sending a request until its response headers arrived",
+        ("host",),
+    ).observe(r.elapsed.total_seconds(), host=host)
+
+    retries = getattr(getattr(r.raw, "retries", None), "history", None)
+    if retries:
+        record_retry(host, len(retries))
+
+
+def record_retry(source, count=1):
+    """Count requests or downloads that had to be repeated, by host or source."""
+    get_registry().counter(
+        "sentinel_retries",
+        "Requests retried by urllib3 and downloads moved to another source",
+        ("source",),
+    ).inc(count, source=source)
+
+
+def record_transfer(url, nbytes, seconds):
+    """Record one streamed response body of ``nbytes`` read in ``seconds``."""
+    registry = get_registry()
+    host = host_of(url)
+
+    registry.counter(
+        "sentinel_transfer_bytes", "Bytes of response bodies written to disk", ("host",)
+    ).inc(nbytes, host=host)
+    registry.histogram(
+        "sentinel_transfer_seconds",
+        "Seconds spent streaming a response body",
+        ("host",),
+        buckets=DURATION_BUCKETS,
+    ).observe(seconds, host=host)
+    if seconds > 0 and nbytes:
+        registry.histogram(
+            "sentinel_transfer_throughput_bytes_per_second",
+            "Throughput of each streamed response body",
+            ("host",),
+            buckets=THROUGHPUT_BUCKETS,
+        ).observe(nbytes / seconds, host=host)
+
+
+def record_query(query, seconds, results=None, failed=False):
+    registry = get_registry()
+
+    registry.histogram(
+        "sentinel_query_seconds", "Seconds taken by a product search", ("query",)
+    ).observe(seconds, query=query)
+    if failed:
+        registry.counter(
+            "sentinel_query_errors", "Product searches that raised", ("query",)
+        ).inc(query=query)
+    elif results is not None:
+        registry.histogram(
+            "sentinel_query_results",
+            "Products returned by a search",
+            ("query",),
+            buckets=RESULT_BUCKETS,
+        ).observe(results, query=query)
+
+
+def timed_query(query):
+    """Decorate a search function to record its latency and number of results.
+
+    For a generator function the time until the generator is exhausted and
+    the number of items it yielded are recorded.
+    """
+
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                start = time.monotonic()
+                count = 0
+                try:
+                    for item in func(*args, **kwargs):
+                        count += 1
+                        yield item
+                except GeneratorExit:
+                    # Closed early by the consumer, not a failed search
+                    raise
+                except BaseException:
+                    record_query(query, time.monotonic() - start, failed=True)
+                    raise
+                record_query(query, time.monotonic() - start, count)
+
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                results = func(*args, **kwargs)
+            except BaseException:
+                record_query(query, time.monotonic() - start, failed=True)
+                raise
+
+            try:
+                count = len(results)
+            except TypeError:
+                count = None
+            record_query(query, time.monotonic() - start, count)
+            return results
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        registry = self.server.registry
+
+        if self.path.split("?")[0] == "/metrics":
+            body = registry.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path.split("?")[0] == "/metrics.json":
+            body = json.dumps(registry.to_dict()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_prometheus(port, host=DEFAULT_METRICS_HOST, registry=None):
+    """Serve ``/metrics`` (Prometheus text) and ``/metrics.json`` on a daemon thread.
+
+    Listens on the loopback interface unless ``host`` says otherwise, e.g.
+    ``0.0.0.0`` for every interface.
+
+    Returns:
+        (ThreadingHTTPServer): Call ``shutdown()`` on it to stop serving.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry or get_registry()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    logger.info(f"Serving metrics on {host}:{server.server_address[1]}/metrics")
+    return server
+
+
+class MetricsReporter:
+    """Dumps the registry to a JSON file every ``interval`` seconds."""
+
+    def __init__(self, file_path, interval=60.0, registry=None):
+        self.file_path = file_path
+        self.interval = interval
+        self.registry = registry or get_registry()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return self
+
+        self.stop_event.clear()
+
+        def dump_loop():
+            while not self.stop_event.wait(self.interval):
+                self.dump()
+
+        self.thread = threading.Thread(target=dump_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def dump(self):
+        try:
+            self.registry.dump_json(self.file_path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.file_path}: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        # Keep the final values
+        self.dump()
+
+
+_exporters_lock = threading.Lock()
+_exporters = {}
+
+
+def start_exporters(
+    port=None, json_path=None, json_interval=60.0, host=DEFAULT_METRICS_HOST
+):
+    """Start the Prometheus endpoint and/or the JSON reporter once per process."""
+    with _exporters_lock:
+        if port is not None and "prometheus" not in _exporters:
+            _exporters["prometheus"] = serve_prometheus(port, host=host)
+        if json_path and "json" not in _exporters:
+            _exporters["json"] = MetricsReporter(json_path, json_interval).start()
+
+        return dict(_exporters)
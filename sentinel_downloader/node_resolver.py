@@ -0,0 +1,141 @@
+"""Cached lookups in the OData Nodes tree of SciHub products.
+
+A product's SAFE structure never changes, yet finding a TCI or band image
+takes one ``Nodes`` request per folder level. ``NodeResolver`` keeps each
+listing in a ``NodeCache`` (time and size bounded, least recently used
+entries go first) so repeated lookups into the same product make no further
+requests, and parses the Atom feeds incrementally from the response stream.
+"""
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+NODE_NAME_RE = re.compile(r"Nodes\('([^']+)'\)$")
+
+
+class NodeCache:
+    """Thread-safe LRU mapping of node url -> children with a time to live.
+
+    Args:
+        ttl (float): Seconds a listing stays valid.
+        max_entries (int): Listings kept before the least recently used go.
+    """
+
+    def __init__(self, ttl=3600.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+_default_cache = NodeCache()
+
+
+def get_node_cache():
+    return _default_cache
+
+
+def parse_node_feed(stream):
+    """Return [(name, url)] for the entries of a Nodes Atom feed read from ``stream``."""
+    nodes = []
+
+    for _, entry in etree.iterparse(stream, events=("end",), tag=f"{ATOM}entry"):
+        entry_id = entry.find(f"{ATOM}id")
+        if entry_id is not None and entry_id.text:
+            url = entry_id.text.strip()
+            match = NODE_NAME_RE.search(url)
+            if match:
+                nodes.append((match.group(1), url))
+
+        # Entries are independent, drop each once read
+        entry.clear()
+        while entry.getprevious() is not None:
+            del entry.getparent()[0]
+
+    return nodes
+
+
+class NodeResolver:
+    """Lists and walks product Nodes through a shared ``NodeCache``.
+
+    Args:
+        session (requests.Session): Session used for the requests.
+        auth (tuple): (username, password) for the hub.
+        cache (NodeCache): Defaults to the process wide cache.
+    """
+
+    def __init__(self, session, auth, cache=None, timeout=2 * 60.0):
+        self.session = session
+        self.auth = auth
+        self.cache = cache if cache is not None else get_node_cache()
+        self.timeout = timeout
+
+    def children(self, node_url):
+        """Return [(name, url)] for the children of a ``Products('id')`` or
+        ``.../Nodes('name')`` url, from the cache when possible."""
+        nodes = self.cache.get(node_url)
+        if nodes is not None:
+            return nodes
+
+        r = self.session.get(
+            url=f"{node_url}/Nodes", auth=self.auth, stream=True, timeout=self.timeout
+        )
+        with r:
+            logger.debug(f"Nodes of {node_url}: status code {r.status_code}")
+            r.raise_for_status()
+            r.raw.decode_content = True
+            nodes = tuple(parse_node_feed(r.raw))
+
+        self.cache.put(node_url, nodes)
+        return nodes
+
+    def resolve(self, node_url, *names):
+        """Return the url of the node reached by following ``names`` from ``node_url``.
+
+        Each level is checked against its (cached) listing, so a missing
+        folder raises ``KeyError`` naming it.
+        """
+        for name in names:
+            children = dict(self.children(node_url))
+            if name not in children:
+                raise KeyError(f"{name} not found under {node_url}")
+            node_url = children[name]
+
+        return node_url
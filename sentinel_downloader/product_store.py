@@ -0,0 +1,334 @@
+"""Local store of downloaded product zips shared between jobs.
+
+Each job used to download into its own directory, so two jobs needing the same
+product fetched it twice. ``ProductStore`` keeps one copy of every product
+under a root directory, indexed in SQLite by product UUID and checksum, and
+materializes it into job directories as a reflink, hardlink or, failing
+both, a copy. The store is bounded in size and evicts least recently used
+products.
+
+Several processes can share a store: fetching a product and eviction hold
+``flock`` locks in the staging directory, so a product is downloaded once and
+never evicted while another process materializes it.
+"""
+import contextlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import defaultdict, namedtuple
+from pathlib import Path
+
+from .utils import TaskStatus
+
+logger = logging.getLogger(__name__)
+
+# linux/fs.h FICLONE, clones a file's extents on btrfs, xfs and similar
+FICLONE = 0x40049409
+
+StoredProduct = namedtuple(
+    "StoredProduct", ["uuid", "checksum", "path", "size", "last_used"]
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    uuid TEXT PRIMARY KEY,
+    checksum TEXT,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    added REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_checksum ON products (checksum);
+CREATE INDEX IF NOT EXISTS products_last_used ON products (last_used);
+"""
+
+
+def normalize_checksum(checksum):
+    """Accept an (algorithm, value) tuple or a plain value, return ``ALGO:value``."""
+    if checksum is None:
+        return None
+    if isinstance(checksum, (tuple, list)):
+        algorithm, value = checksum
+        return f"{algorithm.upper()}:{value.lower()}"
+    return checksum.lower()
+
+
+def reflink(src, dst):
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+@contextlib.contextmanager
+def file_lock(path, blocking=True, remove=False):
+    """Hold an exclusive ``flock`` on ``path``, yield whether it was taken.
+
+    With ``remove`` the file is deleted before the lock is released, so lock
+    files don't pile up. A lock taken on a file that has since been deleted
+    or replaced is dropped and taken again on the current one.
+
+    Without ``fcntl`` (Windows) nothing is locked and True is yielded.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield True
+        return
+
+    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+
+    while True:
+        f = open(path, "a")
+        try:
+            fcntl.flock(f.fileno(), flags)
+        except BlockingIOError:
+            f.close()
+            yield False
+            return
+
+        try:
+            current = os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            break
+        # Removed by the previous holder while we waited
+        f.close()
+
+    try:
+        yield True
+    finally:
+        if remove:
+            os.unlink(path)
+        f.close()
+
+
+def materialize(src, dst):
+    """Make ``dst`` a reflink, hardlink or copy of ``src``, return which one."""
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        reflink(src, dst)
+        return "reflink"
+    except (ImportError, OSError):
+        if dst.exists():
+            dst.unlink()
+
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+class ProductStore:
+    """Content-addressed store of product zips.
+
+    Args:
+        root (str): Directory holding the index, the products and staging
+            space for downloads in progress.
+        max_bytes (int): Evict least recently used products once the store
+            grows beyond this size. None for no limit.
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+        self.objects_dir = self.root / "objects"
+        self.staging_dir = self.root / "staging"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+
+        self.lock = threading.RLock()
+        # One download per product at a time, other callers wait for it. The
+        # thread locks order this process's callers, the file locks (see
+        # lock_path) other processes using the same root
+        self.product_locks = defaultdict(threading.Lock)
+
+        self.db = sqlite3.connect(
+            str(self.root / "index.sqlite"), check_same_thread=False, timeout=30
+        )
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def lock_path(self, uuid):
+        return self.staging_dir / f"{uuid}.lock"
+
+    @contextlib.contextmanager
+    def product_lock(self, uuid):
+        """Hold ``uuid``'s lock against other threads and processes."""
+        with self.product_locks[uuid], file_lock(self.lock_path(uuid), remove=True):
+            yield
+
+    def row_to_product(self, row):
+        uuid, checksum, path, size, last_used = row
+        return StoredProduct(uuid, checksum, self.root / path, size, last_used)
+
+    def get(self, uuid, checksum=None):
+        """Return the ``StoredProduct`` for ``uuid``, or one with ``checksum``.
+
+        Entries whose file has gone missing, or whose checksum differs from
+        the one given, are dropped and None is returned.
+        """
+        checksum = normalize_checksum(checksum)
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT uuid, checksum, path, size, last_used FROM products WHERE uuid = ?",
+                (uuid,),
+            ).fetchone()
+            if row is None and checksum:
+                row = self.db.execute(
+                    "SELECT uuid, checksum, path, size, last_used FROM products "
+                    "WHERE checksum = ?",
+                    (checksum,),
+                ).fetchone()
+            if row is None:
+                return None
+
+            product = self.row_to_product(row)
+            stale = not product.path.is_file() or (
+                checksum and product.checksum and product.checksum != checksum
+            )
+            if stale:
+                logger.warning(f"Dropping stale store entry for {product.uuid}")
+                self.remove(product.uuid)
+                return None
+
+            now = time.time()
+            self.db.execute(
+                "UPDATE products SET last_used = ? WHERE uuid = ?", (now, product.uuid)
+            )
+            self.db.commit()
+
+            return product._replace(last_used=now)
+
+    def add(self, uuid, file_path, checksum=None):
+        """Move a downloaded file into the store and return its ``StoredProduct``."""
+        file_path = Path(file_path)
+        relative = Path("objects", uuid, file_path.name)
+        stored = self.root / relative
+        stored.parent.mkdir(parents=True, exist_ok=True)
+
+        try:
+            os.replace(file_path, stored)
+        except OSError:
+            # Different filesystem
+            shutil.move(str(file_path), str(stored))
+
+        size = stored.stat().st_size
+        now = time.time()
+
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO products "
+                "(uuid, checksum, path, size, added, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (uuid, normalize_checksum(checksum), str(relative), size, now, now),
+            )
+            self.db.commit()
+
+        self.evict(keep=uuid)
+
+        return StoredProduct(uuid, normalize_checksum(checksum), stored, size, now)
+
+    def remove(self, uuid):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT path FROM products WHERE uuid = ?", (uuid,)
+            ).fetchone()
+            self.db.execute("DELETE FROM products WHERE uuid = ?", (uuid,))
+            self.db.commit()
+
+        if row is not None:
+            shutil.rmtree(self.root / Path(row[0]).parent, ignore_errors=True)
+
+    def total_size(self):
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM products").fetchone()[0]
+
+    def evict(self, keep=None):
+        """Remove least recently used products until the store fits ``max_bytes``.
+
+        Hardlinks already materialized in job directories keep their data.
+        Products being fetched, by any process, are skipped.
+        """
+        if self.max_bytes is None:
+            return []
+
+        evicted = []
+        with file_lock(self.staging_dir / "evict.lock"), self.lock:
+            total = self.total_size()
+            rows = self.db.execute(
+                "SELECT uuid, size FROM products ORDER BY last_used ASC"
+            ).fetchall()
+
+            for uuid, size in rows:
+                if total <= self.max_bytes:
+                    break
+                if uuid == keep:
+                    continue
+                with file_lock(self.lock_path(uuid), blocking=False, remove=True) as locked:
+                    if not locked:
+                        continue
+                    self.remove(uuid)
+                evicted.append(uuid)
+                total -= size
+
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} products from the store")
+
+        return evicted
+
+    def fetch(self, uuid, dest_path, download, checksum=None):
+        """Materialize product ``uuid`` at ``dest_path``, downloading it if needed.
+
+        Args:
+            uuid (str): Product UUID.
+            dest_path (str): Path the zip should appear at in the job directory.
+            download (callable): ``download(staging_path)`` fetches the zip to
+                ``staging_path`` and returns a ``TaskStatus``. Staging paths
+                are shared, so an interrupted download resumes from any job.
+            checksum: (algorithm, value) tuple or value, recorded with the
+                product and used to match existing entries.
+
+        Returns:
+            (TaskStatus): The download's failed status, or a successful one
+            whose data is ``dest_path``.
+        """
+        dest_path = Path(dest_path)
+
+        with contextlib.ExitStack() as locks:
+            locks.enter_context(self.product_lock(uuid))
+            product = self.get(uuid, checksum)
+            if product is not None and product.uuid != uuid:
+                # Matched by checksum, lock that product too so it can't be
+                # evicted while it is materialized
+                locks.enter_context(self.product_lock(product.uuid))
+                product = self.get(product.uuid, checksum)
+
+            if product is None:
+                staging_path = self.staging_dir / dest_path.name
+                task_status = download(staging_path)
+                if not task_status.status:
+                    return task_status
+                product = self.add(uuid, staging_path, checksum)
+            else:
+                logger.info(f"{uuid} found in the product store")
+
+            method = materialize(product.path, dest_path)
+
+        logger.debug(f"Materialized {uuid} at {dest_path} as a {method}")
+        return TaskStatus(True, "Download successful", str(dest_path))
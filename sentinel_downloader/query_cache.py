@@ -0,0 +1,289 @@
+"""Local SQLite cache of OpenSearch query results.
+
+Dashboards and schedulers repeat the same searches every few minutes, and
+each one used to go to SciHub. ``QueryCache`` stores every query (normalized
+with ``SentinelAPI.format_query``, so keyword order and date formats don't
+matter) with the products it returned. Within ``ttl`` a repeated query is
+answered locally. After that only products ingested since the newest one
+already cached are requested (an ``ingestiondate`` range added to the query)
+and merged in; a full refresh runs every ``full_refresh_interval`` to drop
+products the hub no longer returns. Queries with relative dates (``NOW-7DAYS``)
+are always refreshed in full, their window moves and products fall out of it.
+
+``CachingAPI`` wraps a ``SentinelAPI`` so its ``query`` goes through a cache.
+"""
+import datetime
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+from sentinelsat.sentinel import SentinelAPI
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 15 * 60.0
+DEFAULT_FULL_REFRESH_INTERVAL = 24 * 60 * 60.0
+
+CachedQuery = namedtuple(
+    "CachedQuery", ["key", "created", "synced", "max_ingestion", "product_count"]
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    key TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    synced REAL NOT NULL,
+    max_ingestion TEXT
+);
+CREATE TABLE IF NOT EXISTS query_products (
+    key TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (key, uuid)
+);
+CREATE TABLE IF NOT EXISTS products (
+    uuid TEXT PRIMARY KEY,
+    properties TEXT NOT NULL
+);
+"""
+
+DATETIME_KEY = "__datetime__"
+
+# Solr date math on NOW, e.g. NOW-7DAYS or NOW/DAY
+RELATIVE_DATE_RE = re.compile(r"NOW[-+/]")
+
+
+def encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {DATETIME_KEY: value.isoformat()}
+    raise TypeError(f"Can't store {type(value).__name__} in the query cache")
+
+
+def decode_value(obj):
+    if DATETIME_KEY in obj and len(obj) == 1:
+        return datetime.datetime.fromisoformat(obj[DATETIME_KEY])
+    return obj
+
+
+def query_key(order_by=None, limit=None, offset=0, **query_kwargs):
+    """Normalized form of a ``SentinelAPI.query`` call, used as the cache key."""
+    query = " ".join(SentinelAPI.format_query(**query_kwargs).split())
+    return json.dumps(
+        {"q": query, "order_by": order_by, "limit": limit, "offset": offset},
+        sort_keys=True,
+    )
+
+
+def newest_ingestion(products):
+    dates = [
+        properties["ingestiondate"]
+        for properties in products.values()
+        if isinstance(properties.get("ingestiondate"), datetime.datetime)
+    ]
+    return max(dates) if dates else None
+
+
+class QueryCache:
+    """Query -> products cache in an SQLite file.
+
+    Args:
+        path (str): SQLite database file, created if missing.
+        ttl (float): Seconds a result is served without asking the hub.
+        full_refresh_interval (float): Seconds after which a query is rerun
+            in full instead of incrementally.
+    """
+
+    def __init__(
+        self,
+        path,
+        ttl=DEFAULT_TTL,
+        full_refresh_interval=DEFAULT_FULL_REFRESH_INTERVAL,
+        clock=time.time,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.full_refresh_interval = full_refresh_interval
+        self.clock = clock
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+        self.hits = 0
+        self.refreshes = 0
+        self.misses = 0
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def lookup(self, key):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT key, created, synced, max_ingestion, "
+                "(SELECT COUNT(*) FROM query_products WHERE key = queries.key) "
+                "FROM queries WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        key, created, synced, max_ingestion, count = row
+        if max_ingestion is not None:
+            max_ingestion = datetime.datetime.fromisoformat(max_ingestion)
+        return CachedQuery(key, created, synced, max_ingestion, count)
+
+    def products(self, key):
+        """Cached products of ``key`` as an OrderedDict, in result order."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT p.uuid, p.properties FROM query_products q "
+                "JOIN products p ON p.uuid = q.uuid "
+                "WHERE q.key = ? ORDER BY q.position",
+                (key,),
+            ).fetchall()
+
+        return OrderedDict(
+            (uuid, json.loads(properties, object_hook=decode_value))
+            for uuid, properties in rows
+        )
+
+    def store(self, key, products, replace=True, created=None):
+        """Save ``products`` for ``key``, replacing or extending what was cached."""
+        now = self.clock()
+
+        with self.lock:
+            if replace:
+                self.db.execute("DELETE FROM query_products WHERE key = ?", (key,))
+                previous = None
+            else:
+                previous = self.lookup(key)
+
+            position = self.db.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM query_products WHERE key = ?",
+                (key,),
+            ).fetchone()[0]
+
+            for uuid, properties in products.items():
+                self.db.execute(
+                    "INSERT OR REPLACE INTO products (uuid, properties) VALUES (?, ?)",
+                    (uuid, json.dumps(properties, default=encode_value)),
+                )
+                inserted = self.db.execute(
+                    "INSERT OR IGNORE INTO query_products (key, uuid, position) "
+                    "VALUES (?, ?, ?)",
+                    (key, uuid, position),
+                ).rowcount
+                position += inserted
+
+            max_ingestion = newest_ingestion(products)
+            if previous is not None and previous.max_ingestion is not None:
+                max_ingestion = max(filter(None, [max_ingestion, previous.max_ingestion]))
+
+            if created is None:
+                created = now if previous is None else previous.created
+
+            self.db.execute(
+                "INSERT OR REPLACE INTO queries (key, created, synced, max_ingestion) "
+                "VALUES (?, ?, ?, ?)",
+                (key, created, now, max_ingestion.isoformat() if max_ingestion else None),
+            )
+            self.db.commit()
+
+    def invalidate(self, key=None):
+        """Forget one query, or every query when ``key`` is None."""
+        with self.lock:
+            if key is None:
+                self.db.execute("DELETE FROM query_products")
+                self.db.execute("DELETE FROM queries")
+            else:
+                self.db.execute("DELETE FROM query_products WHERE key = ?", (key,))
+                self.db.execute("DELETE FROM queries WHERE key = ?", (key,))
+            self.db.execute(
+                "DELETE FROM products WHERE uuid NOT IN (SELECT uuid FROM query_products)"
+            )
+            self.db.commit()
+
+    def query(self, api, **kwargs):
+        """``api.query(**kwargs)``, answered from the cache when possible."""
+        key = query_key(**kwargs)
+        cached = self.lookup(key)
+        now = self.clock()
+
+        if cached is not None and now - cached.synced < self.ttl:
+            self.hits += 1
+            logger.debug(f"Query cache hit for {key}")
+            return self.products(key)
+
+        incremental = (
+            cached is not None
+            and cached.max_ingestion is not None
+            and now - cached.created < self.full_refresh_interval
+            # The query can't be narrowed further if it already filters on it,
+            # and paging a narrowed query would return different pages
+            and not any(k.lower() == "ingestiondate" for k in kwargs)
+            and kwargs.get("limit") is None
+            and not kwargs.get("offset")
+            # Products older than a relative start date must be dropped
+            and not RELATIVE_DATE_RE.search(key)
+        )
+
+        if incremental:
+            self.refreshes += 1
+            logger.debug(f"Refreshing {key} with products since {cached.max_ingestion}")
+            new_products = api.query(
+                ingestiondate=(cached.max_ingestion, "NOW"), **kwargs
+            )
+            self.store(key, new_products, replace=False)
+        else:
+            self.misses += 1
+            products = api.query(**kwargs)
+            self.store(key, products, replace=True, created=now)
+
+        return self.products(key)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def open_query_cache(path, **kwargs):
+    """Return the process wide ``QueryCache`` for ``path``, opening it on first use.
+
+    Downloaders created per query (as ``api_wrapper`` does) share one
+    connection. ``kwargs`` update the settings of an already open cache.
+    """
+    path = Path(path).resolve()
+
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = QueryCache(path, **kwargs)
+        else:
+            for name, value in kwargs.items():
+                setattr(cache, name, value)
+        return cache
+
+
+class CachingAPI:
+    """A ``SentinelAPI`` whose ``query`` goes through a ``QueryCache``.
+
+    Every other attribute is the wrapped api's.
+    """
+
+    def __init__(self, api, cache):
+        self.api = api
+        self.cache = cache
+
+    def query(self, **kwargs):
+        return self.cache.query(self.api, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
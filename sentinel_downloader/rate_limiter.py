@@ -0,0 +1,60 @@
+"""Token bucket limiting how fast concurrent workers send requests to the hub.
+
+Running searches concurrently only helps up to the rate the hub tolerates
+from one account, beyond that it starts answering 429/503. A ``RateLimiter``
+shared by the workers hands out at most ``rate`` permits per second, allowing
+short bursts of ``burst`` permits after idle time.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Thread-safe token bucket.
+
+    Args:
+        rate (float): Permits added per second.
+        burst (int): Permits that can accumulate while idle.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+
+        self.tokens = float(self.burst)
+        self.last = clock()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+        """Block until a permit is available, return the seconds waited."""
+        waited = 0.0
+
+        while True:
+            with self.lock:
+                self.refill(self.clock())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+
+            self.sleep(wait)
+            waited += wait
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        pass
@@ -0,0 +1,209 @@
+"""Read members of a remote product zip without downloading all of it.
+
+A zip keeps its table of contents (the central directory) at the end of the
+file and every member can be located from it, so ``zipfile`` only needs a
+seekable file. ``HTTPRangeFile`` provides one over HTTP ``Range`` requests:
+the tail of the file is fetched once up front (covering the central
+directory of a SAFE product), and later reads fetch just the bytes of the
+members asked for. Inspecting ``manifest.safe`` or ``MTD_MSIL1C.xml`` costs
+kilobytes instead of the whole archive.
+"""
+import io
+import logging
+import shutil
+import zipfile
+from pathlib import Path
+
+from . import http_session
+from .http_download import DEFAULT_TIMEOUT, DownloadError, parse_content_range
+
+logger = logging.getLogger(__name__)
+
+# Enough for the end of central directory record and the central directory of
+# a typical SAFE product
+DEFAULT_TAIL_SIZE = 64 * 1024
+# Small reads (zipfile reads headers a few bytes at a time) are rounded up,
+# and the read ahead doubles while a member is read sequentially
+DEFAULT_READ_AHEAD = 64 * 1024
+MAX_READ_AHEAD = 8 * 1024 * 1024
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """Seekable, read only file over the body of ``url`` using Range requests.
+
+    Args:
+        url (str): Url of the file, the server must honour ``Range``.
+        auth (tuple): Optional (username, password).
+        session (requests.Session): Defaults to the shared session.
+        tail_size (int): Bytes fetched from the end of the file on open.
+        read_ahead (int): Minimum bytes fetched per request, doubled (up to
+            ``MAX_READ_AHEAD``) for each sequential request.
+    """
+
+    def __init__(
+        self,
+        url,
+        auth=None,
+        session=None,
+        tail_size=DEFAULT_TAIL_SIZE,
+        read_ahead=DEFAULT_READ_AHEAD,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        super().__init__()
+        self.url = url
+        self.auth = auth
+        self.session = session or http_session.get_session()
+        self.read_ahead = read_ahead
+        self.next_read_ahead = read_ahead
+        self.timeout = timeout
+
+        self.position = 0
+        self.requests = 0
+        self.bytes_fetched = 0
+
+        # A suffix range returns the tail and, in Content-Range, the size
+        start, data = self.fetch(f"bytes=-{tail_size}")
+        self.size = self.total
+        self.buffers = [(start, data)]
+
+    def fetch(self, byte_range):
+        r = self.session.get(
+            self.url,
+            headers={"Range": byte_range},
+            auth=self.auth,
+            stream=True,
+            timeout=self.timeout,
+        )
+        with r:
+            if r.status_code != 206:
+                raise DownloadError(
+                    f"{self.url} answered {byte_range} with {r.status_code}, "
+                    "byte ranges are required"
+                )
+
+            content_range = parse_content_range(r.headers.get("Content-Range"))
+            if content_range is None or content_range[2] is None:
+                raise DownloadError(f"{self.url} sent no usable Content-Range")
+
+            start, _, self.total = content_range
+            data = r.content
+
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        logger.debug(f"Fetched {byte_range} ({len(data)} bytes) of {self.url}")
+
+        return start, data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+
+        return self.position
+
+    def cached(self, start, end):
+        """Return bytes [start, end) if one buffer holds them, else None."""
+        for buffer_start, data in self.buffers:
+            if buffer_start <= start and end <= buffer_start + len(data):
+                return data[start - buffer_start : end - buffer_start]
+        return None
+
+    def readinto(self, b):
+        end = min(self.position + len(b), self.size)
+        if end <= self.position:
+            return 0
+
+        data = self.cached(self.position, end)
+        if data is None:
+            last_start, last_data = self.buffers[-1]
+            if self.position == last_start + len(last_data):
+                self.next_read_ahead = min(self.next_read_ahead * 2, MAX_READ_AHEAD)
+            else:
+                self.next_read_ahead = self.read_ahead
+
+            fetch_end = min(max(end, self.position + self.next_read_ahead), self.size)
+            start, fetched = self.fetch(f"bytes={self.position}-{fetch_end - 1}")
+            # Keep the tail (central directory) plus the latest read
+            self.buffers = [self.buffers[0], (start, fetched)]
+            data = fetched[: end - start]
+
+        n = len(data)
+        b[:n] = data
+        self.position += n
+        return n
+
+
+class RemoteZip:
+    """``zipfile.ZipFile`` over a remote zip, with helpers to find and extract members.
+
+    Usage::
+
+        with RemoteZip(url, auth=(user, password)) as remote:
+            manifest = remote.read(remote.find("manifest.safe"))
+    """
+
+    def __init__(self, url, auth=None, session=None, **kwargs):
+        self.file = HTTPRangeFile(url, auth=auth, session=session, **kwargs)
+        self.zip_file = zipfile.ZipFile(io.BufferedReader(self.file, buffer_size=8192))
+
+    def close(self):
+        self.zip_file.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def bytes_fetched(self):
+        return self.file.bytes_fetched
+
+    def namelist(self):
+        return self.zip_file.namelist()
+
+    def infolist(self):
+        return self.zip_file.infolist()
+
+    def find(self, name):
+        """Return the first member whose path ends with ``name``, or None."""
+        for member in self.namelist():
+            if member == name or member.endswith("/" + name):
+                return member
+        return None
+
+    def read(self, member):
+        return self.zip_file.read(member)
+
+    def extract(self, member, directory, flatten=False):
+        """Stream ``member`` into ``directory`` and return the written path.
+
+        The member's folders are kept unless ``flatten`` is True.
+        """
+        relative = Path(member).name if flatten else Path(member)
+        full_file_path = Path(directory, relative)
+
+        if Path(directory).resolve() not in full_file_path.resolve().parents:
+            raise ValueError(f"Member {member} would be written outside {directory}")
+
+        full_file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self.zip_file.open(member) as src, open(full_file_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+        return str(full_file_path)
@@ -1,14 +1,18 @@
-import requests
 import logging
 import os
 import json
 from typing import Dict, Tuple, List, Optional
 
 from pathlib import Path
+from urllib.parse import urlsplit
 import zipfile
 
 
-from utils import TaskStatus
+from .utils import TaskStatus
+from . import http_download
+from . import http_session
+from .download_scheduler import DownloadScheduler
+from .transfer_monitor import TransferMonitor
 
 import sentinel_downloader.s2_downloader as esa_downloader
 
@@ -37,36 +41,84 @@ class S1Downloader():
 
         self.esa_downloader = esa_downloader.S2Downloader(self.config_path)
 
+        self.session = http_session.get_session()
+
+        self.asf_url = 'https://datapool.asf.alaska.edu'
+
         if self.primary_dl_src == 'USGS_ASF':
             self.secondary_dl_src = 'ESA_SCIHUB'
         elif self.primary_dl_src == 'ESA_SCIHUB':
             self.secondary_dl_src = 'USGS_ASF'
 
-
-    def s1_download_wrapper(self, product: Dict, dest_dir: str) -> TaskStatus:
-        """Wraps primary dl funcs depending on configured download source.
+        # Bytes per second below which a transfer is abandoned for the other source
+        self.scheduler = DownloadScheduler(
+            self.download_sources(),
+            min_throughput=self.config['S1'].get('MIN_THROUGHPUT'),
+            throughput_grace=self.config['S1'].get('THROUGHPUT_GRACE', 30.0),
+            # Seconds before racing the other source against a lagging one
+            hedge_delay=self.config['S1'].get('HEDGE_DELAY'),
+        )
+
+    def download_sources(self):
+        """Source name -> download callable, primary source first."""
+        sources = {
+            'USGS_ASF': self.asf_download_zip,
+            'ESA_SCIHUB': self.esa_download_zip,
+        }
+
+        return {
+            name: sources[name]
+            for name in (self.primary_dl_src, self.secondary_dl_src)
+        }
+
+    def source_host(self, name):
+        """Host name the download source ``name`` transfers from."""
+        if name == 'USGS_ASF':
+            return urlsplit(self.asf_url).hostname
+        return urlsplit(self.esa_downloader.copernicus_url).hostname
+
+    def s1_download_wrapper(
+        self, product: Dict, dest_dir: str, host_slot=None, priority=0
+    ) -> TaskStatus:
+        """Download a product from the healthiest source, failing over to the other.
+
+        The configured primary source is tried first until the scheduler has
+        measured both, after which the faster, more reliable one is preferred.
+        Products go through the scheduler's queue, with concurrent callers
+        lower ``priority`` values are downloaded first.
+
+        ``host_slot(host)``, if given, returns a context manager held around
+        every attempt on that host, so failover and hedged transfers count
+        against the concurrency limit of the host they actually use.
         """
-
+        logger = logging.getLogger(__name__)
 
         # Check if download already exists
         if Path(dest_dir, product['name'] + '.zip').is_file():
-            print(Path(dest_dir, product['name'] + '.zip'))
-
-
             return TaskStatus(True, f'Product zip already exists in dest dir {product["name"]}', None)
 
-        print(self.primary_dl_src)
+        source_slot = None
+        if host_slot is not None:
+            def source_slot(name):
+                return host_slot(self.source_host(name))
 
-        if self.primary_dl_src == 'USGS_ASF':
-            result = self.asf_download_zip(product, dest_dir)
+        result = self.scheduler.submit(
+            product, dest_dir, priority=priority, source_slot=source_slot
+        )
 
-        elif self.primary_dl_src == 'ESA_SCIHUB':
-            result = self.esa_downloader.download_product(product, dest_dir)
+        if result.source is not None:
+            logger.info(f'Downloaded {product["name"]} from {result.source}')
 
-        return result
+        return result.task_status
 
+    def esa_download_zip(self, product: Dict, download_folder: str, progress=None) -> TaskStatus:
+        """Download the product zip from SciHub."""
 
-    def asf_download_zip(self, product: Dict, download_folder: str) -> TaskStatus:
+        return self.esa_downloader.download_fullproduct(
+            product['uuid'], product['name'], download_folder, progress=progress
+        )
+
+    def asf_download_zip(self, product: Dict, download_folder: str, progress=None) -> TaskStatus:
         """ Uses ASF (Alaska Satellite Facility) to download S1 data products
 
             The ASF download procedure is very simple: create a URL from the
@@ -81,11 +133,14 @@ class S1Downloader():
 
             # Product name with zip concat to  it
 
+            ``progress(bytes_done, total_bytes)`` is called as the transfer
+            advances, an exception raised from it aborts the download.
+
         """
 
         logger = logging.getLogger(__name__)
 
-        download_baseurl = 'https://datapool.asf.alaska.edu'
+        download_baseurl = self.asf_url
 
         p_type = product['product_type']
         p_format = product['detailed_metadata']['format']
@@ -126,46 +181,94 @@ class S1Downloader():
         USERNAME = self.asf_username
         PASSWORD = self.asf_password
 
-        print(download_url)
+        logger.debug(f'Requesting {download_url}')
 
-        init_resp = requests.get(download_url)
-        data_resp = requests.get(init_resp.url, stream=True, auth=(USERNAME, PASSWORD))
+        # The first request only follows the redirects to the login, the second
+        # one authenticates there and streams the product
+        with self.session.get(download_url, timeout=http_download.DEFAULT_TIMEOUT) as init_resp:
+            auth_url = init_resp.url
 
-        result_status = None
-
-        if data_resp.status_code == 200:
-            # Success! we have initialized correctly and can now make a request to
-            # the TRUE url, which will allow us to authenticate and download the product
+        data_resp = self.session.get(
+            auth_url, stream=True, auth=(USERNAME, PASSWORD), timeout=http_download.DEFAULT_TIMEOUT
+        )
 
-            # Size of file to download and write at a time, bigger chunks = more memory used
-            chunk_size = 1024 * 1024
+        result_status = None
 
-            FILENAME = os.path.join(download_folder, product_name)
-            try:
-                with open(FILENAME, 'wb') as fd:
-                    logger.debug('Starting sentinel1 download...')
+        with data_resp:
+            if data_resp.status_code == 200:
+                # Success! we have initialized correctly and can now make a request to
+                # the TRUE url, which will allow us to authenticate and download the product
+
+                # Size of file to download and write at a time, bigger chunks = more memory used
+                chunk_size = 1024 * 1024
+
+                FILENAME = os.path.join(download_folder, product_name)
+                # Separate from the SciHub .part so a failover never mixes the two
+                part_file = FILENAME + '.asf.part'
+                content_length = data_resp.headers.get('Content-Length')
+                total = int(content_length) if content_length else None
+                transfer = TransferMonitor(FILENAME, product['name'], total)
+
+                def on_chunk(nbytes):
+                    transfer.update(nbytes)
+                    if progress:
+                        progress(transfer.bytes_transferred, total)
+
+                if progress:
+                    # Starting point, as http_download.ProgressCounter reports it
+                    progress(0, total)
+
+                try:
+                    with open(part_file, 'wb') as fd:
+                        logger.debug('Starting sentinel1 download...')
+
+                        written = http_download.stream_response_to_file(
+                            data_resp, fd, chunk_size, on_chunk
+                        )
+
+                    if total is not None and written != total:
+                        raise http_download.DownloadError(
+                            f'Transfer ended early, {written} of {total} bytes on disk'
+                        )
+
+                    os.replace(part_file, FILENAME)
+                except BaseException as e:
+                    logger.critical('Unknown error occured while trying to download, {}'.format(e))
+                    http_download.remove_if_exists(part_file)
+                    result_status = TaskStatus(False, 'An exception occured while trying to download.', e)
+                else:
+                    logger.debug('Finished s1 download for product {}'.format(product_name))
+                    result_status = TaskStatus(True, 'Download successful', FILENAME)
+                finally:
+                    transfer.finish()
+
+            elif data_resp.status_code == 404:
+                logger.critical('The supplied product url cannot be found')
+                result_status = TaskStatus(False, 'The supplied product URL cannot be found.', None)
+            elif data_resp.status_code == 401:
+                logger.critical('Problem with authenication')
+                result_status = TaskStatus(False, 'Problem with authentication', None)
+            else:
+                logger.critical('Unkown status code, failure {}'.format(data_resp.status_code))
+                result_status = TaskStatus(False, f'Unknown status code ({data_resp.status_code}) failure.', None)
 
-                    for chunk in data_resp.iter_content(chunk_size):
-                        logger.debug('Writing chunk of file to disk... ')
-                        fd.write(chunk)
-            except BaseException as e:
-                logger.critical('Unknown error occured while trying to download, {}'.format(e))
+        return result_status
 
-            logger.debug('Finished s1 download for product {}'.format(product_name))
+    def list_remote_zip(self, product: Dict) -> TaskStatus:
+        """List the members of a product zip on SciHub without downloading it.
 
-            result_status = TaskStatus(True, None, None)
+        Only the zip's central directory is fetched, see ``remote_zip``.
+        """
+        logger = logging.getLogger(__name__)
 
-        elif data_resp.status_code == 404:
-            logger.critical('The supplied product url cannot be found')
-            result_status = TaskStatus(False, 'The supplied product URL cannot be found.', None)
-        elif data_resp.status_code == 401:
-            logger.critical('Problem with authenication')
-            result_status = TaskStatus(False, 'Problem with authentication', None)
-        else:
-            logger.critical('Unkown status code, failure {}'.format(data_resp.status_code))
-            result_status = TaskStatus(False, f'Unknown status code ({data_resp.status_code}) failure.', None)
+        try:
+            with self.esa_downloader.open_remote_zip(product['uuid']) as remote:
+                members = [info.filename for info in remote.infolist() if not info.is_dir()]
+        except BaseException as e:
+            logger.error(f'Could not list remote zip of {product["name"]}: {e}')
+            return TaskStatus(False, 'Could not read remote zip', str(e))
 
-        return result_status
+        return TaskStatus(True, None, members)
 
     def validate_zip(self, product_name, path_to_zip):
 
@@ -13,28 +13,91 @@ import requests
 from requests.auth import HTTPBasicAuth
 
 import collections
+import functools
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from .transfer_monitor import TransferMonitor
+from . import http_download
+from . import http_session
+from . import metrics
+from . import search_batch
+from .footprint_index import open_footprint_index
+from .node_resolver import NodeResolver
+from .product_store import ProductStore
+from .query_cache import CachingAPI, open_query_cache
+from .rate_limiter import RateLimiter
+from .remote_zip import RemoteZip
+from .search_batch import BatchedSearch, PagedAPI, iter_query_pages, tile_clause
 
 from .utils import TaskStatus, ConfigFileProblem, ConfigValueMissing
 
 from collections import OrderedDict
-from lxml import etree
 from pathlib import Path
 
 import logging
 import yaml
 import math
+import re
+
+PRODUCT_VALUE_URL_RE = re.compile(r"Products\('([^']+)'\)/\$value$")
+
+DEFAULT_HUB_URL = "https://scihub.copernicus.eu/dhus"
+
+# Ids per OData $filter query when checking whether products are online
+ONLINE_CHECK_BATCH_SIZE = 50
+
+# Tiles OR'd into one search query, the rest of the query length is left for
+# the date and product type terms
+TILE_QUERY_GROUP_SIZE = 50
+TILE_QUERY_LENGTH_RATIO = 0.8
+# Search requests per second (and burst) allowed to the hub
+DEFAULT_SEARCH_RATE = 2.0
+
+# Native resolution (m) of each band, used when a band is requested without one
+BAND_RESOLUTIONS = {
+    "B01": 60,
+    "B02": 10,
+    "B03": 10,
+    "B04": 10,
+    "B05": 20,
+    "B06": 20,
+    "B07": 20,
+    "B08": 10,
+    "B8A": 20,
+    "B09": 60,
+    "B10": 60,
+    "B11": 20,
+    "B12": 20,
+    "AOT": 10,
+    "WVP": 10,
+    "TCI": 10,
+    "SCL": 20,
+}
 
 
 class S2Downloader:
-    def __init__(self, path_to_config="config.yaml", username=None, password=None):
+    def __init__(
+        self, path_to_config="config.yaml", username=None, password=None, hub_url=None
+    ):
 
         # create logger
         self.logger = logging.getLogger(__name__)
 
         user_n = None
         pass_w = None
+        config_hub_url = None
+
+        self.download_segments = 1
+        self.verify_checksums = True
+        # Shared local copy of downloaded products, see product_store
+        self.product_store = None
+        self.search_rate = DEFAULT_SEARCH_RATE
+        # Local cache of search results, see query_cache
+        self.query_cache = None
+        # Local index of AOI search results, see footprint_index
+        self.footprint_index = None
+        self.search_concurrency = search_batch.DEFAULT_CONCURRENCY
 
         if username and password:
             user_n = username
@@ -81,6 +144,63 @@ class S2Downloader:
             user_n = config["ESA_SCIHUB_USER"]
             pass_w = config["ESA_SCIHUB_PASS"]
 
+            # Number of concurrent byte ranges used for full product downloads
+            self.download_segments = int(config.get("DOWNLOAD_SEGMENTS", 1))
+            self.verify_checksums = bool(config.get("VERIFY_CHECKSUMS", True))
+            if config.get("QUERY_CACHE_PATH"):
+                cache_kwargs = {}
+                if "QUERY_CACHE_TTL" in config:
+                    cache_kwargs["ttl"] = float(config["QUERY_CACHE_TTL"])
+                if "QUERY_CACHE_FULL_REFRESH" in config:
+                    cache_kwargs["full_refresh_interval"] = float(
+                        config["QUERY_CACHE_FULL_REFRESH"]
+                    )
+                self.query_cache = open_query_cache(
+                    config["QUERY_CACHE_PATH"], **cache_kwargs
+                )
+
+            if config.get("FOOTPRINT_INDEX_PATH"):
+                index_kwargs = {}
+                if "FOOTPRINT_INDEX_SETTLE" in config:
+                    index_kwargs["settle"] = float(config["FOOTPRINT_INDEX_SETTLE"])
+                if "FOOTPRINT_INDEX_COVERAGE_TTL" in config:
+                    index_kwargs["coverage_ttl"] = float(
+                        config["FOOTPRINT_INDEX_COVERAGE_TTL"]
+                    )
+                self.footprint_index = open_footprint_index(
+                    config["FOOTPRINT_INDEX_PATH"], **index_kwargs
+                )
+
+            # Rate limit and concurrency of batched searches
+            self.search_rate = float(config.get("SEARCH_RATE", self.search_rate))
+            self.search_concurrency = int(
+                config.get("SEARCH_CONCURRENCY", self.search_concurrency)
+            )
+            # Another DHuS instance, or a local stand-in for testing
+            config_hub_url = config.get("ESA_SCIHUB_URL")
+
+            if config.get("PRODUCT_STORE_DIR"):
+                max_gb = config.get("PRODUCT_STORE_MAX_GB")
+                self.product_store = ProductStore(
+                    config["PRODUCT_STORE_DIR"],
+                    max_bytes=int(max_gb * 1024 ** 3) if max_gb else None,
+                )
+
+            # Prometheus endpoint and/or periodic JSON dump of the metrics
+            if config.get("METRICS_PORT") or config.get("METRICS_JSON_PATH"):
+                metrics.start_exporters(
+                    port=config.get("METRICS_PORT"),
+                    host=config.get("METRICS_HOST", metrics.DEFAULT_METRICS_HOST),
+                    json_path=config.get("METRICS_JSON_PATH"),
+                    json_interval=config.get("METRICS_JSON_INTERVAL", 60.0),
+                )
+
+            if "HTTP_POOL_SIZE" in config or "HTTP_HOST_LIMITS" in config:
+                http_session.configure(
+                    pool_maxsize=config.get("HTTP_POOL_SIZE"),
+                    host_limits=config.get("HTTP_HOST_LIMITS"),
+                )
+
         self.username = user_n
         self.password = pass_w
 
@@ -88,25 +208,84 @@ class S2Downloader:
             self.logger.error("Missing auth env vars, MISSING USERNAME OR PASSWORD")
             raise ConfigValueMissing
 
-        self.copernicus_url = "https://scihub.copernicus.eu/dhus"
+        self.copernicus_url = (hub_url or config_hub_url or DEFAULT_HUB_URL).rstrip("/")
 
         self.api = SentinelAPI(
             self.username,
             self.password,
-            "https://scihub.copernicus.eu/dhus",
+            self.copernicus_url,
             show_progressbars=True,
         )
 
+        # Keep-alive connection pools shared by every downloader in the process
+        self.session = http_session.get_session()
+        http_session.share_adapters(self.api.session)
+
+        # Shared by every batched search of this downloader
+        self.search_rate_limiter = RateLimiter(
+            self.search_rate, burst=self.search_concurrency
+        )
+
+        # Nodes listings are cached process wide, repeated lookups are free
+        self.node_resolver = NodeResolver(self.session, (self.username, self.password))
+
     def __del__(self):
         pass
 
+    @property
+    def search_api(self):
+        """The api searches go through, answered from ``query_cache`` when set."""
+        if self.query_cache is None:
+            return self.api
+        return CachingAPI(self.api, self.query_cache)
+
     def get_product_info(self, product_id, full=True):
         product_data = self.api.get_product_odata(product_id, full=full)
         return product_data
 
+    def get_product_checksum(self, product_id):
+        """Return the (algorithm, hex digest) OData Checksum of a product.
+
+        Returns None when checksum verification is disabled or the checksum
+        can't be retrieved, in which case the download goes ahead unverified.
+        """
+        if not self.verify_checksums:
+            return None
+
+        url = f"{self.copernicus_url}/odata/v1/Products('{product_id}')?$format=json"
+
+        try:
+            r = self.session.get(
+                url=url, auth=(self.username, self.password), timeout=2 * 60.0
+            )
+            r.raise_for_status()
+            checksum = r.json()["d"]["Checksum"]
+        except Exception as e:
+            self.logger.warning(f"Could not get checksum for {product_id}: {e}")
+            return None
+
+        return checksum["Algorithm"], checksum["Value"]
+
     def search_for_products(
         self, dataset_name, polygon, query_dict, just_entity_ids=False
     ):
+        results = OrderedDict(
+            self.iter_products(dataset_name, polygon, query_dict, ordered=True)
+        )
+        self.logger.info(f"Query returned {len(results)} products")
+
+        return results
+
+    @metrics.timed_query("search_for_products")
+    def iter_products(self, dataset_name, polygon, query_dict, ordered=False):
+        """``search_for_products`` yielding (uuid, properties) one at a time.
+
+        Products are yielded as their result page arrives, in page order when
+        ``ordered`` is True, so a consumer never holds the whole result set.
+        With a ``footprint_index`` only the parts of the polygon and date range
+        not searched before go to the hub, products are then yielded from the
+        index in sensing order.
+        """
         self.logger.info(f"Searching for products using {query_dict}")
         producttype = None
         filename = None
@@ -125,7 +304,7 @@ class S2Downloader:
             f"product type: {producttype}, filename: {filename}, sensormode: {sensormode}"
         )
 
-        results = self.api.query(
+        query_kwargs = dict(
             area=polygon,
             filename=filename,
             producttype=producttype,
@@ -134,13 +313,27 @@ class S2Downloader:
             area_relation="Intersects",
             platformname=dataset_name,
         )
-        self.logger.info(f"Query results: {results}")
 
-        return results
+        if self.footprint_index is not None:
+            yield from self.footprint_index.query(
+                functools.partial(self.iter_query, ordered=ordered), **query_kwargs
+            )
+        else:
+            yield from self.iter_query(ordered=ordered, **query_kwargs)
 
     def search_for_products_by_name(
         self, dataset_name, names, query_dict, just_entity_ids=False
     ):
+        results = OrderedDict(
+            self.iter_products_by_name(dataset_name, names, query_dict, ordered=True)
+        )
+        self.logger.info(f"Query returned {len(results)} products")
+
+        return results
+
+    @metrics.timed_query("search_for_products_by_name")
+    def iter_products_by_name(self, dataset_name, names, query_dict, ordered=False):
+        """``search_for_products_by_name`` yielding (uuid, properties) one at a time."""
         self.logger.info(f"Searching for products by name using query {query_dict}")
         producttype = None
         filename = None
@@ -168,26 +361,64 @@ class S2Downloader:
             else:
                 names_formatted_for_search.append(f"(filename:{name}*)")
 
-        names_raw_query_str = " or ".join(names_formatted_for_search)
-
-        self.logger.info(f"Raw query string: {names_raw_query_str}")
         self.logger.info(f"Dataset name: {dataset_name}")
 
-        results = collections.OrderedDict([])
-        for name in names:
-            result = self.api.query(raw=name)
-            results.update(result)
+        # One OR'd query per batch of names instead of a query per name
+        yield from self.batched_search().iter_query(
+            names_formatted_for_search, ordered=ordered
+        )
 
-        self.logger.info(f"Query results: {results}")
+    def iter_query(self, ordered=False, **query_kwargs):
+        """Yield (uuid, properties) for a ``SentinelAPI.query`` as pages arrive.
 
-        return results
+        Pages after the first are fetched concurrently under the search rate
+        limit (see ``search_batch.iter_query_pages``), in page order when
+        ``ordered`` is True. With a ``query_cache`` the cached results are
+        yielded instead, misses and refreshes still load their pages
+        concurrently but are yielded once complete.
+        """
+        if self.query_cache is not None:
+            paged_api = PagedAPI(
+                self.api,
+                rate_limiter=self.search_rate_limiter,
+                concurrency=self.search_concurrency,
+            )
+            yield from self.query_cache.query(paged_api, **query_kwargs).items()
+            return
+
+        yield from iter_query_pages(
+            self.api,
+            rate_limiter=self.search_rate_limiter,
+            concurrency=self.search_concurrency,
+            ordered=ordered,
+            **query_kwargs,
+        )
+
+    def batched_search(self, **kwargs):
+        """Return a ``BatchedSearch`` over this downloader's api and rate limit."""
+        kwargs.setdefault("concurrency", self.search_concurrency)
+        return BatchedSearch(self.search_api, rate_limiter=self.search_rate_limiter, **kwargs)
 
     def search_for_products_by_tile(
         self, tiles, date_range, just_entity_ids=False, product_type=None
     ):
 
-        products = OrderedDict([])
+        products = OrderedDict(
+            self.iter_products_by_tile(tiles, date_range, product_type=product_type)
+        )
+
+        self.logger.info(f"Products found when searching by tile: {len(products)}")
 
+        return products
+
+    @metrics.timed_query("search_for_products_by_tile")
+    def iter_products_by_tile(self, tiles, date_range, product_type=None):
+        """Yield (uuid, properties) for the products of many tiles as they are found.
+
+        Tiles are OR'd into groups of ``TILE_QUERY_GROUP_SIZE``, the groups are
+        searched concurrently under the downloader's search rate limit, and
+        each product is yielded once.
+        """
         query_kwargs = {
             "platformname": "Sentinel-2",
             "date": (date_range[0], date_range[1]),
@@ -199,22 +430,30 @@ class S2Downloader:
         elif product_type == "L2A":
             query_kwargs["producttype"] = "S2MSI2A"
 
-        for tile in tiles:
-            kw = query_kwargs.copy()
-            kw["filename"] = f"*_T{tile}_*"  # products after 2017-03-31
-            pp = self.api.query(**kw)
-            products.update(pp)
+        search = self.batched_search(
+            max_clauses=TILE_QUERY_GROUP_SIZE, max_length_ratio=TILE_QUERY_LENGTH_RATIO
+        )
+        clauses = [tile_clause(tile) for tile in dict.fromkeys(tiles)]
 
-        for prod in products:
-            products[prod]["api_source"] = "esa_scihub"
+        for uuid, properties in search.iter_query(clauses, **query_kwargs):
+            properties["api_source"] = "esa_scihub"
+            yield uuid, properties
 
-        self.logger.info(f"Products found when searching by tile: {products}")
+    def search_for_products_by_footprint(self, wkt, date_range, product_type=None):
+        products = OrderedDict(
+            self.iter_products_by_footprint(
+                wkt, date_range, product_type=product_type, ordered=True
+            )
+        )
 
-        return products
+        self.logger.info(f"Products found when searching by footprint: {len(products)}")
 
-    def search_for_products_by_footprint(self, wkt, date_range, product_type=None):
-        products = OrderedDict([])
+        return products
 
+    @metrics.timed_query("search_for_products_by_footprint")
+    def iter_products_by_footprint(self, wkt, date_range, product_type=None, ordered=False):
+        """Yield (uuid, properties) for the products intersecting ``wkt`` as
+        result pages arrive, in page order when ``ordered`` is True."""
         query_kwargs = {
             "footprint": wkt,
             "platformname": "Sentinel-2",
@@ -236,14 +475,9 @@ class S2Downloader:
             f" AND ( (platformname:Sentinel-2) AND (producttype:{product_type_string}))"
         )
 
-        products = self.api.query(raw=raw)
-
-        for prod in products:
-            products[prod]["api_source"] = "esa_scihub"
-
-        self.logger.info(f"Products found when searching by tile: {products}")
-
-        return products
+        for uuid, properties in self.iter_query(ordered=ordered, raw=raw):
+            properties["api_source"] = "esa_scihub"
+            yield uuid, properties
 
     def get_esa_product_name(
         self, platformname, relative_orbit_number, filename_query, sensingdate
@@ -337,141 +571,346 @@ class S2Downloader:
         pass
 
     def build_download_url(self, tile_id):
-        url = f"https://scihub.copernicus.eu/dhus/odata/v1/Products('{tile_id}')/Nodes"
+        """Return the ``$value`` url of the TCI image of a L1C product.
+
+        The product and granule names come from the cached Nodes listings, so
+        only the first lookup for a product costs any requests.
+        """
         # https://scihub.copernicus.eu/dhus/odata/v1/Products('a8f318d3-b95f-44f6-aa7e-bccbe4b00c4f')/
         # Nodes('S2B_MSIL1C_20190628T182929_N0207_R027_T12UUA_20190628T221748.SAFE')/
         # Nodes('GRANULE')/
         # Nodes('L1C_T12UUA_A012065_20190628T183312')/
         # Nodes('IMG_DATA')/Nodes
-        r = requests.get(url=url, auth=(self.username, self.password), timeout=2 * 60.0)
-        self.logger.info(
-            f"Status code: {r.status_code}, content: {r.content}, text: {r.text}"
-        )
+        product_url = f"{self.copernicus_url}/odata/v1/Products('{tile_id}')"
 
-        XHTML_NAMESPACE = "http://www.w3.org/2005/Atom"
-        XHTML = "{%s}" % XHTML_NAMESPACE
+        product_name, product_node_url = self.node_resolver.children(product_url)[0]
+        self.logger.debug(f"Product name: {product_name}")
 
-        NSMAP = {None: XHTML_NAMESPACE}  # the default namespace (no prefix)
+        granule_name, granule_url = self.node_resolver.children(
+            f"{product_node_url}/Nodes('GRANULE')"
+        )[0]
+        self.logger.info(f"Granule name: {granule_name}")
 
-        # xhtml = etree.Element(XHTML + "html", nsmap=NSMAP)  #
-        xml = r.text.encode("utf-8")
-        parser = etree.XMLParser(ns_clean=True, recover=True, encoding="utf-8")
-        h = etree.fromstring(xml, parser=parser)
+        # 'T12UXA_20190620T181921_TCI.jp2' L1C_T12UXA_A020859_20190620T182912  S2A_MSIL1C_20190620T181921_N0207_R127_T12UXA_20190620T231306.SAFE
+        tci_name = f"{granule_name.split('_')[1]}_{product_name.split('_')[2]}_TCI.jp2"
+        next_url = f"{granule_url}/Nodes('IMG_DATA')/Nodes('{tci_name}')/$value"
+
+        return next_url
 
-        result = h.find("entry/id", h.nsmap)
-        self.logger.debug(f"xml text: {result.text}")
+    def list_nodes(self, node_url):
+        """Return [(name, url)] for the children of an OData node.
 
-        product_name = result.text.split("/")[-1][7:-2]
-        self.logger.debug(f"Product name: {product_name}")
+        ``node_url`` is a ``Products('id')`` or ``.../Nodes('name')`` url, the
+        returned urls have the same form so they can be listed in turn or
+        fetched with ``/$value``. Listings are cached by ``node_resolver``.
+        """
+        return self.node_resolver.children(node_url)
 
-        next_url = f"{result.text}/Nodes('GRANULE')/Nodes"
+    def resolve_band_nodes(self, product_id, bands):
+        """Find the image files for ``bands`` in a product's SAFE tree.
 
-        next_r = requests.get(
-            url=next_url, auth=(self.username, self.password), timeout=2 * 60
+        Args:
+            product_id (str): Product UUID.
+            bands (list): Band names (``"B04"``, ``"SCL"``) or (band,
+                resolution in m) tuples. L2A products hold each band at
+                several resolutions, a band without one uses its native
+                resolution. L1C products only have the native resolution.
+
+        Returns:
+            (list): (relative path inside the product, node url) for each
+            file, across every granule of the product.
+        """
+        wanted = []
+        for band in bands:
+            if isinstance(band, str):
+                band = (band, BAND_RESOLUTIONS.get(band))
+            wanted.append(band)
+
+        product_url = f"{self.copernicus_url}/odata/v1/Products('{product_id}')"
+        ((safe_name, safe_url),) = self.list_nodes(product_url)
+
+        files = []
+        for granule_name, granule_url in self.list_nodes(f"{safe_url}/Nodes('GRANULE')"):
+            img_data_url = f"{granule_url}/Nodes('IMG_DATA')"
+            img_data_path = Path(safe_name, "GRANULE", granule_name, "IMG_DATA")
+            img_nodes = self.list_nodes(img_data_url)
+
+            # L2A products group files in R10m, R20m and R60m folders
+            resolution_dirs = {
+                int(name[1:-1]): url for name, url in img_nodes if re.match(r"R\d+m$", name)
+            }
+
+            for band, resolution in wanted:
+                if resolution_dirs:
+                    if resolution not in resolution_dirs:
+                        raise ValueError(f"{band} is not available at {resolution} m")
+                    folder = f"R{resolution}m"
+                    candidates = self.list_nodes(resolution_dirs[resolution])
+                    suffix = f"_{band}_{resolution}m.jp2"
+                else:
+                    folder = None
+                    candidates = img_nodes
+                    suffix = f"_{band}.jp2"
+
+                matches = [(n, u) for n, u in candidates if n.endswith(suffix)]
+                if not matches:
+                    raise ValueError(f"No {band} image in granule {granule_name}")
+
+                for name, url in matches:
+                    path = img_data_path / folder / name if folder else img_data_path / name
+                    files.append((path, url))
+
+        return files
+
+    def download_bands(self, product_id, bands, directory, max_workers=4):
+        """Download only the requested band images of a product.
+
+        The files are written into a SAFE-shaped tree under ``directory``
+        (``<name>.SAFE/GRANULE/<granule>/IMG_DATA/...``) and fetched
+        ``max_workers`` at a time. See ``resolve_band_nodes`` for ``bands``.
+
+        Returns:
+            (TaskStatus): On success data is the list of downloaded paths,
+            otherwise a dict of path -> exception for the files that failed.
+        """
+        try:
+            files = self.resolve_band_nodes(product_id, bands)
+        except Exception as e:
+            self.logger.error(f"Could not resolve bands {bands} of {product_id}: {e}")
+            return TaskStatus(False, "Could not resolve band nodes", e)
+
+        def download(relative_path, url):
+            full_file_path = Path(directory, relative_path)
+            full_file_path.parent.mkdir(parents=True, exist_ok=True)
+
+            if not full_file_path.is_file():
+                transfer = TransferMonitor(full_file_path, product_id)
+                try:
+                    http_download.download_to_file(
+                        f"{url}/$value",
+                        full_file_path,
+                        auth=(self.username, self.password),
+                        timeout=2 * 60.0,
+                        progress=transfer.progress,
+                    )
+                finally:
+                    transfer.finish()
+
+            return str(full_file_path)
+
+        paths = []
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(download, relative_path, url): relative_path
+                for relative_path, url in files
+            }
+            for future in as_completed(futures):
+                try:
+                    paths.append(future.result())
+                except Exception as e:
+                    self.logger.error(f"Download of {futures[future]} failed: {e}")
+                    errors[str(futures[future])] = e
+
+        if errors:
+            return TaskStatus(False, f"{len(errors)} of {len(files)} band downloads failed", errors)
+
+        return TaskStatus(True, "Download successful", sorted(paths))
+
+    def open_remote_zip(self, product_id):
+        """Return a ``RemoteZip`` reading the product zip with Range requests."""
+        return RemoteZip(
+            f"{self.copernicus_url}/odata/v1/Products('{product_id}')/$value",
+            auth=(self.username, self.password),
+            session=self.session,
         )
 
-        xml = next_r.text.encode("utf-8")
-        h = etree.fromstring(xml, parser=parser)
-        self.logger.debug(f"Next result text: {next_r.text}")
-        result = h.find("entry/id", h.nsmap)
-        self.logger.debug(f"Next result text: {result.text}")
+    def extract_product_members(self, product_id, names, directory):
+        """Extract single files from a product zip without downloading it.
 
-        granule_name = result.text.split("/")[-1][7:-2]
-        self.logger.info(f"Granule name: {granule_name}")
-        # 'T12UXA_20190620T181921_TCI.jp2' L1C_T12UXA_A020859_20190620T182912  S2A_MSIL1C_20190620T181921_N0207_R127_T12UXA_20190620T231306.SAFE
-        tci_name = f"{granule_name.split('_')[1]}_{product_name.split('_')[2]}_TCI.jp2"
-        next_url = f"{result.text}/Nodes('IMG_DATA')/Nodes('{tci_name}')/$value"
+        Args:
+            product_id (str): Product UUID.
+            names (list): Member paths or file names, e.g. ``manifest.safe``,
+                ``MTD_MSIL1C.xml`` or a band jp2 name.
+            directory (str): Members are written here with their SAFE folders.
 
-        return next_url
+        Returns:
+            (TaskStatus): data is the list of extracted paths on success.
+        """
+        try:
+            with self.open_remote_zip(product_id) as remote:
+                paths = []
+                for name in names:
+                    member = remote.find(name)
+                    if member is None:
+                        return TaskStatus(False, f"{name} is not in the product zip", None)
+                    paths.append(remote.extract(member, directory))
+
+                self.logger.info(
+                    f"Extracted {len(paths)} members of {product_id}, "
+                    f"{remote.bytes_fetched} bytes fetched"
+                )
+        except Exception as e:
+            self.logger.error(f"Remote extraction from {product_id} failed: {e}")
+            return TaskStatus(False, "An exception occured while reading the remote zip.", e)
+
+        return TaskStatus(True, "Extraction successful", paths)
 
     def download_tci(self, tile_id, directory):
 
         url = self.build_download_url(tile_id)
         self.logger.info(f"Url created: {url}")
+
+        return self.download_tci_url(url, directory)
+
+    def download_tci_url(self, url, directory, monitor=True):
+        """Download a TCI image from its ``build_download_url`` url into ``directory``."""
         file_name = url.split("/")[-2][7:-2]
         self.logger.info(f"Downloading true color preview image for: {file_name}")
 
         full_file_path = Path(directory, file_name)
 
-        r = requests.get(
-            url=url, auth=(self.username, self.password), stream=True, timeout=2 * 60
-        )
-
-        self.logger.info(f"Response status code: {r.status_code}")
-
         if not os.path.isfile(full_file_path):
+            transfer = TransferMonitor(full_file_path, 1) if monitor else None
             try:
-
-                transfer = TransferMonitor(full_file_path, 1)
-                with open(full_file_path, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=1000000):
-                        f.write(chunk)
+                http_download.download_to_file(
+                    url,
+                    full_file_path,
+                    auth=(self.username, self.password),
+                    timeout=2 * 60,
+                    progress=transfer.progress if transfer else None,
+                )
 
             except BaseException as e:
-                transfer.finish()
                 return TaskStatus(
                     False, "An exception occured while trying to download.", e
                 )
             else:
-                transfer.finish()
                 return TaskStatus(True, "Download successful", full_file_path)
+            finally:
+                if transfer:
+                    transfer.finish()
         else:
             return TaskStatus(
                 False, "Requested file to download already exists.", full_file_path
             )
 
-    def download_fullproduct(self, tile_id, tile_name, directory):
+    def download_tci_batch(self, uuids, directory, concurrency=8):
+        """Download the TCI previews of many products, yielding results as they finish.
 
-        url = f"https://scihub.copernicus.eu/dhus/odata/v1/Products('{tile_id}')/$value"
+        Node lookups and image downloads run in two pools of ``concurrency``
+        threads each, so the next products are being resolved while earlier
+        previews download, and all requests reuse the pooled session.
+
+        Yields:
+            (tuple): (uuid, TaskStatus) in completion order, one per uuid.
+        """
+        uuids = list(uuids)
+        results = queue.Queue()
+
+        def download(uuid, url):
+            try:
+                task_status = self.download_tci_url(url, directory, monitor=False)
+            except Exception as e:
+                task_status = TaskStatus(False, "An exception occured while trying to download.", e)
+            results.put((uuid, task_status))
+
+        with ThreadPoolExecutor(concurrency) as resolvers, ThreadPoolExecutor(
+            concurrency
+        ) as downloaders:
+
+            def resolved(uuid, future):
+                try:
+                    url = future.result()
+                    downloaders.submit(download, uuid, url)
+                except Exception as e:
+                    self.logger.error(f"Could not resolve the TCI of {uuid}: {e}")
+                    results.put((uuid, TaskStatus(False, "Could not resolve TCI node", e)))
+
+            for uuid in uuids:
+                future = resolvers.submit(self.build_download_url, uuid)
+                future.add_done_callback(functools.partial(resolved, uuid))
+
+            for _ in uuids:
+                yield results.get()
+
+    def download_fullproduct(
+        self, tile_id, tile_name, directory, segments=None, progress=None
+    ):
+        """Download the full product zip for ``tile_id``.
+
+        When ``segments`` (or the ``DOWNLOAD_SEGMENTS`` config value) is greater
+        than 1 the zip is fetched as that many concurrent byte ranges, falling
+        back to a single stream if the server does not honour ``Range``.
+        ``progress(bytes_done, total_bytes)`` is called as the transfer advances,
+        an exception raised from it aborts the download.
+
+        With a ``product_store`` configured the zip is linked from the store
+        when another job already downloaded it, and added to it otherwise.
+        """
+        if segments is None:
+            segments = self.download_segments
+
+        url = f"{self.copernicus_url}/odata/v1/Products('{tile_id}')/$value"
 
         full_file_path = Path(directory, tile_name + ".zip")
         self.logger.info(f"Url created: {url}")
 
         self.logger.info(f"Downloading full product for {tile_name}")
 
-        try:
-            r = requests.get(
-                url=url, auth=(self.username, self.password), stream=True, timeout=120.0
-            )
-        except BaseException as e:
-            self.logger.error(e)
+        if os.path.isfile(full_file_path):
             return TaskStatus(
-                False, "An exception occured while trying to download.", e
+                True, "Requested file to download already exists.", str(full_file_path)
             )
 
-        self.logger.debug(f"Response status code: {r.status_code}")
+        checksum = self.get_product_checksum(tile_id)
 
-        if not os.path.isfile(full_file_path):
+        def download(file_path):
             try:
 
-                transfer = TransferMonitor(full_file_path, 1)
-                with open(full_file_path, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=1000000):
-                        f.write(chunk)
+                transfer = TransferMonitor(file_path, tile_id)
+
+                def on_progress(done, total):
+                    transfer.progress(done, total)
+                    if progress:
+                        progress(done, total)
+
+                http_download.download_to_file(
+                    url,
+                    file_path,
+                    auth=(self.username, self.password),
+                    segments=segments,
+                    timeout=120.0,
+                    progress=on_progress,
+                    checksum=checksum,
+                )
 
             except BaseException as e:
+                self.logger.error(e)
                 transfer.finish()
                 return TaskStatus(
                     False, "An exception occured while trying to download.", e
                 )
             else:
                 transfer.finish()
-                return TaskStatus(True, "Download successful", str(full_file_path))
-        else:
-            return TaskStatus(
-                True, "Requested file to download already exists.", str(full_file_path)
-            )
+                return TaskStatus(True, "Download successful", str(file_path))
+
+        if self.product_store is not None:
+            return self.product_store.fetch(tile_id, full_file_path, download, checksum)
+
+        return download(full_file_path)
 
     def download_fullproduct_callback(
         self, tile_id, tile_name, directory, callback=None
     ):
         """Same as download_fullproduct, except that is supports a callback of the
-        form func(current_amount_downloaded_in_bytes, total_amount_to_transfer_in_bytes, percentange_complete)
+        form func(percentange_complete)
 
-        For every chunk of the file downloaded, the callback is called.
+        The callback is called every time the transfer advances by at least
+        5 percent. An interrupted transfer is resumed on the next call.
 
         """
-        url = f"https://scihub.copernicus.eu/dhus/odata/v1/Products('{tile_id}')/$value"
+        url = f"{self.copernicus_url}/odata/v1/Products('{tile_id}')/$value"
 
         full_file_path = Path(directory, tile_name + ".zip")
 
@@ -479,61 +918,59 @@ class S2Downloader:
         self.logger.info(f"Downloading full product for {tile_name}")
         self.logger.info(f"Full file path: {full_file_path}")
 
+        if callback is None:
+            callback = lambda percent: None
+
+        if os.path.isfile(full_file_path):
+            callback(100)
+            return TaskStatus(
+                True,
+                "Requested file to download already exists.",
+                str(full_file_path),
+            )
+
+        update_throttle_threshold = 5  # Update every percent change
+        previous_update = 0
+
+        transfer = TransferMonitor(full_file_path, tile_id)
+
+        def progress(transfer_progress, file_size):
+            nonlocal previous_update
+
+            transfer.progress(transfer_progress, file_size)
+
+            if not file_size:
+                return
+
+            transfer_percent = round(min(100, (transfer_progress / file_size) * 100), 2)
+
+            if (transfer_percent - previous_update) >= update_throttle_threshold:
+                self.logger.debug(
+                    f"Progress: {transfer_progress},  {transfer_percent:.2f}%"
+                )
+                callback(transfer_percent)
+                previous_update = math.floor(transfer_percent)
+
         try:
-            r = requests.get(
-                url=url,
+            http_download.download_to_file(
+                url,
+                full_file_path,
                 auth=(self.username, self.password),
-                stream=True,
+                segments=self.download_segments,
                 timeout=2 * 60.0,
+                progress=progress,
+                checksum=self.get_product_checksum(tile_id),
             )
         except BaseException as e:
             self.logger.error(e)
+            transfer.finish()
             return TaskStatus(
                 False, "An exception occured while trying to download.", e
             )
         else:
-            self.logger.debug(f"Response status code: {r.status_code}")
-
-            file_size = int(r.headers["Content-Length"])
-            transfer_progress = 0
-            chunk_size = 10000
-
-            previous_update = 0
-            update_throttle_threshold = 5  # Update every percent change
-
-            if not os.path.isfile(full_file_path):
-                try:
-                    with open(full_file_path, "wb") as f:
-                        for chunk in r.iter_content(chunk_size=chunk_size):
-                            f.write(chunk)
-                            transfer_progress += chunk_size
-                            transfer_percent = round(
-                                min(100, (transfer_progress / file_size) * 100), 2
-                            )
-
-                            if (
-                                transfer_percent - previous_update
-                            ) >= update_throttle_threshold:
-                                self.logger.debug(
-                                    f"Progress: {transfer_progress},  {transfer_percent:.2f}%"
-                                )
-                                callback(transfer_percent)
-                                previous_update = math.floor(transfer_percent)
-
-                except BaseException as e:
-                    return TaskStatus(
-                        False, "An exception occured while trying to download.", e
-                    )
-                else:
-                    callback(transfer_percent)
-                    return TaskStatus(True, "Download successful", str(full_file_path))
-            else:
-                callback(100)
-                return TaskStatus(
-                    True,
-                    "Requested file to download already exists.",
-                    str(full_file_path),
-                )
+            transfer.finish()
+            callback(100)
+            return TaskStatus(True, "Download successful", str(full_file_path))
 
     def request_offline_product(self, tile_id):
         """For products with the Offline status, it is a regular download request
@@ -543,36 +980,91 @@ class S2Downloader:
         actually downloaded.
 
         """
-        url = f"https://scihub.copernicus.eu/dhus/odata/v1/Products('{tile_id}')/$value"
-        # https://scihub.copernicus.eu/dhus/odata/v1/Products('bd22f901-a796-4553-acc9-73cbc34e0f40')/$value
-        # https://scihub.copernicus.eu/dhus/odata/v1/Products('c94ffc0b-62e5-4f76-83b8-e7f0e5a7542e')/$value
-        # https://scihub.copernicus.eu/dhus/odata/v1/Products(' Id ')/$value
-        self.logger.info(f"Url created: {url}")
-        self.logger.info(self.username)
-        self.logger.info(self.password)
+        task_status = self.trigger_retrieval(tile_id)
+
+        if task_status.data == 202:
+            self.logger.debug("Request to move product to Online state was successful")
+            return True
+        else:
+            self.logger.debug(
+                "Request to move product to Online state either failed or encountered unknown behaviour"
+            )
+            return False
+
+    def trigger_retrieval(self, product_id):
+        """Ask the hub to restore an offline product from the Long Term Archive.
+
+        Only the response status is read, the body of an online product is not
+        downloaded.
+
+        Returns:
+            (TaskStatus): status is True if the retrieval was accepted (data
+            202) or the product is already online (data 200). A 403 (data)
+            means the user's LTA quota is used up, a 503 that the hub is
+            overloaded. data is None if the request itself failed.
+        """
+        url = f"{self.copernicus_url}/odata/v1/Products('{product_id}')/$value"
+        self.logger.info(f"Requesting LTA retrieval of {product_id}")
+
         try:
-            r = requests.get(
+            r = self.session.get(
                 url=url,
                 auth=(self.username, self.password),
-                stream=False,
+                stream=True,
                 timeout=2 * 60,
             )
-        except BaseException as e:
+        except Exception as e:
             self.logger.error(e)
-            return False
-        else:
+            return TaskStatus(False, "Retrieval request failed", None)
+
+        with r:
             self.logger.debug(f"Response status code: {r.status_code}")
 
-            if r.status_code == 202:
-                self.logger.debug(
-                    "Request to move product to Online state was successful"
-                )
-                return True
-            else:
-                self.logger.debug(
-                    "Request to move product to Online state either failed or encountered unknown behaviour"
-                )
-                return False
+        if r.status_code == 202:
+            return TaskStatus(True, "Retrieval triggered", 202)
+        elif r.status_code == 200:
+            return TaskStatus(True, "Product is online", 200)
+        elif r.status_code == 403:
+            return TaskStatus(False, "LTA quota exceeded", 403)
+        elif r.status_code == 503:
+            return TaskStatus(False, "Hub is not accepting retrievals", 503)
+        else:
+            return TaskStatus(
+                False, f"Unexpected status code {r.status_code}", r.status_code
+            )
+
+    @metrics.timed_query("check_products_online")
+    def check_products_online(self, product_ids, batch_size=ONLINE_CHECK_BATCH_SIZE):
+        """Return {product id: online} for many products in few requests.
+
+        Ids are checked ``batch_size`` at a time with a single OData
+        ``$filter=Id eq '...' or Id eq '...'`` query per batch. Ids the hub
+        does not return are left out of the result.
+        """
+        product_ids = list(product_ids)
+        online = {}
+
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start : start + batch_size]
+            id_filter = " or ".join(f"Id eq '{product_id}'" for product_id in batch)
+
+            r = self.session.get(
+                url=f"{self.copernicus_url}/odata/v1/Products",
+                params={
+                    "$filter": id_filter,
+                    "$select": "Id,Online",
+                    "$top": len(batch),
+                    "$format": "json",
+                },
+                auth=(self.username, self.password),
+                timeout=2 * 60.0,
+            )
+            r.raise_for_status()
+
+            for entry in r.json()["d"]["results"]:
+                online[entry["Id"]] = bool(entry["Online"])
+
+        return online
 
     def download_file(self, url, download_name, download_id):
         """Download from scihub using requests library and their api.
@@ -586,19 +1078,23 @@ class S2Downloader:
 
         self.logger.info(f"Downloading file for url {url}")
 
-        r = requests.get(
-            url=url, auth=(self.username, self.password), stream=True, timeout=2 * 60.0
-        )
-
-        self.logger.debug(f"Response status code: {r.status_code}")
-
         if not os.path.isfile(download_name):
             try:
 
                 transfer = TransferMonitor(download_name, download_id)
-                with open(download_name, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=1000000):
-                        f.write(chunk)
+                checksum = None
+                product_id = PRODUCT_VALUE_URL_RE.search(url)
+                if product_id:
+                    checksum = self.get_product_checksum(product_id.group(1))
+
+                http_download.download_to_file(
+                    url,
+                    download_name,
+                    auth=(self.username, self.password),
+                    timeout=2 * 60.0,
+                    progress=transfer.progress,
+                    checksum=checksum,
+                )
 
             except BaseException as e:
                 transfer.finish()
@@ -656,6 +1152,7 @@ class S2Downloader:
         # return 'Failure'
         pass
 
+    @metrics.timed_query("search_for_products_by_tile_directly")
     def search_for_products_by_tile_directly(self, tile, daterange):
         """
                 #         producttype:	Used to perform a search based on the product type.
@@ -686,9 +1183,9 @@ class S2Downloader:
         platform_query = "platformname:Sentinel-2"
         filename_query = f"filename:*_T{tile}_*"
 
-        query_url = f"https://scihub.copernicus.eu/dhus/search?q=({date_query} AND {platform_query} AND {filename_query})"
+        query_url = f"{self.copernicus_url}/search?q=({date_query} AND {platform_query} AND {filename_query})"
 
-        r = requests.get(
+        r = self.session.get(
             query_url,
             auth=HTTPBasicAuth(self.username, self.password),
             timeout=2 * 60.0,
@@ -0,0 +1,239 @@
+"""Run many similar OpenSearch queries as a few batched, concurrent requests.
+
+Searching for hundreds of product names or MGRS tiles one query at a time
+costs one round trip each. ``BatchedSearch`` ORs the per item clauses into as
+few queries as the hub accepts (bounded by a clause count and the GET length
+limit), runs them on a small thread pool with a shared ``RateLimiter``, and
+merges the results, each product once, as the queries finish.
+
+A single query with thousands of results is paged by ``SentinelAPI.query``
+one page after another. ``iter_query_pages`` reads the total from the first
+page and fetches the remaining pages concurrently instead, yielding products
+as each page arrives. ``PagedAPI`` gives the same paging to code calling
+``query``, such as a ``QueryCache`` filling a miss.
+"""
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# The page loading helpers are sentinelsat internals, the version is pinned in
+# requirements.txt and test_s2_search.test_sentinelsat_internals checks them
+from sentinelsat.sentinel import (
+    SentinelAPI,
+    _format_order_by,
+    _parse_opensearch_response,
+)
+
+logger = logging.getLogger(__name__)
+
+# Clauses OR'd into one query, DHuS rejects very large boolean queries
+DEFAULT_MAX_CLAUSES = 100
+# Concurrent search requests for one batched search
+DEFAULT_CONCURRENCY = 4
+# Pages are fetched concurrently by offset, ordering by ingestion keeps the
+# offsets stable while products are being ingested
+DEFAULT_PAGE_ORDER = "+ingestiondate"
+
+
+def chunk_query_clauses(
+    clauses, max_clauses=DEFAULT_MAX_CLAUSES, operator=" OR ", max_length_ratio=1.0
+):
+    """Join ``clauses`` with ``operator`` into as few queries as the hub accepts.
+
+    Each query holds at most ``max_clauses`` clauses and its length stays
+    under ``max_length_ratio`` of the OpenSearch limit (see
+    ``SentinelAPI.check_query_length``), lower it to leave room for other
+    query terms.
+    """
+    queries = []
+    current = []
+
+    for clause in clauses:
+        candidate = current + [clause]
+        too_long = (
+            SentinelAPI.check_query_length(operator.join(candidate)) > max_length_ratio
+        )
+        if current and (len(candidate) > max_clauses or too_long):
+            queries.append(operator.join(current))
+            current = [clause]
+        else:
+            current = candidate
+
+    if current:
+        queries.append(operator.join(current))
+
+    return queries
+
+
+def iter_query_pages(
+    api,
+    rate_limiter=None,
+    concurrency=DEFAULT_CONCURRENCY,
+    order_by=DEFAULT_PAGE_ORDER,
+    limit=None,
+    ordered=False,
+    **query_kwargs,
+):
+    """Yield (uuid, properties) for the results of ``api.query(**query_kwargs)``.
+
+    The first page gives the total number of results, the remaining pages
+    (``api.page_size`` products each) are then fetched ``concurrency`` at a
+    time, each after acquiring ``rate_limiter``. Products are yielded as
+    their page arrives, or in page order when ``ordered`` is True, and a
+    product seen on an earlier page is skipped.
+    """
+    query = api.format_query(**query_kwargs)
+    if not query.strip():
+        raise ValueError("Empty query.")
+
+    formatted_order_by = _format_order_by(order_by)
+    page_size = api.page_size
+
+    def load_page(offset):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        page_limit = page_size if limit is None else min(page_size, limit - offset)
+        entries, total = api._load_subquery(query, formatted_order_by, page_limit, offset)
+        return _parse_opensearch_response(entries), total
+
+    seen = set()
+
+    def new_products(page):
+        for uuid, properties in page.items():
+            if uuid not in seen:
+                seen.add(uuid)
+                yield uuid, properties
+
+    first_page, total = load_page(0)
+    if limit is not None:
+        total = min(total, limit)
+    logger.info(f"Query matches {total} products, {page_size} per page")
+
+    yield from new_products(first_page)
+
+    offsets = list(range(page_size, total, page_size))
+    if not offsets:
+        return
+
+    with ThreadPoolExecutor(min(concurrency, len(offsets))) as executor:
+        futures = [executor.submit(load_page, offset) for offset in offsets]
+
+        try:
+            for future in futures if ordered else as_completed(futures):
+                yield from new_products(future.result()[0])
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class PagedAPI:
+    """A ``SentinelAPI`` whose ``query`` loads its pages concurrently.
+
+    Every other attribute is the wrapped api's. Queries with an ``offset``
+    go to the api unchanged.
+    """
+
+    def __init__(self, api, rate_limiter=None, concurrency=DEFAULT_CONCURRENCY):
+        self.api = api
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+
+    def query(self, order_by=None, limit=None, offset=0, **query_kwargs):
+        if offset:
+            return self.api.query(
+                order_by=order_by, limit=limit, offset=offset, **query_kwargs
+            )
+
+        return OrderedDict(
+            iter_query_pages(
+                self.api,
+                rate_limiter=self.rate_limiter,
+                concurrency=self.concurrency,
+                order_by=order_by or DEFAULT_PAGE_ORDER,
+                limit=limit,
+                ordered=True,
+                **query_kwargs,
+            )
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+
+def tile_clause(tile):
+    """Filename clause matching the products of an MGRS tile (after 2017-03-31)."""
+    return f"(filename:*_T{tile}_*)"
+
+
+class BatchedSearch:
+    """Batched, concurrent and rate limited ``SentinelAPI.query`` calls.
+
+    Args:
+        api (SentinelAPI): Api the queries are sent through.
+        concurrency (int): Queries in flight at once.
+        rate_limiter (RateLimiter): Optional, acquired before every query.
+        max_clauses (int): Clauses per query.
+        max_length_ratio (float): Share of the query length limit the OR'd
+            clauses may use.
+    """
+
+    def __init__(
+        self,
+        api,
+        concurrency=DEFAULT_CONCURRENCY,
+        rate_limiter=None,
+        max_clauses=DEFAULT_MAX_CLAUSES,
+        max_length_ratio=1.0,
+    ):
+        self.api = api
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter
+        self.max_clauses = max_clauses
+        self.max_length_ratio = max_length_ratio
+
+    def raw_queries(self, clauses):
+        return chunk_query_clauses(
+            clauses, self.max_clauses, max_length_ratio=self.max_length_ratio
+        )
+
+    def run_query(self, raw, query_kwargs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        # Parentheses keep the OR'd clauses apart from the other query terms
+        return self.api.query(raw=f"({raw})", **query_kwargs)
+
+    def iter_query(self, clauses, ordered=False, **query_kwargs):
+        """Yield (uuid, properties) for every product matching any of ``clauses``.
+
+        ``query_kwargs`` (``date``, ``producttype``, ...) are added to every
+        query. Products are yielded once, as soon as the query that found them
+        completes, or in clause order when ``ordered`` is True.
+        """
+        raw_queries = self.raw_queries(list(clauses))
+        if not raw_queries:
+            return
+
+        logger.info(
+            f"Searching {len(raw_queries)} batched queries, {self.concurrency} at a time"
+        )
+
+        seen = set()
+        with ThreadPoolExecutor(min(self.concurrency, len(raw_queries))) as executor:
+            futures = [
+                executor.submit(self.run_query, raw, query_kwargs) for raw in raw_queries
+            ]
+
+            try:
+                for future in futures if ordered else as_completed(futures):
+                    for uuid, properties in future.result().items():
+                        if uuid not in seen:
+                            seen.add(uuid)
+                            yield uuid, properties
+            finally:
+                # Stopped early or a query failed, don't start the rest
+                for future in futures:
+                    future.cancel()
+
+    def query(self, clauses, **query_kwargs):
+        """``iter_query`` collected into an OrderedDict, in clause order."""
+        return OrderedDict(self.iter_query(clauses, ordered=True, **query_kwargs))
@@ -0,0 +1,483 @@
+"""Local stand-in for the SciHub DHuS and ASF endpoints used by the downloaders.
+
+Serves product zips from memory so downloads can be exercised without
+credentials or network access. Besides the OData ``$value``, ``Nodes`` and
+``Online`` endpoints and the OpenSearch ``search`` endpoint it emulates the
+Long Term Archive (202 for offline products, 403 past the quota), byte
+ranges, a bandwidth limit and injected faults, which makes it the server for
+both the tests and ``benchmarks/``.
+"""
+import datetime
+import fnmatch
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+VALUE_RE = re.compile(r"^/dhus/odata/v1/Products\('([^']+)'\)/\$value$")
+PRODUCT_RE = re.compile(r"^/dhus/odata/v1/Products\('([^']+)'\)$")
+ONLINE_RE = re.compile(r"^/dhus/odata/v1/Products\('([^']+)'\)/Online/\$value$")
+SEARCH_PATH = "/dhus/search"
+# datapool.asf.alaska.edu/<type>/<platform>/<name>.zip
+ASF_RE = re.compile(r"^/asf/[A-Z_]+/S[AB]/([^/]+)\.zip$")
+PRODUCTS_PATH = "/dhus/odata/v1/Products"
+FILTER_ID_RE = re.compile(r"Id eq '([^']+)'")
+NODES_RE = re.compile(
+    r"^/dhus/odata/v1/Products\('([^']+)'\)((?:/Nodes\('[^']+'\))*)/(Nodes|\$value)$"
+)
+NODE_NAME_RE = re.compile(r"Nodes\('([^']+)'\)")
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+FILENAME_CLAUSE_RE = re.compile(r"filename:([^\s()]+)")
+INGESTION_RANGE_RE = re.compile(r'ingestiondate:\["?([^"\s]+)"? TO "?([^"\s\]]+)"?\]')
+BEGIN_RANGE_RE = re.compile(r'beginPosition:\["?([^"\s]+)"? TO "?([^"\s\]]+)"?\]')
+FOOTPRINT_RE = re.compile(r'footprint:"Intersects\(([^"]+)\)"')
+NOW_DAYS_RE = re.compile(r"^NOW-(\d+)DAYS?$")
+NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?(?:e-?\d+)?")
+# Bytes written between checks of the bandwidth limit
+THROTTLE_CHUNK = 64 * 1024
+
+
+def wkt_bounds(text):
+    """(min_x, max_x, min_y, max_y) of the coordinates in a WKT string."""
+    numbers = [float(n) for n in NUMBER_RE.findall(text)]
+    xs, ys = numbers[0::2], numbers[1::2]
+    return min(xs), max(xs), min(ys), max(ys)
+
+
+def parse_query_date(text):
+    if text == "NOW":
+        return datetime.datetime.max
+    days_ago = NOW_DAYS_RE.match(text)
+    if days_ago:
+        return datetime.datetime.utcnow() - datetime.timedelta(days=int(days_ago.group(1)))
+    if text == "*":
+        return datetime.datetime.min
+    return datetime.datetime.fromisoformat(text.rstrip("Z"))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.hub.connections += 1
+
+    def do_GET(self):
+        hub = self.server.hub
+        hub.requests.append((self.path, dict(self.headers)))
+
+        with hub.lock:
+            hub.active += 1
+            hub.max_active = max(hub.max_active, hub.active)
+
+        try:
+            if hub.latency:
+                time.sleep(hub.latency)
+            self.route()
+        finally:
+            with hub.lock:
+                hub.active -= 1
+
+    def route(self):
+        hub = self.server.hub
+        path = urlsplit(self.path).path
+
+        hub.restore_retrieved()
+
+        fault = hub.next_fault()
+        if fault is not None:
+            self.send_response(fault)
+            if fault in (429, 503):
+                self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        match = VALUE_RE.match(path)
+        if match and match.group(1) in hub.offline:
+            self.send_retrieval(match.group(1))
+            return
+
+        if match and match.group(1) in hub.products:
+            self.send_body(hub.products[match.group(1)])
+            return
+
+        if path == PRODUCTS_PATH:
+            query = parse_qs(urlsplit(self.path).query)
+            ids = FILTER_ID_RE.findall(query.get("$filter", [""])[0])
+            results = [
+                {"Id": product_id, "Online": product_id not in hub.offline}
+                for product_id in ids
+                if product_id in hub.products
+            ]
+            self.send_body(
+                json.dumps({"d": {"results": results}}).encode("utf-8"),
+                content_type="application/json",
+            )
+            return
+
+        match = NODES_RE.match(path)
+        if match and match.group(1) in hub.nodes:
+            self.send_node(match.group(1), NODE_NAME_RE.findall(match.group(2)), match.group(3))
+            return
+
+        match = ONLINE_RE.match(path)
+        if match and match.group(1) in hub.products:
+            online = match.group(1) not in hub.offline
+            self.send_body(json.dumps(online).encode("utf-8"), content_type="text/plain")
+            return
+
+        if path == SEARCH_PATH:
+            self.send_search(parse_qs(urlsplit(self.path).query))
+            return
+
+        match = ASF_RE.match(path)
+        if match and match.group(1) in hub.asf_products:
+            self.send_body(hub.asf_products[match.group(1)])
+            return
+
+        match = PRODUCT_RE.match(path)
+        if match and match.group(1) in hub.products:
+            self.send_body(
+                json.dumps({"d": hub.product_entity(match.group(1))}).encode("utf-8"),
+                content_type="application/json",
+            )
+            return
+
+        self.send_error(404)
+
+    def send_node(self, product_id, names, action):
+        """Serve a Nodes listing (Atom feed) or a file's $value from ``hub.nodes``."""
+        hub = self.server.hub
+
+        node = hub.nodes[product_id]
+        for name in names:
+            if not isinstance(node, dict) or name not in node:
+                self.send_error(404)
+                return
+            node = node[name]
+
+        if action == "$value":
+            if isinstance(node, dict):
+                self.send_error(404)
+                return
+            self.send_body(node)
+            return
+
+        if not isinstance(node, dict):
+            self.send_error(404)
+            return
+
+        parent = f"{hub.base_url}/odata/v1/Products('{product_id}')" + "".join(
+            f"/Nodes('{name}')" for name in names
+        )
+        entries = "".join(
+            f"<entry><id>{parent}/Nodes('{name}')</id>"
+            f'<title type="text">{name}</title></entry>'
+            for name in node
+        )
+        self.send_body(
+            f'<feed xmlns="http://www.w3.org/2005/Atom">{entries}</feed>'.encode("utf-8"),
+            content_type="application/atom+xml",
+        )
+
+    def send_search(self, query):
+        """Answer an OpenSearch query from ``hub.search_entries``.
+
+        Only ``filename:`` clauses (any of them matching selects an entry),
+        ``ingestiondate:[from TO to]`` and ``beginPosition:[from TO to]``
+        ranges and an ``Intersects`` footprint (compared by bounding box) are
+        interpreted, entries without the field always match them. ``rows``
+        and ``start`` page the results.
+        """
+        hub = self.server.hub
+
+        q = query.get("q", [""])[0]
+        rows = int(query.get("rows", ["10"])[0])
+        start = int(query.get("start", ["0"])[0])
+
+        patterns = FILENAME_CLAUSE_RE.findall(q)
+        entries = [
+            entry
+            for entry in hub.search_entries
+            if not patterns
+            or any(fnmatch.fnmatch(hub.entry_filename(entry), p) for p in patterns)
+        ]
+
+        for name, pattern in (
+            ("ingestiondate", INGESTION_RANGE_RE),
+            ("beginposition", BEGIN_RANGE_RE),
+        ):
+            date_range = pattern.search(q)
+            if date_range:
+                start_date, end_date = (parse_query_date(d) for d in date_range.groups())
+                entries = [
+                    entry
+                    for entry in entries
+                    if hub.entry_date(entry, name) is None
+                    or start_date <= hub.entry_date(entry, name) <= end_date
+                ]
+
+        area = FOOTPRINT_RE.search(q)
+        if area:
+            min_x, max_x, min_y, max_y = wkt_bounds(area.group(1))
+            entries = [
+                entry
+                for entry in entries
+                if hub.entry_bounds(entry) is None
+                or (
+                    hub.entry_bounds(entry)[0] <= max_x
+                    and min_x <= hub.entry_bounds(entry)[1]
+                    and hub.entry_bounds(entry)[2] <= max_y
+                    and min_y <= hub.entry_bounds(entry)[3]
+                )
+            ]
+
+        feed = {
+            "opensearch:totalResults": str(len(entries)),
+            "opensearch:startIndex": str(start),
+            "opensearch:itemsPerPage": str(rows),
+            "entry": entries[start : start + rows],
+        }
+        self.send_body(
+            json.dumps({"feed": feed}).encode("utf-8"), content_type="application/json"
+        )
+
+    def send_retrieval(self, product_id):
+        """Answer a $value request for an offline product like the LTA does."""
+        hub = self.server.hub
+
+        with hub.lock:
+            if product_id in hub.retrieving:
+                status = 202
+            elif len(hub.retrieving) >= hub.lta_quota:
+                status = 403
+            else:
+                hub.retrieving[product_id] = time.monotonic()
+                status = 202
+
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_body(self, body, content_type="application/octet-stream"):
+        hub = self.server.hub
+        byte_range = self.headers.get("Range")
+
+        if byte_range and hub.support_range:
+            start, end = RANGE_RE.match(byte_range).groups()
+            if start == "":
+                start = max(0, len(body) - int(end))
+                end = len(body) - 1
+            else:
+                start = int(start)
+                end = min(int(end), len(body) - 1) if end else len(body) - 1
+
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(body)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+            body = body[start : end + 1]
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if hub.drop_after is not None and len(body) > hub.drop_after:
+            # One shot fault: cut the connection part way through the body
+            drop_after, hub.drop_after = hub.drop_after, None
+            self.write_body(body[:drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        self.write_body(body)
+
+    def write_body(self, body):
+        throttle = self.server.hub.throttle
+        if not throttle:
+            self.wfile.write(body)
+            return
+
+        # Pace the response to ``throttle`` bytes per second
+        view = memoryview(body)
+        started = time.perf_counter()
+        for offset in range(0, len(body), THROTTLE_CHUNK):
+            chunk = view[offset : offset + THROTTLE_CHUNK]
+            # Hold each chunk back until the limit allows all of it
+            ahead = (offset + len(chunk)) / throttle - (time.perf_counter() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+            self.wfile.write(chunk)
+
+
+class StandInHub:
+    """Threaded HTTP server emulating the parts of DHuS the downloaders use.
+
+    Usage::
+
+        with StandInHub({"uuid": b"zip bytes"}) as hub:
+            s2_dl = S2Downloader(username="user", password="pass", hub_url=hub.base_url)
+            s1_dl.asf_url = hub.asf_url
+    """
+
+    def __init__(self, products=None, support_range=True):
+        self.products = products if products is not None else {}
+        self.support_range = support_range
+        self.requests = []
+        # Product id -> MD5 to report instead of the real one
+        self.checksums = {}
+        self.connections = 0
+        # Seconds to wait before answering each request
+        self.latency = 0
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        # Set to a byte count to drop the next body after that many bytes
+        self.drop_after = None
+        # Product id -> nested dict of SAFE folders, leaves are file bytes
+        self.nodes = {}
+        # Long Term Archive: offline product ids, and triggered id -> trigger time.
+        # A triggered product comes online retrieval_delay seconds later
+        self.offline = set()
+        self.retrieving = {}
+        self.lta_quota = 20
+        self.retrieval_delay = 0
+        # OpenSearch entries served by search, see add_search_entry
+        self.search_entries = []
+        # Product name (without .zip) -> bytes served under asf_url
+        self.asf_products = {}
+        # Bytes per second each response is limited to, None for no limit
+        self.throttle = None
+        # Status codes answered, one per request and in order, before
+        # requests are served normally again
+        self.faults = []
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.server.daemon_threads = True
+        self.server.hub = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def product_entity(self, product_id):
+        """OData Products entity, as returned for ``Products('id')?$format=json``."""
+        body = self.products[product_id]
+        checksum = self.checksums.get(product_id, hashlib.md5(body).hexdigest())
+
+        return {
+            "Id": product_id,
+            "Name": f"{product_id}.SAFE",
+            "ContentLength": str(len(body)),
+            "Checksum": {"Algorithm": "MD5", "Value": checksum.upper()},
+            "Online": product_id not in self.offline,
+        }
+
+    def add_search_entry(self, product_id, title, **properties):
+        """Add a product to the search results, as DHuS formats an OpenSearch entry.
+
+        ``properties`` become typed entry fields (``str``, ``int``, ``double``
+        or ``date`` by their Python type), the filename defaults to
+        ``title.SAFE``.
+        """
+        properties.setdefault("filename", f"{title}.SAFE")
+        properties.setdefault("identifier", title)
+        properties.setdefault("uuid", product_id)
+
+        entry = {
+            "id": product_id,
+            "title": title,
+            "link": [
+                {"href": f"{self.base_url}/odata/v1/Products('{product_id}')/$value"},
+                {
+                    "rel": "alternative",
+                    "href": f"{self.base_url}/odata/v1/Products('{product_id}')/",
+                },
+            ],
+            "summary": title,
+        }
+        for name, value in properties.items():
+            if isinstance(value, bool):
+                kind, value = "str", str(value).lower()
+            elif isinstance(value, str):
+                kind = "str"
+            elif isinstance(value, int):
+                kind, value = "int", str(value)
+            elif isinstance(value, float):
+                kind, value = "double", str(value)
+            else:
+                kind, value = "date", value.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            entry.setdefault(kind, []).append({"name": name, "content": value})
+
+        self.search_entries.append(entry)
+        return entry
+
+    @staticmethod
+    def entry_filename(entry):
+        for field in entry.get("str", []):
+            if field["name"] == "filename":
+                return field["content"]
+        return entry["title"]
+
+    @staticmethod
+    def entry_bounds(entry):
+        for field in entry.get("str", []):
+            if field["name"] == "footprint":
+                return wkt_bounds(field["content"])
+        return None
+
+    @staticmethod
+    def entry_date(entry, name):
+        for field in entry.get("date", []):
+            if field["name"] == name:
+                return parse_query_date(field["content"])
+        return None
+
+    def next_fault(self):
+        with self.lock:
+            if self.faults:
+                return self.faults.pop(0)
+        return None
+
+    def restore_retrieved(self):
+        with self.lock:
+            now = time.monotonic()
+            for product_id, triggered in list(self.retrieving.items()):
+                if now - triggered >= self.retrieval_delay:
+                    del self.retrieving[product_id]
+                    self.offline.discard(product_id)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/dhus"
+
+    @property
+    def asf_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/asf"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
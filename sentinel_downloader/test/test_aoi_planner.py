@@ -0,0 +1,51 @@
+import unittest
+
+from .. import aoi_planner
+from ..footprint_index import box_wkt
+
+
+def field(x, y, size=0.01):
+    return box_wkt(x, x + size, y, y + size)
+
+
+class TestAoiPlanner(unittest.TestCase):
+    def test_nearby_polygons_are_searched_together(self):
+        # A row of adjacent fields, an overlapping one and a far away field
+        polygons = [field(0.01 * i, 0) for i in range(10)]
+        polygons += [field(0.005, 0.005), field(5, 5)]
+
+        plans = aoi_planner.plan_queries(polygons)
+
+        self.assertEqual([plan.members for plan in plans], [list(range(11)), [11]])
+        hull = aoi_planner.geometry_rings(plans[0].geometry)[0]
+        self.assertEqual(len(hull), 7)
+        for actual, expected in zip(aoi_planner.rings_bounds([hull]), (0, 0.1, 0, 0.015)):
+            self.assertAlmostEqual(actual, expected)
+        self.assertEqual(plans[1].geometry, polygons[11])
+
+    def test_sparse_groups_are_not_merged(self):
+        # Close, but the hull around both would be mostly empty
+        polygons = [field(0, 0), field(0.05, 0.05)]
+
+        plans = aoi_planner.plan_queries(polygons)
+        merged = aoi_planner.plan_queries(polygons, max_area_ratio=20)
+
+        self.assertEqual([plan.members for plan in plans], [[0], [1]])
+        self.assertEqual([plan.members for plan in merged], [[0, 1]])
+
+    def test_matcher(self):
+        polygons = [field(0, 0), field(0.02, 0), "not a polygon"]
+        matcher = aoi_planner.PolygonMatcher(polygons)
+
+        self.assertEqual(matcher.covered(box_wkt(0.005, 0.025, 0, 0.01), [0, 1]), [0, 1])
+        self.assertEqual(matcher.covered(box_wkt(0.012, 0.018, 0, 0.01), [0, 1]), [])
+        self.assertEqual(matcher.covered(box_wkt(0.025, 1, 0, 1), [1, 2]), [1, 2])
+        self.assertEqual(matcher.covered(None, [0, 1]), [0, 1])
+
+        plans = aoi_planner.plan_queries(polygons)
+        self.assertEqual([plan.members for plan in plans], [[0, 1], [2]])
+        self.assertEqual(plans[1].geometry, "not a polygon")
+
+
+if __name__ == "__main__":
+    unittest.main()
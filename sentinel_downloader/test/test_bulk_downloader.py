@@ -0,0 +1,161 @@
+import unittest
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from .. import bulk_downloader
+from .. import s1_downloader
+from .. import s2_downloader
+from .stand_in_server import StandInHub
+
+PRODUCTS = {
+    f"0000000{i}-bc41-4c43-adae-be4dfa03ad5f": os.urandom(64 * 1024) for i in range(6)
+}
+
+
+class TestBulkDownloader(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.s2_dl = s2_downloader.S2Downloader(username="user", password="pass")
+        self.records = [
+            {"uuid": uuid, "name": f"S2A_MSIL1C_TEST_{i}", "platform_name": "Sentinel-2"}
+            for i, uuid in enumerate(PRODUCTS)
+        ]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_download_all_respects_host_limit(self):
+        with StandInHub(dict(PRODUCTS)) as hub:
+            hub.latency = 0.1
+            self.s2_dl.copernicus_url = hub.base_url
+
+            downloader = bulk_downloader.BulkDownloader(
+                self.s2_dl, max_concurrent=6, host_limits={"127.0.0.1": 2}
+            )
+            report = downloader.run(self.records, self.temp_dir.name)
+            max_active = hub.max_active
+
+        self.assertLessEqual(max_active, 2)
+        self.assertEqual(len(report.results), len(PRODUCTS))
+        self.assertTrue(all(r.task_status.status for r in report.results))
+        self.assertEqual(report.total_bytes, sum(len(b) for b in PRODUCTS.values()))
+        self.assertGreater(report.throughput, 0)
+
+        for i, uuid in enumerate(PRODUCTS):
+            path = Path(self.temp_dir.name, f"S2A_MSIL1C_TEST_{i}.zip")
+            self.assertEqual(path.read_bytes(), PRODUCTS[uuid])
+
+    def test_failed_and_existing_products_are_reported(self):
+        Path(self.temp_dir.name, "S2A_MSIL1C_TEST_0.zip").write_bytes(b"done")
+        completed = []
+
+        with StandInHub() as hub:
+            self.s2_dl.copernicus_url = hub.base_url
+
+            downloader = bulk_downloader.BulkDownloader(self.s2_dl)
+            report = downloader.run(
+                self.records[:2], self.temp_dir.name, on_result=completed.append
+            )
+
+        statuses = {r.product_id: r.task_status.status for r in report.results}
+        self.assertTrue(statuses[self.records[0]["uuid"]])
+        self.assertFalse(statuses[self.records[1]["uuid"]])
+        self.assertEqual(len(completed), 2)
+        self.assertEqual(report.total_bytes, 0)
+
+    def test_checksum_mismatch_fails_product(self):
+        with StandInHub(dict(PRODUCTS)) as hub:
+            hub.checksums[self.records[0]["uuid"]] = "0" * 32
+            self.s2_dl.copernicus_url = hub.base_url
+
+            downloader = bulk_downloader.BulkDownloader(self.s2_dl)
+            report = downloader.run(self.records[:2], self.temp_dir.name)
+
+        statuses = {r.product_id: r.task_status.status for r in report.results}
+        self.assertFalse(statuses[self.records[0]["uuid"]])
+        self.assertTrue(statuses[self.records[1]["uuid"]])
+        self.assertFalse(Path(self.temp_dir.name, "S2A_MSIL1C_TEST_0.zip").exists())
+
+    def s1_failing_over(self, uuids):
+        """An S1Downloader whose ASF attempts all fail over to SciHub, and S1
+        records for ``uuids``."""
+        config_path = Path(self.temp_dir.name, "config.json")
+        config_path.write_text(
+            json.dumps(
+                {
+                    "SENTINEL_USER": "user",
+                    "SENTINEL_PASS": "pass",
+                    "ESA_SCIHUB_USER": "user",
+                    "ESA_SCIHUB_PASS": "pass",
+                    "ASF_USER": "user",
+                    "ASF_PASS": "pass",
+                    "S1": {"DOWNLOAD": "USGS_ASF"},
+                }
+            )
+        )
+        s1_dl = s1_downloader.S1Downloader(str(config_path))
+        # Nothing listens there
+        s1_dl.asf_url = "http://127.0.0.1:9"
+        records = [
+            {
+                "uuid": uuid,
+                "name": f"S1A_IW_GRDH_1SDV_20190601T000000_{i}",
+                "platform_name": "Sentinel-1",
+                "product_type": "GRD",
+                "detailed_metadata": {"format": "SAFE"},
+                "polarization_mode": "VV VH",
+                "sensor_mode": "IW",
+            }
+            for i, uuid in enumerate(uuids)
+        ]
+        return s1_dl, records
+
+    def test_s1_failover_respects_scihub_limit(self):
+        s1_dl, records = self.s1_failing_over(PRODUCTS)
+
+        with StandInHub(dict(PRODUCTS)) as hub:
+            hub.latency = 0.1
+            s1_dl.esa_downloader.copernicus_url = hub.base_url
+
+            downloader = bulk_downloader.BulkDownloader(
+                self.s2_dl, s1_dl, max_concurrent=6, host_limits={"127.0.0.1": 2}
+            )
+            report = downloader.run(records, self.temp_dir.name)
+            max_active = hub.max_active
+
+        self.assertTrue(all(r.task_status.status for r in report.results))
+        self.assertLessEqual(max_active, 2)
+
+    def test_mixed_s1_and_s2_records_complete(self):
+        uuids = list(PRODUCTS)
+        s1_dl, s1_records = self.s1_failing_over(uuids[:2])
+        records = [r for pair in zip(s1_records, self.records[2:4]) for r in pair]
+        reports = []
+
+        with StandInHub(dict(PRODUCTS)) as hub:
+            hub.latency = 0.1
+            self.s2_dl.copernicus_url = hub.base_url
+            s1_dl.esa_downloader.copernicus_url = hub.base_url
+
+            downloader = bulk_downloader.BulkDownloader(
+                self.s2_dl, s1_dl, max_concurrent=2, host_limits={"127.0.0.1": 1}
+            )
+            # In a thread, a lock order deadlock would otherwise hang the suite
+            thread = threading.Thread(
+                target=lambda: reports.append(downloader.run(records, self.temp_dir.name)),
+                daemon=True,
+            )
+            thread.start()
+            thread.join(30)
+            max_active = hub.max_active
+
+        self.assertFalse(thread.is_alive(), "bulk download deadlocked")
+        self.assertEqual(len(reports[0].results), 4)
+        self.assertTrue(all(r.task_status.status for r in reports[0].results))
+        self.assertLessEqual(max_active, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from .. import disk_writer
+
+
+class TestDiskWriter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = Path(self.temp_dir.name, "out.bin")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_write_behind_reuses_buffers(self):
+        data = os.urandom(1024 * 1024 + 123)
+        readinto = io.BytesIO(data).readinto
+        seen = set()
+
+        with open(self.file_path, "wb") as f:
+            with disk_writer.WriteBehindWriter(f, buffer_size=64 * 1024, buffer_count=2) as writer:
+                while True:
+                    buffer = writer.acquire()
+                    seen.add(id(buffer))
+                    n, error = disk_writer.fill_buffer(readinto, buffer)
+                    self.assertIsNone(error)
+                    if not n:
+                        writer.release(buffer)
+                        break
+                    writer.write(buffer, n)
+
+        self.assertEqual(self.file_path.read_bytes(), data)
+        self.assertEqual(len(seen), 2)
+
+    def test_fill_buffer_returns_partial_read_with_error(self):
+        chunks = [b"abc", b"de"]
+
+        def readinto(view):
+            if not chunks:
+                raise ConnectionError("reset")
+            chunk = chunks.pop(0)
+            view[: len(chunk)] = chunk
+            return len(chunk)
+
+        buffer = bytearray(16)
+        n, error = disk_writer.fill_buffer(readinto, buffer)
+
+        self.assertEqual(n, 5)
+        self.assertEqual(bytes(buffer[:n]), b"abcde")
+        self.assertIsInstance(error, ConnectionError)
+
+    def test_writer_error_is_raised(self):
+        class BrokenFile:
+            def write(self, data):
+                raise OSError("disk full")
+
+            def flush(self):
+                pass
+
+        writer = disk_writer.WriteBehindWriter(BrokenFile(), buffer_size=8, buffer_count=1)
+        buffer = writer.acquire()
+        writer.write(buffer, 8)
+
+        with self.assertRaises(OSError):
+            writer.flush()
+        with self.assertRaises(OSError):
+            writer.close()
+
+    def test_preallocate(self):
+        with open(self.file_path, "wb") as f:
+            disk_writer.preallocate(f, 5000)
+
+        self.assertEqual(self.file_path.stat().st_size, 5000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from .. import download_scheduler
+from .. import s1_downloader
+from ..utils import TaskStatus
+from .stand_in_server import StandInHub
+
+PRODUCT_ID = "5f0c6c8e-bc41-4c43-adae-be4dfa03ad5f"
+PRODUCT_NAME = "S1A_IW_GRDH_1SDV_20190701T005946_20190701T010011_027917_0326DE_6D1F"
+PRODUCT_BYTES = os.urandom(256 * 1024)
+
+
+def fake_source(name, calls, status=True, rate_bytes=0, delay=0):
+    def download(product, dest_dir, progress):
+        calls.append((name, product["name"]))
+        if rate_bytes:
+            progress(0, None)
+        time.sleep(delay)
+        if rate_bytes:
+            progress(rate_bytes, None)
+        if not status:
+            return TaskStatus(False, f"{name} failed", None)
+        return TaskStatus(True, "Download successful", name)
+
+    return download
+
+
+class TestDownloadScheduler(unittest.TestCase):
+    def test_priority_order(self):
+        calls = []
+        scheduler = download_scheduler.DownloadScheduler(
+            {"ASF": fake_source("ASF", calls)}
+        )
+        scheduler.add({"name": "low"}, ".", priority=5)
+        scheduler.add({"name": "high"}, ".", priority=1)
+        scheduler.add({"name": "also_low"}, ".", priority=5)
+
+        results = scheduler.run()
+
+        self.assertEqual([c[1] for c in calls], ["high", "low", "also_low"])
+        self.assertTrue(all(r.task_status.status for r in results))
+        self.assertEqual(len(scheduler), 0)
+
+    def test_submit_shares_the_queue(self):
+        calls = []
+        release = threading.Event()
+
+        def source(product, dest_dir, progress):
+            calls.append(product["name"])
+            if product["name"] == "busy":
+                release.wait(5)
+            return TaskStatus(True, "Download successful", product["name"])
+
+        scheduler = download_scheduler.DownloadScheduler({"ASF": source})
+        busy = threading.Thread(target=scheduler.submit, args=({"name": "busy"}, "."))
+        busy.start()
+        while not calls:
+            time.sleep(0.01)
+
+        scheduler.add({"name": "low"}, ".", priority=5)
+        scheduler.add({"name": "high"}, ".", priority=1)
+        result = scheduler.submit({"name": "mine"}, ".", priority=3)
+        release.set()
+        busy.join()
+
+        self.assertEqual(result.task_status.data, "mine")
+        # Queued work ahead of the caller's own product is done first
+        self.assertEqual(calls, ["busy", "high", "mine"])
+        self.assertEqual(len(scheduler), 1)
+
+    def test_resumed_bytes_are_not_counted(self):
+        guard = download_scheduler.ThroughputGuard(1024, grace=0)
+        # Resumed from a nearly complete .part, 1 byte in 10 seconds since
+        guard(10 ** 9, None)
+        guard.start -= 10
+        with self.assertRaises(download_scheduler.SlowTransfer):
+            guard(10 ** 9 + 1, None)
+        self.assertEqual(guard.bytes_done, 1)
+
+    def test_failover_to_secondary(self):
+        calls = []
+        scheduler = download_scheduler.DownloadScheduler(
+            {
+                "ASF": fake_source("ASF", calls, status=False),
+                "ESA": fake_source("ESA", calls),
+            }
+        )
+
+        result = scheduler.download({"name": "p"}, ".")
+
+        self.assertEqual(result.source, "ESA")
+        self.assertEqual([a[0] for a in result.attempts], ["ASF", "ESA"])
+        self.assertEqual(scheduler.health["ASF"].consecutive_failures, 1)
+
+    def test_slow_source_is_abandoned_and_deprioritised(self):
+        calls = []
+        scheduler = download_scheduler.DownloadScheduler(
+            {
+                "ASF": fake_source("ASF", calls, rate_bytes=1, delay=0.02),
+                "ESA": fake_source("ESA", calls, rate_bytes=10 ** 9, delay=0.02),
+            },
+            min_throughput=1024,
+            throughput_grace=0,
+        )
+
+        first = scheduler.download({"name": "first"}, ".")
+        second = scheduler.download({"name": "second"}, ".")
+
+        self.assertIsInstance(
+            first.attempts[0][1].data, download_scheduler.SlowTransfer
+        )
+        self.assertEqual(first.source, "ESA")
+        # Both sources have been measured, ESA is now preferred
+        self.assertEqual(scheduler.rank_sources(), ["ESA", "ASF"])
+        self.assertEqual(second.attempts[0][0], "ESA")
+
+    def test_failing_source_cools_down(self):
+        health = download_scheduler.SourceHealth("ASF", max_failures=2, failure_cooldown=60)
+        health.record_failure()
+        self.assertTrue(health.available())
+        health.record_failure()
+        self.assertFalse(health.available())
+        health.record_success(100, 1.0)
+        self.assertTrue(health.available())
+
+
+class TestS1Failover(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        config_path = Path(self.temp_dir.name, "config.json")
+        config_path.write_text(
+            json.dumps(
+                {
+                    "SENTINEL_USER": "user",
+                    "SENTINEL_PASS": "pass",
+                    "ESA_SCIHUB_USER": "user",
+                    "ESA_SCIHUB_PASS": "pass",
+                    "ASF_USER": "user",
+                    "ASF_PASS": "pass",
+                    "S1": {"DOWNLOAD": "USGS_ASF"},
+                }
+            )
+        )
+        self.s1_dl = s1_downloader.S1Downloader(str(config_path))
+        self.product = {
+            "uuid": PRODUCT_ID,
+            "name": PRODUCT_NAME,
+            "product_type": "GRD",
+            "detailed_metadata": {"format": "SAFE"},
+            "polarization_mode": "VV VH",
+            "sensor_mode": "IW",
+        }
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_asf_404_fails_over_to_scihub(self):
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            self.s1_dl.asf_url = hub.base_url
+            self.s1_dl.esa_downloader.copernicus_url = hub.base_url
+
+            task_status = self.s1_dl.s1_download_wrapper(self.product, self.temp_dir.name)
+            paths = [path for path, _ in hub.requests]
+
+        self.assertTrue(task_status.status)
+        self.assertTrue(any(f"GRD_HD/SA/{PRODUCT_NAME}.zip" in p for p in paths))
+        self.assertEqual(
+            Path(self.temp_dir.name, PRODUCT_NAME + ".zip").read_bytes(), PRODUCT_BYTES
+        )
+        self.assertEqual(self.s1_dl.scheduler.health["USGS_ASF"].failures, 1)
+        self.assertEqual(self.s1_dl.scheduler.health["ESA_SCIHUB"].successes, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import datetime
+import tempfile
+import unittest
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from .. import footprint_index
+from .. import rate_limiter
+from .. import s2_downloader
+from .stand_in_server import StandInHub
+
+# Lower left half of the unit square
+TRIANGLE = "POLYGON((0 0, 1 0, 0 1, 0 0))"
+EAST = "POLYGON((0.5 0, 1.5 0, 1.5 1, 0.5 1, 0.5 0))"
+JUNE = (datetime.date(2019, 6, 1), datetime.date(2019, 7, 1))
+
+
+def product_id(i):
+    return f"{i:08d}-b95f-44f6-aa7e-bccbe4b00c4f"
+
+
+def add_product(hub, i, min_x, max_x, min_y, max_y, day, month=6):
+    hub.add_search_entry(
+        product_id(i),
+        f"S2B_MSIL1C_20190628T182929_N0207_R027_T12UUA_20190628T{i:06d}",
+        footprint=footprint_index.box_wkt(min_x, max_x, min_y, max_y),
+        beginposition=datetime.datetime(2019, month, day, 18, 0),
+    )
+
+
+def epoch(*args):
+    return footprint_index.to_epoch(datetime.datetime(*args))
+
+
+class TestGeometry(unittest.TestCase):
+    def test_subtract_box(self):
+        box = (0, 2, 0, 2, 0, 10)
+
+        self.assertEqual(footprint_index.subtract_box(box, (3, 4, 0, 2, 0, 10)), [box])
+        self.assertEqual(footprint_index.subtract_box(box, (-1, 3, -1, 3, -1, 11)), [])
+        self.assertEqual(
+            footprint_index.subtract_box(box, (1, 3, -1, 3, 0, 5)),
+            [(0, 1, 0, 2, 0, 10), (1, 2, 0, 2, 5, 10)],
+        )
+
+    def test_rings_intersect(self):
+        triangle = footprint_index.geometry_rings(TRIANGLE)
+
+        for box, expected in [
+            ((0.2, 0.4, 0.2, 0.4), True),
+            ((0.7, 0.9, 0.7, 0.9), False),
+            ((-1, 2, -1, 2), True),
+            ((0.9, 1.2, -0.5, 0.05), True),
+        ]:
+            rings = footprint_index.geometry_rings(footprint_index.box_wkt(*box))
+            self.assertEqual(footprint_index.rings_intersect(triangle, rings), expected, box)
+
+
+class TestFootprintIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.now = epoch(2020, 1, 1)
+        self.hub = StandInHub().start()
+        self.s2_dl = s2_downloader.S2Downloader(
+            username="user", password="pass", hub_url=self.hub.base_url
+        )
+        self.s2_dl.search_rate_limiter = rate_limiter.RateLimiter(100, burst=4)
+        self.index = footprint_index.FootprintIndex(
+            Path(self.temp_dir.name, "footprints.sqlite"), clock=lambda: self.now
+        )
+        self.s2_dl.footprint_index = self.index
+
+        add_product(self.hub, 0, 0.2, 0.4, 0.2, 0.4, 10)
+        add_product(self.hub, 1, 0.8, 1.2, 0.05, 0.15, 15)
+        add_product(self.hub, 2, 1.3, 1.6, 0.2, 0.4, 20)
+        add_product(self.hub, 3, 0.2, 0.4, 0.2, 0.4, 10, month=7)
+        # Inside the triangle's bounds but not the triangle
+        add_product(self.hub, 4, 0.7, 0.9, 0.7, 0.9, 12)
+
+    def tearDown(self):
+        self.index.close()
+        self.hub.stop()
+        self.temp_dir.cleanup()
+
+    def search(self, polygon, date=JUNE):
+        return [
+            uuid
+            for uuid, _ in self.s2_dl.iter_products("Sentinel-2", polygon, {"date": date})
+        ]
+
+    def search_queries(self):
+        return [
+            parse_qs(urlsplit(path).query)["q"][0]
+            for path, _ in self.hub.requests
+            if path.startswith("/dhus/search")
+        ]
+
+    def test_repeated_and_overlapping_searches(self):
+        self.assertEqual(self.search(TRIANGLE), [product_id(0), product_id(1)])
+        self.assertEqual(self.search(TRIANGLE), [product_id(0), product_id(1)])
+        self.assertEqual(len(self.search_queries()), 1)
+        self.assertEqual(self.index.hits, 1)
+
+        # Only the part east of the triangle's bounds is new
+        self.assertEqual(
+            self.search(EAST), [product_id(4), product_id(1), product_id(2)]
+        )
+        self.assertEqual(len(self.search_queries()), 2)
+        self.assertIn("Intersects(POLYGON((1.0 0.0, 1.5 0.0", self.search_queries()[-1])
+
+        # Only July is new
+        july = (datetime.date(2019, 6, 1), datetime.date(2019, 8, 1))
+        self.assertEqual(
+            self.search(TRIANGLE, july), [product_id(0), product_id(1), product_id(3)]
+        )
+        self.assertEqual(len(self.search_queries()), 3)
+        self.assertIn(
+            'beginPosition:["2019-07-01T00:00:00Z" TO "2019-08-01T00:00:00Z"]',
+            self.search_queries()[-1],
+        )
+
+    def test_recent_products_are_searched_again(self):
+        self.now = epoch(2019, 6, 25)
+
+        self.search(TRIANGLE)
+        self.search(TRIANGLE)
+
+        self.assertEqual(len(self.search_queries()), 2)
+        self.assertIn(
+            'beginPosition:["2019-06-22T00:00:00Z" TO "2019-07-01T00:00:00Z"]',
+            self.search_queries()[-1],
+        )
+
+    def test_expired_coverage_is_searched_again(self):
+        self.search(TRIANGLE)
+        self.now += footprint_index.DEFAULT_COVERAGE_TTL + 1
+        self.search(TRIANGLE)
+        self.search(TRIANGLE)
+
+        self.assertEqual(len(self.search_queries()), 2)
+        self.assertEqual(self.index.hits, 1)
+        # The expired box was pruned when the new one was recorded
+        self.assertEqual(self.index.db.execute("SELECT COUNT(*) FROM coverage").fetchone()[0], 1)
+        self.assertEqual(
+            self.index.db.execute("SELECT COUNT(*) FROM coverage_rtree").fetchone()[0], 1
+        )
+
+    def test_products_gone_from_the_hub_are_dropped(self):
+        self.assertEqual(self.search(TRIANGLE), [product_id(0), product_id(1)])
+
+        # Retracted after the first search
+        self.hub.search_entries.pop(0)
+        self.assertEqual(self.search(TRIANGLE), [product_id(0), product_id(1)])
+        self.now += footprint_index.DEFAULT_COVERAGE_TTL + 1
+        self.assertEqual(self.search(TRIANGLE), [product_id(1)])
+        self.assertEqual(
+            self.index.db.execute(
+                "SELECT COUNT(*) FROM footprints WHERE uuid = ?", (product_id(0),)
+            ).fetchone()[0],
+            0,
+        )
+
+    def test_unresolvable_dates_go_to_the_hub(self):
+        for _ in range(2):
+            self.search(TRIANGLE, ("NOW-30DAYS", "NOW"))
+
+        self.assertEqual(len(self.search_queries()), 2)
+        self.assertEqual(self.index.gap_searches, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from .. import download_scheduler
+from .. import hedged_download
+from ..utils import TaskStatus
+
+PRODUCT = {"uuid": "5f0c6c8e", "name": "S1A_IW_GRDH_TEST"}
+
+
+def mirror(name, chunks=4, delay=0.0, first_byte_delay=0.0, fail=False):
+    """Fake source writing ``name`` into the zip, ``delay`` seconds per chunk."""
+
+    def download(product, dest_dir, progress):
+        path = Path(dest_dir, product["name"] + ".zip")
+        try:
+            deadline = time.monotonic() + first_byte_delay
+            while time.monotonic() < deadline:
+                progress(0, None)
+                time.sleep(0.01)
+
+            if fail:
+                return TaskStatus(False, f"{name} returned 404", None)
+
+            with open(path, "wb") as f:
+                for i in range(chunks):
+                    time.sleep(delay)
+                    f.write(name.encode())
+                    progress((i + 1) * len(name), None)
+        except Exception as e:
+            return TaskStatus(False, "An exception occured while trying to download.", e)
+
+        return TaskStatus(True, "Download successful", str(path))
+
+    return download
+
+
+class TestHedgedDownload(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dest = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def zip_bytes(self):
+        return Path(self.dest, PRODUCT["name"] + ".zip").read_bytes()
+
+    def assertNoTempDirs(self):
+        self.assertEqual(
+            [p.name for p in Path(self.dest).iterdir()], [PRODUCT["name"] + ".zip"]
+        )
+
+    def test_fast_primary_is_not_hedged(self):
+        result = hedged_download.hedged_download(
+            [("ASF", mirror("ASF")), ("ESA", mirror("ESA"))],
+            PRODUCT,
+            self.dest,
+            hedge_delay=1.0,
+        )
+
+        self.assertEqual(result.source, "ASF")
+        self.assertFalse(result.hedged)
+        self.assertEqual([a.source for a in result.attempts], ["ASF"])
+        self.assertEqual(self.zip_bytes(), b"ASF" * 4)
+        self.assertNoTempDirs()
+
+    def test_stalled_primary_is_hedged_and_cancelled(self):
+        result = hedged_download.hedged_download(
+            [("ASF", mirror("ASF", first_byte_delay=10)), ("ESA", mirror("ESA"))],
+            PRODUCT,
+            self.dest,
+            hedge_delay=0.1,
+            poll_interval=0.02,
+        )
+        # Give the cancelled primary a moment to unwind and clean up
+        time.sleep(0.1)
+
+        self.assertEqual(result.source, "ESA")
+        self.assertTrue(result.hedged)
+        attempts = {a.source: a for a in result.attempts}
+        self.assertIsInstance(
+            attempts["ASF"].task_status.data, hedged_download.HedgeCancelled
+        )
+        self.assertEqual(self.zip_bytes(), b"ESA" * 4)
+        self.assertNoTempDirs()
+
+    def test_slow_primary_is_hedged(self):
+        result = hedged_download.hedged_download(
+            [("ASF", mirror("ASF", chunks=50, delay=0.05)), ("ESA", mirror("ESA"))],
+            PRODUCT,
+            self.dest,
+            hedge_delay=0.1,
+            min_throughput=10 ** 6,
+            poll_interval=0.02,
+        )
+        time.sleep(0.1)
+
+        self.assertEqual(result.source, "ESA")
+        self.assertTrue(result.hedged)
+        self.assertNoTempDirs()
+
+    def test_failed_primary_fails_over_without_waiting(self):
+        start = time.monotonic()
+        result = hedged_download.hedged_download(
+            [("ASF", mirror("ASF", fail=True)), ("ESA", mirror("ESA"))],
+            PRODUCT,
+            self.dest,
+            hedge_delay=30,
+        )
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(result.source, "ESA")
+        self.assertFalse(result.hedged)
+        self.assertNoTempDirs()
+
+    def test_all_sources_fail(self):
+        result = hedged_download.hedged_download(
+            [("ASF", mirror("ASF", fail=True)), ("ESA", mirror("ESA", fail=True))],
+            PRODUCT,
+            self.dest,
+            hedge_delay=30,
+        )
+
+        self.assertIsNone(result.source)
+        self.assertFalse(result.task_status.status)
+        self.assertEqual(os.listdir(self.dest), [])
+
+    def test_retry_resumes_partial_files(self):
+        seen = []
+
+        def resumable(name):
+            def download(product, dest_dir, progress):
+                part = Path(dest_dir, product["name"] + ".zip.part")
+                retry = any(source == name for source, _ in seen)
+                seen.append((name, part.read_bytes() if part.exists() else None))
+                with open(part, "ab") as f:
+                    f.write(name.encode())
+                if not retry:
+                    return TaskStatus(False, "Connection reset", None)
+                path = Path(dest_dir, product["name"] + ".zip")
+                os.replace(part, path)
+                return TaskStatus(True, "Download successful", str(path))
+
+            return download
+
+        # Left by an interrupted sequential download
+        Path(self.dest, PRODUCT["name"] + ".zip.part").write_bytes(b"SEQ")
+        sources = [("ASF", resumable("ASF")), ("ESA", resumable("ESA"))]
+
+        first = hedged_download.hedged_download(sources, PRODUCT, self.dest, hedge_delay=30)
+        second = hedged_download.hedged_download(sources, PRODUCT, self.dest, hedge_delay=30)
+
+        self.assertIsNone(first.source)
+        self.assertEqual(second.source, "ASF")
+        self.assertEqual(seen, [("ASF", b"SEQ"), ("ESA", None), ("ASF", b"SEQASF")])
+        self.assertEqual(self.zip_bytes(), b"SEQASFASF")
+        self.assertNoTempDirs()
+
+    def test_scheduler_records_hedge_outcome(self):
+        scheduler = download_scheduler.DownloadScheduler(
+            {
+                "ASF": mirror("ASF", first_byte_delay=10),
+                "ESA": mirror("ESA"),
+            },
+            hedge_delay=0.1,
+        )
+
+        result = scheduler.download(PRODUCT, self.dest)
+        time.sleep(0.1)
+
+        self.assertEqual(result.source, "ESA")
+        self.assertEqual(scheduler.health["ESA"].successes, 1)
+        # The cancelled loser is not counted as a failure
+        self.assertEqual(scheduler.health["ASF"].failures, 0)
+        self.assertEqual(scheduler.rank_sources(), ["ESA", "ASF"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+import unittest
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from .. import http_download
+from .. import s2_downloader
+from .stand_in_server import StandInHub
+
+PRODUCT_ID = "6574b5fa-3898-4c9e-9c36-028193764211"
+PRODUCT_BYTES = os.urandom(3 * 1024 * 1024 + 17)
+PRODUCT_MD5 = ("MD5", hashlib.md5(PRODUCT_BYTES).hexdigest().upper())
+
+
+class TestHttpDownload(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = Path(self.temp_dir.name, "product.zip")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_split_ranges_covers_file(self):
+        ranges = http_download.split_ranges(100, 3, min_segment_size=10)
+
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], 99)
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end + 1, start)
+
+    def test_split_ranges_respects_min_segment_size(self):
+        ranges = http_download.split_ranges(100, 8, min_segment_size=40)
+
+        self.assertEqual(ranges, [(0, 49), (50, 99)])
+
+    def test_segmented_download(self):
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            written = http_download.download_to_file(
+                url, self.file_path, segments=4, min_segment_size=512 * 1024
+            )
+            range_requests = [h.get("Range") for _, h in hub.requests]
+
+        self.assertEqual(written, len(PRODUCT_BYTES))
+        self.assertEqual(self.file_path.read_bytes(), PRODUCT_BYTES)
+        # probe plus one request per segment
+        self.assertEqual(len(range_requests), 5)
+
+    def test_segmented_download_falls_back_without_range(self):
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}, support_range=False) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            http_download.download_to_file(url, self.file_path, segments=4)
+            request_count = len(hub.requests)
+
+        self.assertEqual(self.file_path.read_bytes(), PRODUCT_BYTES)
+        self.assertEqual(request_count, 1)
+
+    def test_download_missing_product_raises(self):
+        with StandInHub() as hub:
+            url = f"{hub.base_url}/odata/v1/Products('missing')/$value"
+
+            with self.assertRaises(http_download.DownloadError):
+                http_download.download_to_file(url, self.file_path)
+
+    def test_interrupted_download_keeps_part_file(self):
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            hub.drop_after = 1024 * 1024
+
+            with self.assertRaises(Exception):
+                http_download.download_to_file(url, self.file_path)
+
+        self.assertFalse(self.file_path.exists())
+
+        # The .part is preallocated, the state file records what arrived
+        part = http_download.part_path(self.file_path)
+        self.assertEqual(part.stat().st_size, len(PRODUCT_BYTES))
+        state = http_download.load_state(http_download.state_path(self.file_path))
+        self.assertEqual(state["segments"], [[0, len(PRODUCT_BYTES) - 1, 1024 * 1024]])
+        self.assertEqual(part.read_bytes()[: 1024 * 1024], PRODUCT_BYTES[: 1024 * 1024])
+
+    def test_interrupted_download_resumes_from_state(self):
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            hub.drop_after = 1024 * 1024
+
+            with self.assertRaises(Exception):
+                http_download.download_to_file(url, self.file_path)
+
+            http_download.download_to_file(url, self.file_path)
+            range_header = hub.requests[-1][1].get("Range")
+
+        self.assertEqual(range_header, f"bytes={1024 * 1024}-{len(PRODUCT_BYTES) - 1}")
+        self.assertEqual(self.file_path.read_bytes(), PRODUCT_BYTES)
+        self.assertFalse(http_download.state_path(self.file_path).exists())
+
+    def test_resume_single_stream(self):
+        part = http_download.part_path(self.file_path)
+        part.write_bytes(PRODUCT_BYTES[:1000])
+
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            http_download.download_to_file(url, self.file_path)
+            range_header = hub.requests[0][1].get("Range")
+
+        self.assertEqual(range_header, "bytes=1000-")
+        self.assertEqual(self.file_path.read_bytes(), PRODUCT_BYTES)
+        self.assertFalse(part.exists())
+
+    def test_resume_restarts_when_range_ignored(self):
+        part = http_download.part_path(self.file_path)
+        part.write_bytes(b"stale bytes")
+
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}, support_range=False) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            http_download.download_to_file(url, self.file_path)
+
+        self.assertEqual(self.file_path.read_bytes(), PRODUCT_BYTES)
+
+    def test_resume_segmented(self):
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            hub.drop_after = 4096
+
+            with self.assertRaises(Exception):
+                http_download.download_to_file(
+                    url,
+                    self.file_path,
+                    segments=3,
+                    min_segment_size=512 * 1024,
+                )
+
+            state = http_download.load_state(http_download.state_path(self.file_path))
+            self.assertIsNotNone(state)
+
+            http_download.download_to_file(
+                url, self.file_path, segments=3, min_segment_size=512 * 1024
+            )
+
+        self.assertEqual(self.file_path.read_bytes(), PRODUCT_BYTES)
+        self.assertFalse(http_download.state_path(self.file_path).exists())
+
+    def test_checksum_verified_in_flight(self):
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            http_download.download_to_file(url, self.file_path, checksum=PRODUCT_MD5)
+
+        self.assertEqual(self.file_path.read_bytes(), PRODUCT_BYTES)
+
+    def test_checksum_verified_after_resume(self):
+        http_download.part_path(self.file_path).write_bytes(PRODUCT_BYTES[:5000])
+
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            http_download.download_to_file(url, self.file_path, checksum=PRODUCT_MD5)
+
+        self.assertEqual(self.file_path.read_bytes(), PRODUCT_BYTES)
+
+    def test_full_size_part_without_state_is_downloaded_again(self):
+        # What an interrupted preallocation leaves behind
+        part = http_download.part_path(self.file_path)
+        part.write_bytes(bytes(len(PRODUCT_BYTES)))
+
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            http_download.download_to_file(url, self.file_path)
+            self.assertEqual(self.file_path.read_bytes(), PRODUCT_BYTES)
+
+            part.write_bytes(PRODUCT_BYTES)
+            http_download.download_to_file(url, self.file_path, checksum=PRODUCT_MD5)
+            requests = len(hub.requests)
+
+        self.assertEqual(self.file_path.read_bytes(), PRODUCT_BYTES)
+        # The verified complete .part was kept, one 416 response
+        self.assertEqual(requests, 3)
+
+    def test_checksum_verified_segmented(self):
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            http_download.download_to_file(
+                url,
+                self.file_path,
+                segments=3,
+                min_segment_size=512 * 1024,
+                checksum=PRODUCT_MD5,
+            )
+
+        self.assertEqual(self.file_path.read_bytes(), PRODUCT_BYTES)
+
+    def test_checksum_mismatch_discards_part(self):
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+
+            with self.assertRaises(http_download.ChecksumMismatch):
+                http_download.download_to_file(
+                    url, self.file_path, checksum=("MD5", "0" * 32)
+                )
+
+        self.assertFalse(self.file_path.exists())
+        self.assertFalse(http_download.part_path(self.file_path).exists())
+
+    def test_download_fullproduct_segmented(self):
+        s2_dl = s2_downloader.S2Downloader(username="user", password="pass")
+
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            s2_dl.copernicus_url = hub.base_url
+            result = s2_dl.download_fullproduct(
+                PRODUCT_ID, "S2A_TEST", self.temp_dir.name, segments=2
+            )
+
+        self.assertTrue(result.status)
+        self.assertEqual(Path(result.data).read_bytes(), PRODUCT_BYTES)
+
+    def test_download_fullproduct_callback_reports_progress(self):
+        s2_dl = s2_downloader.S2Downloader(username="user", password="pass")
+        percents = []
+
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            s2_dl.copernicus_url = hub.base_url
+            result = s2_dl.download_fullproduct_callback(
+                PRODUCT_ID, "S2A_TEST", self.temp_dir.name, percents.append
+            )
+
+        self.assertTrue(result.status)
+        self.assertEqual(percents[-1], 100)
+        self.assertEqual(percents, sorted(percents))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+import requests
+
+from .. import http_session
+from .stand_in_server import StandInHub
+
+PRODUCT_ID = "2b17b57d-fff4-4645-b539-91f305c27c69"
+
+
+class TestHttpSession(unittest.TestCase):
+    def tearDown(self):
+        http_session.configure(host_limits={})
+
+    def test_session_is_shared(self):
+        self.assertIs(http_session.get_session(), http_session.get_session())
+
+    def test_host_limits_mount_blocking_pool(self):
+        http_session.configure(host_limits={"scihub.copernicus.eu": 2})
+
+        adapter = http_session.get_session().get_adapter(
+            "https://scihub.copernicus.eu/dhus/odata/v1/Products"
+        )
+
+        self.assertEqual(adapter._pool_maxsize, 2)
+        self.assertTrue(adapter._pool_block)
+
+    def test_configure_removes_old_host_limits(self):
+        http_session.configure(host_limits={"datapool.asf.alaska.edu": 4})
+        http_session.configure(host_limits={})
+
+        self.assertNotIn(
+            "https://datapool.asf.alaska.edu/", http_session.get_session().adapters
+        )
+
+    def test_unchanged_configure_keeps_pools(self):
+        http_session.configure(pool_maxsize=10, host_limits={"scihub.copernicus.eu": 2})
+        adapter = http_session.get_session().get_adapter("https://example.com/")
+        host_adapter = http_session.get_session().get_adapter(
+            "https://scihub.copernicus.eu/dhus/search"
+        )
+
+        http_session.configure(pool_maxsize=10, host_limits={"scihub.copernicus.eu": 2})
+
+        self.assertIs(http_session.get_session().get_adapter("https://example.com/"), adapter)
+        self.assertIs(
+            http_session.get_session().get_adapter("https://scihub.copernicus.eu/dhus/search"),
+            host_adapter,
+        )
+
+    def test_share_adapters(self):
+        other = requests.Session()
+        http_session.share_adapters(other)
+
+        self.assertIs(
+            other.get_adapter("https://example.com/"),
+            http_session.get_session().get_adapter("https://example.com/"),
+        )
+
+    def test_connections_are_reused(self):
+        with StandInHub({PRODUCT_ID: b"0123456789"}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            for _ in range(5):
+                r = http_session.get_session().get(url)
+                self.assertEqual(r.content, b"0123456789")
+            connections = hub.connections
+
+        self.assertEqual(connections, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+
+from .. import lta_orchestrator
+from .. import s2_downloader
+from .stand_in_server import StandInHub
+
+PRODUCT_IDS = [f"0000000{i}-bc41-4c43-adae-be4dfa03ad5f" for i in range(6)]
+
+
+class TestLTAOrchestrator(unittest.TestCase):
+    def setUp(self):
+        self.s2_dl = s2_downloader.S2Downloader(username="user", password="pass")
+        self.products = [{"uuid": uuid, "name": f"P{i}"} for i, uuid in enumerate(PRODUCT_IDS)]
+
+    def stand_in_hub(self):
+        hub = StandInHub({uuid: b"zip" for uuid in PRODUCT_IDS})
+        # First product is already online, the rest are in the LTA
+        hub.offline = set(PRODUCT_IDS[1:])
+        return hub
+
+    def test_check_products_online_is_batched(self):
+        with self.stand_in_hub() as hub:
+            self.s2_dl.copernicus_url = hub.base_url
+            online = self.s2_dl.check_products_online(
+                PRODUCT_IDS + ["unknown"], batch_size=3
+            )
+            paths = [path for path, _ in hub.requests]
+
+        self.assertEqual(len(paths), 3)
+        self.assertTrue(online[PRODUCT_IDS[0]])
+        self.assertFalse(any(online[uuid] for uuid in PRODUCT_IDS[1:]))
+        self.assertNotIn("unknown", online)
+
+    def test_trigger_retrieval_statuses(self):
+        with self.stand_in_hub() as hub:
+            hub.lta_quota = 1
+            hub.retrieval_delay = 60
+            self.s2_dl.copernicus_url = hub.base_url
+
+            online = self.s2_dl.trigger_retrieval(PRODUCT_IDS[0])
+            triggered = self.s2_dl.trigger_retrieval(PRODUCT_IDS[1])
+            over_quota = self.s2_dl.trigger_retrieval(PRODUCT_IDS[2])
+
+        self.assertEqual(online.data, 200)
+        self.assertTrue(triggered.status)
+        self.assertEqual(triggered.data, 202)
+        self.assertFalse(over_quota.status)
+        self.assertEqual(over_quota.data, 403)
+
+    def test_run_retrieves_every_product_within_quota(self):
+        handed_off = []
+
+        with self.stand_in_hub() as hub:
+            hub.lta_quota = 2
+            hub.retrieval_delay = 0.1
+            self.s2_dl.copernicus_url = hub.base_url
+
+            orchestrator = lta_orchestrator.LTAOrchestrator(
+                self.s2_dl,
+                on_online=lambda product: handed_off.append(product["uuid"]),
+                quota=2,
+                trigger_interval=0,
+                initial_backoff=0.05,
+                max_backoff=0.2,
+                quota_backoff=0.05,
+            )
+            report = orchestrator.run(self.products, timeout=30)
+            value_requests = [p for p, _ in hub.requests if p.endswith("$value")]
+
+        self.assertCountEqual(report.online, PRODUCT_IDS)
+        self.assertEqual(report.failed, [])
+        self.assertCountEqual(handed_off, PRODUCT_IDS)
+        # The product that was online at the start was never triggered
+        self.assertFalse(any(PRODUCT_IDS[0] in p for p in value_requests))
+        self.assertEqual(len(value_requests), len(PRODUCT_IDS) - 1)
+
+    def test_quota_exceeded_pauses_triggers(self):
+        with self.stand_in_hub() as hub:
+            hub.lta_quota = 1
+            hub.retrieval_delay = 60
+            self.s2_dl.copernicus_url = hub.base_url
+
+            orchestrator = lta_orchestrator.LTAOrchestrator(
+                self.s2_dl,
+                on_online=lambda product: None,
+                quota=5,
+                trigger_interval=0,
+                quota_backoff=60,
+            )
+            orchestrator.add(self.products)
+            orchestrator.poll_once()
+
+        states = [orchestrator.requests[uuid].state for uuid in PRODUCT_IDS]
+        self.assertEqual(states[0], lta_orchestrator.ONLINE)
+        self.assertEqual(states[1], lta_orchestrator.TRIGGERED)
+        self.assertTrue(all(state == lta_orchestrator.QUEUED for state in states[2:]))
+        # One accepted trigger, one refused, then triggering stops
+        self.assertEqual(orchestrator.total_triggers, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
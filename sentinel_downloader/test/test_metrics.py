@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from .. import http_session
+from .. import metrics
+from .. import s2_downloader
+from .stand_in_server import StandInHub
+
+PRODUCT_ID = "5f0c6c8e-bc41-4c43-adae-be4dfa03ad5f"
+PRODUCT_BYTES = os.urandom(512 * 1024)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_prometheus_text(self):
+        requests_total = self.registry.counter(
+            "requests", "Requests", ("host", "status")
+        )
+        requests_total.inc(host="hub", status=200)
+        requests_total.inc(2, host="hub", status=200)
+        latency = self.registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            latency.observe(value)
+
+        text = self.registry.render_prometheus()
+
+        self.assertIn("# TYPE requests counter", text)
+        self.assertIn('requests_total{host="hub",status="200"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn("latency_seconds_count 4", text)
+        self.assertIn("latency_seconds_sum 3.65", text)
+
+    def test_conflicting_types(self):
+        self.registry.counter("things", "Things")
+        with self.assertRaises(ValueError):
+            self.registry.histogram("things", "Things")
+
+    def test_json_dump(self):
+        self.registry.counter("things", "Things", ("kind",)).inc(kind="a")
+
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = Path(directory, "metrics.json")
+            reporter = metrics.MetricsReporter(file_path, interval=60, registry=self.registry)
+            reporter.start()
+            reporter.stop()
+            dumped = json.loads(file_path.read_text())
+
+        self.assertEqual(
+            dumped["metrics"]["things"]["values"], [{"labels": {"kind": "a"}, "value": 1}]
+        )
+
+
+class TestDownloadMetrics(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.registry = metrics.get_registry()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_download_and_search_are_recorded(self):
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            hub.add_search_entry(PRODUCT_ID, "S2A_MSIL1C_20190620T181921_T12UXA_TEST")
+            host = hub.base_url.split("/")[2]
+            s2_dl = s2_downloader.S2Downloader(
+                username="user", password="pass", hub_url=hub.base_url
+            )
+            searches = self.registry.histogram(
+                "sentinel_query_results", "", ("query",), metrics.RESULT_BUCKETS
+            ).count(query="search_for_products_by_tile")
+
+            task_status = s2_dl.download_fullproduct(
+                PRODUCT_ID, "S2A_TEST", self.temp_dir.name
+            )
+            s2_dl.search_for_products_by_tile(["12UXA"], ("20190601", "20190701"))
+
+            server = metrics.serve_prometheus(0)
+            try:
+                address, port = server.server_address
+                self.assertEqual(address, "127.0.0.1")
+                text = http_session.get_session().get(f"http://127.0.0.1:{port}/metrics").text
+            finally:
+                server.shutdown()
+                server.server_close()
+
+        self.assertTrue(task_status.status)
+        self.assertEqual(
+            self.registry.counter("sentinel_transfer_bytes", "").value(host=host),
+            len(PRODUCT_BYTES),
+        )
+        # Checksum lookup, $value and the search
+        self.assertEqual(
+            self.registry.counter("sentinel_http_requests", "").value(
+                host=host, method="GET", status=200
+            ),
+            3,
+        )
+        self.assertEqual(
+            self.registry.histogram("sentinel_query_results", "").count(
+                query="search_for_products_by_tile"
+            ),
+            searches + 1,
+        )
+        self.assertIn(f'sentinel_transfer_bytes_total{{host="{host}"}}', text)
+        self.assertIn(f'sentinel_http_time_to_first_byte_seconds_count{{host="{host}"}}', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
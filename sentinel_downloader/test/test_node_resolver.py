@@ -0,0 +1,89 @@
+import io
+import tempfile
+import time
+import unittest
+
+from .. import node_resolver
+from .. import s2_downloader
+from .stand_in_server import StandInHub
+from .test_s2_nodes import L1C_GRANULE, L1C_ID, L1C_SAFE, L1C_TREE
+
+
+class TestNodeResolver(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.s2_dl = s2_downloader.S2Downloader(username="user", password="pass")
+        self.s2_dl.node_resolver.cache = node_resolver.NodeCache()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_build_download_url_is_cached(self):
+        with StandInHub() as hub:
+            hub.nodes = {L1C_ID: L1C_TREE}
+            self.s2_dl.copernicus_url = hub.base_url
+
+            url = self.s2_dl.build_download_url(L1C_ID)
+            first_requests = len(hub.requests)
+            self.assertEqual(self.s2_dl.build_download_url(L1C_ID), url)
+            self.s2_dl.download_bands(L1C_ID, ["B04"], self.temp_dir.name)
+            node_requests = [p for p, _ in hub.requests if p.endswith("/Nodes")]
+
+            task_status = self.s2_dl.download_tci(L1C_ID, self.temp_dir.name)
+
+        self.assertEqual(first_requests, 2)
+        # The TCI lookup already listed everything but IMG_DATA
+        self.assertEqual(len(node_requests), 3)
+        self.assertTrue(
+            url.endswith(
+                f"Nodes('{L1C_SAFE}')/Nodes('GRANULE')/Nodes('{L1C_GRANULE}')"
+                "/Nodes('IMG_DATA')/Nodes('T12UUA_20190628T182929_TCI.jp2')/$value"
+            )
+        )
+        self.assertTrue(task_status.status, task_status.data)
+
+    def test_resolve_missing_node(self):
+        with StandInHub() as hub:
+            hub.nodes = {L1C_ID: L1C_TREE}
+            product_url = f"{hub.base_url}/odata/v1/Products('{L1C_ID}')"
+
+            url = self.s2_dl.node_resolver.resolve(product_url, L1C_SAFE, "GRANULE")
+            with self.assertRaises(KeyError):
+                self.s2_dl.node_resolver.resolve(product_url, L1C_SAFE, "AUX_DATA")
+
+        self.assertTrue(url.endswith(f"Nodes('{L1C_SAFE}')/Nodes('GRANULE')"))
+
+    def test_cache_ttl_and_size(self):
+        cache = node_resolver.NodeCache(ttl=0.05, max_entries=2)
+        cache.put("a", ("a",))
+        cache.put("b", ("b",))
+        cache.get("a")
+        cache.put("c", ("c",))
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), ("a",))
+
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 1)
+
+    def test_parse_node_feed(self):
+        feed = (
+            b'<feed xmlns="http://www.w3.org/2005/Atom">'
+            b"<entry><id>https://hub/odata/v1/Products('x')/Nodes('A.SAFE')</id></entry>"
+            b"<entry><title>no id</title></entry>"
+            b"<entry><id>https://hub/odata/v1/Products('x')/Nodes('B')</id></entry>"
+            b"</feed>"
+        )
+
+        self.assertEqual(
+            node_resolver.parse_node_feed(io.BytesIO(feed)),
+            [
+                ("A.SAFE", "https://hub/odata/v1/Products('x')/Nodes('A.SAFE')"),
+                ("B", "https://hub/odata/v1/Products('x')/Nodes('B')"),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
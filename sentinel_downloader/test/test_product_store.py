@@ -0,0 +1,182 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from .. import product_store
+from .. import s2_downloader
+from .stand_in_server import StandInHub
+
+PRODUCT_ID = "5f0c6c8e-bc41-4c43-adae-be4dfa03ad5f"
+PRODUCT_BYTES = os.urandom(256 * 1024)
+
+
+class TestProductStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.store = product_store.ProductStore(self.root / "store", max_bytes=2500)
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def staged(self, name, size):
+        path = self.root / name
+        path.write_bytes(b"x" * size)
+        return path
+
+    def test_add_and_get(self):
+        self.store.add("a", self.staged("a.zip", 1000), ("MD5", "ABC"))
+
+        self.assertEqual(self.store.get("a").size, 1000)
+        self.assertEqual(self.store.get("missing", ("md5", "abc")).uuid, "a")
+        # A different checksum for the same uuid means the entry is stale
+        self.assertIsNone(self.store.get("a", ("MD5", "DEF")))
+        self.assertIsNone(self.store.get("a"))
+
+    def test_lru_eviction(self):
+        self.store.add("a", self.staged("a.zip", 1000))
+        time.sleep(0.01)
+        self.store.add("b", self.staged("b.zip", 1000))
+        time.sleep(0.01)
+        self.store.get("a")
+        self.store.add("c", self.staged("c.zip", 1000))
+
+        self.assertIsNotNone(self.store.get("a"))
+        self.assertIsNone(self.store.get("b"))
+        self.assertIsNotNone(self.store.get("c"))
+        self.assertEqual(self.store.total_size(), 2000)
+
+    def test_fetch_downloads_once_for_two_jobs(self):
+        downloads = []
+
+        def download(staging_path):
+            downloads.append(staging_path)
+            Path(staging_path).write_bytes(b"zip")
+            return product_store.TaskStatus(True, "Download successful", str(staging_path))
+
+        first = self.store.fetch("a", self.root / "job1" / "a.zip", download)
+        second = self.store.fetch("a", self.root / "job2" / "a.zip", download)
+
+        self.assertTrue(first.status and second.status)
+        self.assertEqual(len(downloads), 1)
+        self.assertEqual((self.root / "job2" / "a.zip").read_bytes(), b"zip")
+        # Materialized without a second copy of the data
+        stored = self.store.get("a").path
+        self.assertTrue(
+            os.path.samefile(stored, self.root / "job1" / "a.zip")
+            or (self.root / "job1" / "a.zip").stat().st_size == stored.stat().st_size
+        )
+
+    def test_fetch_downloads_once_across_stores(self):
+        # Separate instances on one root, as two processes would open it
+        other = product_store.ProductStore(self.root / "store", max_bytes=2500)
+        self.addCleanup(other.close)
+        downloads = []
+        results = {}
+
+        def download(staging_path):
+            downloads.append(staging_path)
+            time.sleep(0.2)
+            Path(staging_path).write_bytes(b"zip")
+            return product_store.TaskStatus(True, "Download successful", str(staging_path))
+
+        def fetch(store, job):
+            results[job] = store.fetch("a", self.root / job / "a.zip", download)
+
+        threads = [
+            threading.Thread(target=fetch, args=(store, job))
+            for store, job in ((self.store, "job1"), (other, "job2"))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(results["job1"].status and results["job2"].status)
+        self.assertEqual(len(downloads), 1)
+        for job in ("job1", "job2"):
+            self.assertEqual((self.root / job / "a.zip").read_bytes(), b"zip")
+
+    def test_eviction_skips_products_being_fetched(self):
+        self.store.add("a", self.staged("a.zip", 1000))
+        self.store.add("b", self.staged("b.zip", 1000))
+
+        with product_store.file_lock(self.store.lock_path("a")):
+            self.store.add("c", self.staged("c.zip", 1000))
+
+        self.assertIsNotNone(self.store.get("a"))
+        self.assertIsNone(self.store.get("b"))
+
+    def test_lock_files_are_removed(self):
+        def download(staging_path):
+            Path(staging_path).write_bytes(b"x" * 1000)
+            return product_store.TaskStatus(True, "Download successful", str(staging_path))
+
+        for uuid in "abc":
+            self.store.fetch(uuid, self.root / "job" / f"{uuid}.zip", download)
+
+        self.assertEqual(self.store.get("a"), None)
+        # Only the store wide eviction lock stays
+        self.assertEqual(
+            [path.name for path in self.store.staging_dir.glob("*.lock")], ["evict.lock"]
+        )
+
+    def test_checksum_match_is_locked_while_materialized(self):
+        self.store.add("a", self.staged("a.zip", 1000), ("MD5", "ABC"))
+        locked_during_materialize = []
+        materialize = product_store.materialize
+
+        def checking_materialize(src, dst):
+            with product_store.file_lock(self.store.lock_path("a"), blocking=False) as locked:
+                locked_during_materialize.append(not locked)
+            return materialize(src, dst)
+
+        product_store.materialize = checking_materialize
+        self.addCleanup(setattr, product_store, "materialize", materialize)
+
+        task_status = self.store.fetch(
+            "b", self.root / "job" / "b.zip", None, checksum=("md5", "abc")
+        )
+
+        self.assertTrue(task_status.status)
+        self.assertEqual(locked_during_materialize, [True])
+
+    def test_failed_download_is_not_stored(self):
+        def download(staging_path):
+            return product_store.TaskStatus(False, "404", None)
+
+        task_status = self.store.fetch("a", self.root / "job1" / "a.zip", download)
+
+        self.assertFalse(task_status.status)
+        self.assertIsNone(self.store.get("a"))
+
+    def test_s2_downloader_uses_store(self):
+        s2_dl = s2_downloader.S2Downloader(username="user", password="pass")
+        s2_dl.product_store = self.store
+        self.store.max_bytes = None
+
+        with StandInHub({PRODUCT_ID: PRODUCT_BYTES}) as hub:
+            s2_dl.copernicus_url = hub.base_url
+            for job in ("job1", "job2"):
+                task_status = s2_dl.download_fullproduct(
+                    PRODUCT_ID, "S2A_TEST", str(self.root / job)
+                )
+                self.assertTrue(task_status.status)
+            value_requests = [p for p, _ in hub.requests if p.endswith("$value")]
+
+        self.assertEqual(len(value_requests), 1)
+        for job in ("job1", "job2"):
+            self.assertEqual((self.root / job / "S2A_TEST.zip").read_bytes(), PRODUCT_BYTES)
+        self.assertEqual(
+            self.store.get(PRODUCT_ID).checksum,
+            f"MD5:{hashlib.md5(PRODUCT_BYTES).hexdigest()}",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import datetime
+import tempfile
+import unittest
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from .. import query_cache
+from .. import rate_limiter
+from .. import s2_downloader
+from .stand_in_server import StandInHub
+
+
+def product_id(i):
+    return f"{i:08d}-b95f-44f6-aa7e-bccbe4b00c4f"
+
+
+def add_product(hub, i, ingested):
+    hub.add_search_entry(
+        product_id(i),
+        f"S2B_MSIL1C_20190628T182929_N0207_R027_T12UUA_20190628T{i:06d}",
+        ingestiondate=ingested,
+        cloudcoverpercentage=10.0 * i,
+    )
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.now = 1000.0
+        self.cache = self.open_cache()
+
+    def tearDown(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+
+    def open_cache(self):
+        return query_cache.QueryCache(
+            Path(self.temp_dir.name, "queries.sqlite"),
+            ttl=60,
+            full_refresh_interval=3600,
+            clock=lambda: self.now,
+        )
+
+    def search_queries(self, hub):
+        return [
+            parse_qs(urlsplit(path).query)["q"][0]
+            for path, _ in hub.requests
+            if path.startswith("/dhus/search")
+        ]
+
+    def test_query_key_is_normalized(self):
+        self.assertEqual(
+            query_cache.query_key(platformname="Sentinel-2", date=("20190601", "20190701")),
+            query_cache.query_key(
+                date=(datetime.datetime(2019, 6, 1), "20190701"), platformname="Sentinel-2"
+            ),
+        )
+        self.assertNotEqual(
+            query_cache.query_key(platformname="Sentinel-2"),
+            query_cache.query_key(platformname="Sentinel-2", limit=10),
+        )
+
+    def test_hit_then_incremental_refresh(self):
+        with StandInHub() as hub:
+            add_product(hub, 1, datetime.datetime(2019, 6, 28, 20, 0))
+            add_product(hub, 2, datetime.datetime(2019, 6, 29, 20, 0))
+            api = s2_downloader.SentinelAPI("user", "pass", hub.base_url)
+
+            first = self.cache.query(api, raw="filename:*T12UUA*")
+            self.now += 30
+            second = self.cache.query(api, raw="filename:*T12UUA*")
+
+            add_product(hub, 3, datetime.datetime(2019, 6, 30, 20, 0))
+            self.now += 60
+            refreshed = self.cache.query(api, raw="filename:*T12UUA*")
+            queries = self.search_queries(hub)
+
+        self.assertEqual(list(first), [product_id(1), product_id(2)])
+        self.assertEqual(second, first)
+        self.assertEqual(list(refreshed), [product_id(1), product_id(2), product_id(3)])
+        self.assertEqual(refreshed[product_id(3)]["cloudcoverpercentage"], 30.0)
+        self.assertEqual(
+            refreshed[product_id(1)]["ingestiondate"], datetime.datetime(2019, 6, 28, 20, 0)
+        )
+        self.assertEqual((self.cache.hits, self.cache.refreshes, self.cache.misses), (1, 1, 1))
+        self.assertEqual(len(queries), 2)
+        self.assertIn('ingestiondate:["2019-06-29T20:00:00Z" TO "NOW"]', queries[1])
+
+    def test_relative_dates_are_refreshed_in_full(self):
+        with StandInHub() as hub:
+            add_product(hub, 1, datetime.datetime(2019, 6, 28, 20, 0))
+            api = s2_downloader.SentinelAPI("user", "pass", hub.base_url)
+
+            for _ in range(2):
+                products = self.cache.query(
+                    api, raw="filename:*T12UUA*", date=("NOW-10000DAYS", "NOW")
+                )
+                self.now += 60
+            queries = self.search_queries(hub)
+
+        self.assertEqual(list(products), [product_id(1)])
+        self.assertEqual((self.cache.refreshes, self.cache.misses), (0, 2))
+        self.assertNotIn("ingestiondate", queries[1])
+
+    def test_full_refresh_and_persistence(self):
+        with StandInHub() as hub:
+            add_product(hub, 1, datetime.datetime(2019, 6, 28, 20, 0))
+            add_product(hub, 2, datetime.datetime(2019, 6, 29, 20, 0))
+            api = s2_downloader.SentinelAPI("user", "pass", hub.base_url)
+
+            self.cache.query(api, raw="filename:*T12UUA*")
+            self.cache.close()
+            self.cache = self.open_cache()
+            cached = self.cache.query(api, raw="filename:*T12UUA*")
+
+            # Gone from the hub, only a full refresh notices
+            hub.search_entries.pop(0)
+            self.now += 3600
+            refreshed = self.cache.query(api, raw="filename:*T12UUA*")
+
+        self.assertEqual(len(cached), 2)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(list(refreshed), [product_id(2)])
+
+    def test_s2_downloader_searches_use_cache(self):
+        with StandInHub() as hub:
+            add_product(hub, 1, datetime.datetime(2019, 6, 28, 20, 0))
+            s2_dl = s2_downloader.S2Downloader(
+                username="user", password="pass", hub_url=hub.base_url
+            )
+            s2_dl.search_rate_limiter = rate_limiter.RateLimiter(100, burst=4)
+            s2_dl.query_cache = self.cache
+
+            for _ in range(3):
+                results = s2_dl.search_for_products_by_tile(["12UUA"], ("20190601", "20190701"))
+            queries = self.search_queries(hub)
+
+        self.assertEqual(list(results), [product_id(1)])
+        self.assertEqual(results[product_id(1)]["api_source"], "esa_scihub")
+        self.assertEqual(len(queries), 1)
+
+    def test_cache_misses_load_pages_concurrently(self):
+        with StandInHub() as hub:
+            for i in range(250):
+                add_product(hub, i, datetime.datetime(2019, 6, 28, 20, 0))
+            s2_dl = s2_downloader.S2Downloader(
+                username="user", password="pass", hub_url=hub.base_url
+            )
+            s2_dl.search_rate_limiter = rate_limiter.RateLimiter(100, burst=4)
+            s2_dl.query_cache = self.cache
+            hub.latency = 0.1
+
+            for _ in range(2):
+                results = dict(s2_dl.iter_query(raw="filename:*T12UUA*"))
+            starts = [
+                parse_qs(urlsplit(path).query)["start"][0]
+                for path, _ in hub.requests
+                if path.startswith("/dhus/search")
+            ]
+            max_active = hub.max_active
+
+        self.assertEqual(set(results), {product_id(i) for i in range(250)})
+        self.assertEqual(sorted(starts), ["0", "100", "200"])
+        self.assertGreater(max_active, 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
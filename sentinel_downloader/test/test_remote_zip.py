@@ -0,0 +1,105 @@
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+from .. import remote_zip
+from .. import s2_downloader
+from .stand_in_server import StandInHub
+
+PRODUCT_ID = "a8f318d3-b95f-44f6-aa7e-bccbe4b00c4f"
+SAFE = "S2B_MSIL1C_20190628T182929_N0207_R027_T12UUA_20190628T221748.SAFE"
+IMG_DATA = f"{SAFE}/GRANULE/L1C_T12UUA_A012065_20190628T183312/IMG_DATA"
+
+MEMBERS = {
+    f"{SAFE}/manifest.safe": b"<manifest/>" * 100,
+    f"{SAFE}/MTD_MSIL1C.xml": b"<metadata/>" * 100,
+    f"{IMG_DATA}/T12UUA_20190628T182929_B04.jp2": os.urandom(2 * 1024 * 1024),
+    f"{IMG_DATA}/T12UUA_20190628T182929_B08.jp2": os.urandom(2 * 1024 * 1024),
+    f"{IMG_DATA}/T12UUA_20190628T182929_TCI.jp2": os.urandom(2 * 1024 * 1024),
+}
+
+
+def build_zip():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in MEMBERS.items():
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+ZIP_BYTES = build_zip()
+
+
+class TestRemoteZip(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.s2_dl = s2_downloader.S2Downloader(username="user", password="pass")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_list_and_read_metadata_costs_kilobytes(self):
+        with StandInHub({PRODUCT_ID: ZIP_BYTES}) as hub:
+            self.s2_dl.copernicus_url = hub.base_url
+
+            with self.s2_dl.open_remote_zip(PRODUCT_ID) as remote:
+                names = remote.namelist()
+                manifest = remote.read(remote.find("manifest.safe"))
+                fetched = remote.bytes_fetched
+
+        self.assertEqual(sorted(names), sorted(MEMBERS))
+        self.assertEqual(manifest, MEMBERS[f"{SAFE}/manifest.safe"])
+        self.assertLess(fetched, 200 * 1024)
+
+    def test_extract_single_band(self):
+        with StandInHub({PRODUCT_ID: ZIP_BYTES}) as hub:
+            self.s2_dl.copernicus_url = hub.base_url
+            task_status = self.s2_dl.extract_product_members(
+                PRODUCT_ID,
+                ["MTD_MSIL1C.xml", "T12UUA_20190628T182929_B04.jp2"],
+                self.temp_dir.name,
+            )
+            request_count = len(hub.requests)
+
+        self.assertTrue(task_status.status, task_status.data)
+        b04 = Path(self.temp_dir.name, IMG_DATA, "T12UUA_20190628T182929_B04.jp2")
+        self.assertEqual(b04.read_bytes(), MEMBERS[f"{IMG_DATA}/T12UUA_20190628T182929_B04.jp2"])
+        self.assertEqual(
+            Path(self.temp_dir.name, SAFE, "MTD_MSIL1C.xml").read_bytes(),
+            MEMBERS[f"{SAFE}/MTD_MSIL1C.xml"],
+        )
+        # Sequential reads grow the request size, a 2 MB member takes a few requests
+        self.assertLess(request_count, 20)
+
+    def test_missing_member(self):
+        with StandInHub({PRODUCT_ID: ZIP_BYTES}) as hub:
+            self.s2_dl.copernicus_url = hub.base_url
+            task_status = self.s2_dl.extract_product_members(
+                PRODUCT_ID, ["MTD_MSIL2A.xml"], self.temp_dir.name
+            )
+
+        self.assertFalse(task_status.status)
+
+    def test_range_required(self):
+        with StandInHub({PRODUCT_ID: ZIP_BYTES}, support_range=False) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            with self.assertRaises(remote_zip.DownloadError):
+                remote_zip.RemoteZip(url)
+
+    def test_small_file_smaller_than_tail(self):
+        small = io.BytesIO()
+        with zipfile.ZipFile(small, "w") as zf:
+            zf.writestr("a.txt", b"hello")
+
+        with StandInHub({PRODUCT_ID: small.getvalue()}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            with remote_zip.RemoteZip(url) as remote:
+                self.assertEqual(remote.read("a.txt"), b"hello")
+                self.assertEqual(remote.file.requests, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
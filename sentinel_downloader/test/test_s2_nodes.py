@@ -0,0 +1,143 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from .. import s2_downloader
+from .stand_in_server import StandInHub
+
+L1C_ID = "a8f318d3-b95f-44f6-aa7e-bccbe4b00c4f"
+L1C_SAFE = "S2B_MSIL1C_20190628T182929_N0207_R027_T12UUA_20190628T221748.SAFE"
+L1C_GRANULE = "L1C_T12UUA_A012065_20190628T183312"
+
+L2A_ID = "bd22f901-a796-4553-acc9-73cbc34e0f40"
+L2A_SAFE = "S2A_MSIL2A_20190620T181921_N0212_R127_T12UXA_20190620T231306.SAFE"
+L2A_GRANULE = "L2A_T12UXA_A020859_20190620T182912"
+
+
+def band_files(prefix, bands, suffix=""):
+    return {f"{prefix}_{band}{suffix}.jp2": os.urandom(1024) for band in bands}
+
+
+L1C_TREE = {
+    L1C_SAFE: {
+        "GRANULE": {
+            L1C_GRANULE: {
+                "IMG_DATA": band_files(
+                    "T12UUA_20190628T182929", ["B02", "B03", "B04", "B08", "TCI"]
+                )
+            }
+        }
+    }
+}
+
+L2A_TREE = {
+    L2A_SAFE: {
+        "GRANULE": {
+            L2A_GRANULE: {
+                "IMG_DATA": {
+                    "R10m": band_files("T12UXA_20190620T181921", ["B02", "B04", "B08"], "_10m"),
+                    "R20m": band_files("T12UXA_20190620T181921", ["B04", "B8A", "SCL"], "_20m"),
+                    "R60m": band_files("T12UXA_20190620T181921", ["B04", "SCL"], "_60m"),
+                }
+            }
+        }
+    }
+}
+
+
+class TestS2Nodes(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.s2_dl = s2_downloader.S2Downloader(username="user", password="pass")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def stand_in_hub(self):
+        hub = StandInHub()
+        hub.nodes = {L1C_ID: L1C_TREE, L2A_ID: L2A_TREE}
+        return hub
+
+    def test_download_l2a_bands(self):
+        with self.stand_in_hub() as hub:
+            self.s2_dl.copernicus_url = hub.base_url
+            task_status = self.s2_dl.download_bands(
+                L2A_ID, ["B04", "B08", ("SCL", 60)], self.temp_dir.name
+            )
+
+        self.assertTrue(task_status.status, task_status.data)
+
+        img_data = Path(self.temp_dir.name, L2A_SAFE, "GRANULE", L2A_GRANULE, "IMG_DATA")
+        expected = {
+            ("R10m", "T12UXA_20190620T181921_B04_10m.jp2"),
+            ("R10m", "T12UXA_20190620T181921_B08_10m.jp2"),
+            ("R60m", "T12UXA_20190620T181921_SCL_60m.jp2"),
+        }
+        self.assertEqual(len(task_status.data), 3)
+        for folder, name in expected:
+            self.assertEqual(
+                (img_data / folder / name).read_bytes(),
+                L2A_TREE[L2A_SAFE]["GRANULE"][L2A_GRANULE]["IMG_DATA"][folder][name],
+            )
+
+    def test_download_l1c_bands(self):
+        with self.stand_in_hub() as hub:
+            self.s2_dl.copernicus_url = hub.base_url
+            task_status = self.s2_dl.download_bands(L1C_ID, ["B04", "B08"], self.temp_dir.name)
+            value_requests = [p for p, _ in hub.requests if p.endswith("$value")]
+
+        self.assertTrue(task_status.status, task_status.data)
+        self.assertEqual(len(value_requests), 2)
+
+        img_data = Path(self.temp_dir.name, L1C_SAFE, "GRANULE", L1C_GRANULE, "IMG_DATA")
+        self.assertEqual(
+            sorted(p.name for p in img_data.iterdir()),
+            ["T12UUA_20190628T182929_B04.jp2", "T12UUA_20190628T182929_B08.jp2"],
+        )
+
+    def test_download_tci_batch(self):
+        uuids = [f"0000000{i}-b95f-44f6-aa7e-bccbe4b00c4f" for i in range(8)]
+        tcis = {}
+
+        with self.stand_in_hub() as hub:
+            hub.latency = 0.05
+            for i, uuid in enumerate(uuids):
+                date = f"2019062{i}T182929"
+                tcis[uuid] = os.urandom(1024)
+                hub.nodes[uuid] = {
+                    f"S2B_MSIL1C_{date}_N0207_R027_T12UUA_{date}.SAFE": {
+                        "GRANULE": {
+                            L1C_GRANULE: {"IMG_DATA": {f"T12UUA_{date}_TCI.jp2": tcis[uuid]}}
+                        }
+                    }
+                }
+            self.s2_dl.copernicus_url = hub.base_url
+
+            results = list(
+                self.s2_dl.download_tci_batch(
+                    uuids + ["missing"], self.temp_dir.name, concurrency=4
+                )
+            )
+            max_active = hub.max_active
+
+        statuses = dict(results)
+        self.assertEqual(len(results), len(uuids) + 1)
+        self.assertFalse(statuses.pop("missing").status)
+        for uuid, task_status in statuses.items():
+            self.assertTrue(task_status.status, task_status.data)
+            self.assertEqual(Path(task_status.data).read_bytes(), tcis[uuid])
+        self.assertGreater(max_active, 1)
+        self.assertLessEqual(max_active, 8)
+
+    def test_missing_band_fails(self):
+        with self.stand_in_hub() as hub:
+            self.s2_dl.copernicus_url = hub.base_url
+            task_status = self.s2_dl.download_bands(L2A_ID, [("B08", 20)], self.temp_dir.name)
+
+        self.assertFalse(task_status.status)
+        self.assertIsInstance(task_status.data, ValueError)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+"""Searches against the stand-in hub, counting the requests they take."""
+import inspect
+import unittest
+from urllib.parse import parse_qs, urlsplit
+
+from .. import metrics
+from .. import rate_limiter
+from .. import s2_downloader
+from .. import search_batch
+from .stand_in_server import StandInHub
+
+
+def product_name(i, tile="12UUA"):
+    return f"S2B_MSIL1C_20190628T182929_N0207_R027_T{tile}_20190628T{i:06d}"
+
+
+def product_id(i):
+    return f"{i:08d}-b95f-44f6-aa7e-bccbe4b00c4f"
+
+
+class TestS2Search(unittest.TestCase):
+    def search_requests(self, hub):
+        return [path for path, _ in hub.requests if path.startswith("/dhus/search")]
+
+    def test_chunk_query_clauses(self):
+        clauses = [f"(filename:{product_name(i)}*)" for i in range(250)]
+
+        queries = search_batch.chunk_query_clauses(clauses, max_clauses=100)
+
+        self.assertEqual(" OR ".join(queries), " OR ".join(clauses))
+        for query in queries:
+            self.assertLessEqual(search_batch.SentinelAPI.check_query_length(query), 1.0)
+            self.assertLessEqual(query.count(" OR ") + 1, 100)
+
+        self.assertEqual(
+            search_batch.chunk_query_clauses(clauses[:5], max_clauses=2),
+            [" OR ".join(clauses[0:2]), " OR ".join(clauses[2:4]), clauses[4]],
+        )
+
+    def test_search_by_tile_is_batched(self):
+        tiles = [f"{zone}U{a}{b}" for zone in (11, 12) for a in "UVWX" for b in "ABCDEFGHJK"]
+        with StandInHub() as hub:
+            for i, tile in enumerate(tiles * 2):
+                hub.add_search_entry(product_id(i), product_name(i, tile))
+            s2_dl = s2_downloader.S2Downloader(
+                username="user", password="pass", hub_url=hub.base_url
+            )
+            s2_dl.search_rate_limiter = rate_limiter.RateLimiter(100, burst=4)
+
+            stream = s2_dl.iter_products_by_tile(tiles + tiles[:5], ("20190601", "20190701"))
+            first = next(stream)
+            results = dict([first, *stream])
+            requests = self.search_requests(hub)
+
+        self.assertEqual(len(results), len(tiles) * 2)
+        self.assertTrue(all(p["api_source"] == "esa_scihub" for p in results.values()))
+        # 80 tiles in groups of up to 50
+        self.assertEqual(len(requests), 2)
+
+    def test_pages_are_fetched_concurrently(self):
+        with StandInHub() as hub:
+            for i in range(350):
+                hub.add_search_entry(product_id(i), product_name(i))
+            s2_dl = s2_downloader.S2Downloader(
+                username="user", password="pass", hub_url=hub.base_url
+            )
+            s2_dl.search_rate_limiter = rate_limiter.RateLimiter(100, burst=4)
+            hub.latency = 0.1
+
+            stream = s2_dl.iter_query(raw="filename:S2B_MSIL1C_*")
+            first_page = [next(stream) for _ in range(100)]
+            requests_after_first_page = len(self.search_requests(hub))
+            results = dict(first_page + list(stream))
+
+            polygon = "POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))"
+            collected = s2_dl.search_for_products(
+                "Sentinel-2", polygon, {"date": ("20190601", "20190701")}
+            )
+            starts = [
+                parse_qs(urlsplit(path).query)["start"][0]
+                for path in self.search_requests(hub)
+            ]
+            max_active = hub.max_active
+
+        self.assertEqual(requests_after_first_page, 1)
+        self.assertEqual(set(results), {product_id(i) for i in range(350)})
+        self.assertEqual(list(collected), [product_id(i) for i in range(350)])
+        self.assertEqual(sorted(starts), sorted(["0", "100", "200", "300"] * 2))
+        self.assertGreater(max_active, 1)
+
+    def test_iter_products_streams(self):
+        results = metrics.get_registry().histogram(
+            "sentinel_query_results", "", ("query",), metrics.RESULT_BUCKETS
+        )
+        with StandInHub() as hub:
+            for i in range(250):
+                hub.add_search_entry(product_id(i), product_name(i))
+            s2_dl = s2_downloader.S2Downloader(
+                username="user", password="pass", hub_url=hub.base_url
+            )
+            s2_dl.search_rate_limiter = rate_limiter.RateLimiter(100, burst=4)
+            polygon = "POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))"
+            query_dict = {"date": ("20190601", "20190701")}
+            searches = results.count(query="search_for_products")
+
+            stream = s2_dl.iter_products("Sentinel-2", polygon, query_dict)
+            next(stream)
+            requests_for_first = len(self.search_requests(hub))
+            stream.close()
+            closed_early = results.count(query="search_for_products")
+
+            names = [product_name(i) for i in range(3)]
+            by_name = list(s2_dl.iter_products_by_name("Sentinel-2", names, {}, ordered=True))
+            streamed = list(s2_dl.iter_products("Sentinel-2", polygon, query_dict, ordered=True))
+
+        self.assertEqual(requests_for_first, 1)
+        self.assertEqual(closed_early, searches)
+        self.assertEqual([uuid for uuid, _ in by_name], [product_id(i) for i in range(3)])
+        self.assertEqual([uuid for uuid, _ in streamed], [product_id(i) for i in range(250)])
+        self.assertEqual(results.count(query="search_for_products"), searches + 1)
+
+    def test_search_by_footprint_streams(self):
+        with StandInHub() as hub:
+            for i in range(150):
+                hub.add_search_entry(product_id(i), product_name(i))
+            s2_dl = s2_downloader.S2Downloader(
+                username="user", password="pass", hub_url=hub.base_url
+            )
+            s2_dl.search_rate_limiter = rate_limiter.RateLimiter(100, burst=4)
+            polygon = "POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))"
+            date_range = ("2019-06-01T00:00:00Z", "2019-07-01T00:00:00Z")
+
+            stream = s2_dl.iter_products_by_footprint(polygon, date_range, product_type="L1C")
+            uuid, properties = next(stream)
+            requests_for_first = len(self.search_requests(hub))
+            stream.close()
+            products = s2_dl.search_for_products_by_footprint(
+                polygon, date_range, product_type="L1C"
+            )
+
+        self.assertEqual(requests_for_first, 1)
+        self.assertEqual(properties["api_source"], "esa_scihub")
+        self.assertEqual(list(products), [product_id(i) for i in range(150)])
+
+    def test_sentinelsat_internals(self):
+        # iter_query_pages relies on these private helpers, fail here rather
+        # than mid search when a sentinelsat upgrade changes them
+        load_subquery = inspect.signature(search_batch.SentinelAPI._load_subquery)
+        self.assertEqual(
+            list(load_subquery.parameters), ["self", "query", "order_by", "limit", "offset"]
+        )
+        self.assertEqual(search_batch._format_order_by("+ingestiondate"), "ingestiondate asc")
+        self.assertEqual(search_batch._parse_opensearch_response([]), {})
+
+        with StandInHub() as hub:
+            for i in range(3):
+                hub.add_search_entry(product_id(i), product_name(i))
+            s2_dl = s2_downloader.S2Downloader(
+                username="user", password="pass", hub_url=hub.base_url
+            )
+            api = s2_dl.search_api
+            entries, total = api._load_subquery(
+                api.format_query(raw="filename:S2B_MSIL1C_*"), "ingestiondate asc", 2, 0
+            )
+            products = search_batch._parse_opensearch_response(entries)
+
+        self.assertEqual(total, 3)
+        self.assertEqual(list(products), [product_id(0), product_id(1)])
+        self.assertEqual(products[product_id(0)]["title"], product_name(0))
+
+    def test_rate_limiter(self):
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        limiter = rate_limiter.RateLimiter(2, burst=2, clock=lambda: now[0], sleep=sleep)
+        waits = [limiter.acquire() for _ in range(4)]
+
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.5)
+        self.assertAlmostEqual(now[0], 1.0)
+
+    def test_search_by_name_is_batched(self):
+        with StandInHub() as hub:
+            for i in range(300):
+                hub.add_search_entry(product_id(i), product_name(i))
+            s2_dl = s2_downloader.S2Downloader(
+                username="user", password="pass", hub_url=hub.base_url
+            )
+
+            names = [product_name(i) for i in range(0, 300, 2)] + ["S2A_MISSING"]
+            results = s2_dl.search_for_products_by_name("Sentinel-2", names, {})
+            requests = self.search_requests(hub)
+
+        self.assertEqual(list(results), [product_id(i) for i in range(0, 300, 2)])
+        self.assertLess(len(requests), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""The stand-in hub itself: the endpoints and faults the other tests rely on."""
+import datetime
+import time
+import unittest
+
+from .. import http_session
+from .. import s2_downloader
+from .stand_in_server import StandInHub
+
+PRODUCT_ID = "a8f318d3-b95f-44f6-aa7e-bccbe4b00c4f"
+TILES = ["12UUA", "12UUB", "12UVA"]
+
+
+class TestStandInServer(unittest.TestCase):
+    def setUp(self):
+        self.session = http_session.get_session()
+
+    def test_search_through_sentinelsat(self):
+        with StandInHub() as hub:
+            for i, tile in enumerate(TILES):
+                hub.add_search_entry(
+                    f"{i}{PRODUCT_ID[1:]}",
+                    f"S2B_MSIL1C_20190628T182929_N0207_R027_T{tile}_20190628T221748",
+                    beginposition=datetime.datetime(2019, 6, 28, 18, 29, 29),
+                    cloudcoverpercentage=12.5,
+                    orbitnumber=12065,
+                )
+            s2_dl = s2_downloader.S2Downloader(
+                username="user", password="pass", hub_url=hub.base_url
+            )
+
+            results = s2_dl.search_for_products_by_tile(
+                ["12UUA", "12UVA"], ("20190601", "20190701")
+            )
+
+        self.assertEqual(len(results), 2)
+        for product in results.values():
+            self.assertEqual(product["cloudcoverpercentage"], 12.5)
+            self.assertEqual(product["orbitnumber"], 12065)
+            self.assertEqual(product["beginposition"].year, 2019)
+            self.assertEqual(product["api_source"], "esa_scihub")
+
+    def test_online_value(self):
+        with StandInHub({PRODUCT_ID: b"zip"}) as hub:
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/Online/$value"
+            online = self.session.get(url).json()
+            hub.offline.add(PRODUCT_ID)
+            offline = self.session.get(url).json()
+
+        self.assertIs(online, True)
+        self.assertIs(offline, False)
+
+    def test_faults_are_answered_in_order(self):
+        with StandInHub({PRODUCT_ID: b"zip"}) as hub:
+            hub.faults = [503, 500]
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            responses = [self.session.get(url) for _ in range(3)]
+
+        self.assertEqual([r.status_code for r in responses], [503, 500, 200])
+        self.assertEqual(responses[0].headers["Retry-After"], "1")
+        self.assertEqual(responses[2].content, b"zip")
+
+    def test_throttle(self):
+        body = b"x" * (256 * 1024)
+        with StandInHub({PRODUCT_ID: body}) as hub:
+            hub.throttle = 1024 * 1024
+            url = f"{hub.base_url}/odata/v1/Products('{PRODUCT_ID}')/$value"
+            started = time.perf_counter()
+            r = self.session.get(url)
+            elapsed = time.perf_counter() - started
+
+        self.assertEqual(r.content, body)
+        self.assertGreaterEqual(elapsed, 0.2)
+
+    def test_asf_datapool_path(self):
+        name = "S1B_IW_GRDH_1SSV_20161014T012841_20161014T012906_002496_00435F_BB18"
+        with StandInHub() as hub:
+            hub.asf_products[name] = b"asf zip"
+            r = self.session.get(f"{hub.asf_url}/GRD_HS/SB/{name}.zip")
+
+        self.assertEqual(r.content, b"asf zip")
+
+
+if __name__ == "__main__":
+    unittest.main()
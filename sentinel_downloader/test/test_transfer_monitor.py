@@ -0,0 +1,77 @@
+import unittest
+import time
+
+from .. import transfer_monitor
+
+
+class TestTransferMonitor(unittest.TestCase):
+    def setUp(self):
+        self.service = transfer_monitor.TransferMonitorService(
+            sample_interval=0.05, stall_timeout=0.2
+        )
+
+    def test_updates_are_tracked(self):
+        transfer = transfer_monitor.TransferMonitor(
+            "product.zip", 1, total_bytes=1000, service=self.service
+        )
+        transfer.update(100)
+        transfer.update(150)
+
+        stats = transfer.stats()
+        self.assertEqual(stats.bytes_transferred, 250)
+        self.assertEqual(stats.total_bytes, 1000)
+        self.assertEqual(len(self.service.report()), 1)
+
+    def test_progress_sets_total(self):
+        transfer = transfer_monitor.TransferMonitor(
+            "product.zip", 1, service=self.service
+        )
+        transfer.progress(400, 800)
+
+        stats = transfer.stats()
+        self.assertEqual(stats.bytes_transferred, 400)
+        self.assertEqual(stats.total_bytes, 800)
+
+    def test_rates_and_eta(self):
+        transfer = transfer_monitor.TransferMonitor(
+            "product.zip", 1, total_bytes=10000, service=self.service
+        )
+        for _ in range(3):
+            time.sleep(0.06)
+            transfer.update(1000)
+
+        stats = transfer.stats()
+        self.assertGreater(stats.instant_rate, 0)
+        self.assertGreater(stats.ewma_rate, 0)
+        self.assertIsNotNone(stats.eta)
+        self.assertFalse(stats.stalled)
+
+    def test_stall_detection(self):
+        transfer = transfer_monitor.TransferMonitor(
+            "product.zip", 1, service=self.service
+        )
+        transfer.update(10)
+        time.sleep(0.25)
+
+        self.assertEqual([s.id for s in self.service.stalled()], [1])
+
+        time.sleep(0.06)
+        self.assertEqual(transfer.stats().instant_rate, 0)
+
+    def test_finish_is_immediate(self):
+        transfer = transfer_monitor.TransferMonitor(
+            "product.zip", 1, service=self.service
+        )
+        start = time.monotonic()
+        transfer.finish()
+
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.service.report(), [])
+
+    def test_convert_bytes(self):
+        self.assertEqual(transfer_monitor.convert_bytes(2048), "2.0 KB")
+        self.assertEqual(transfer_monitor.convert_bytes(3 * 1024 ** 2, raw="MB"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import datetime
+import tempfile
+import unittest
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from .. import rate_limiter
+from .. import s2_downloader
+from .. import watch_sync
+from .stand_in_server import StandInHub
+
+
+def product_id(i):
+    return f"{i:08d}-b95f-44f6-aa7e-bccbe4b00c4f"
+
+
+def add_product(hub, i, tile, ingested):
+    hub.add_search_entry(
+        product_id(i),
+        f"S2B_MSIL1C_20190628T182929_N0207_R027_T{tile}_20190628T{i:06d}",
+        ingestiondate=ingested,
+    )
+
+
+def day(n):
+    return datetime.datetime(2019, 6, 1, 12, 0) + datetime.timedelta(days=n)
+
+
+class TestWatchSync(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.hub = StandInHub().start()
+        self.s2_dl = s2_downloader.S2Downloader(
+            username="user", password="pass", hub_url=self.hub.base_url
+        )
+        self.s2_dl.search_rate_limiter = rate_limiter.RateLimiter(100, burst=4)
+        self.sync = watch_sync.WatchListSync(
+            self.s2_dl, Path(self.temp_dir.name, "watch.sqlite"), overlap=3600
+        )
+        self.entry = watch_sync.WatchEntry(
+            "alberta", tiles=["12UUA", "12UVA"], filters={"producttype": "S2MSI1C"}
+        )
+
+    def tearDown(self):
+        self.sync.close()
+        self.hub.stop()
+        self.temp_dir.cleanup()
+
+    def last_query(self):
+        searches = [path for path, _ in self.hub.requests if path.startswith("/dhus/search")]
+        return parse_qs(urlsplit(searches[-1]).query)["q"][0]
+
+    def test_only_new_products_are_emitted(self):
+        add_product(self.hub, 1, "12UUA", day(1))
+        add_product(self.hub, 2, "12UVA", day(2))
+        add_product(self.hub, 3, "12UWA", day(2))
+
+        first = dict(self.sync.sync(self.entry))
+        self.assertEqual(set(first), {product_id(1), product_id(2)})
+        self.assertNotIn("ingestiondate", self.last_query())
+        self.assertEqual(self.sync.mark("alberta"), day(2))
+
+        self.assertEqual(list(self.sync.sync(self.entry)), [])
+        self.assertIn('ingestiondate:["2019-06-03T11:00:00Z" TO "NOW"]', self.last_query())
+
+        # Indexed late, inside the overlap
+        add_product(self.hub, 4, "12UUA", day(2) - datetime.timedelta(minutes=10))
+        add_product(self.hub, 5, "12UVA", day(3))
+        self.assertEqual(
+            {uuid for uuid, _ in self.sync.sync(self.entry)}, {product_id(4), product_id(5)}
+        )
+        self.assertEqual(self.sync.mark("alberta"), day(3))
+
+    def test_interrupted_sync_resumes(self):
+        for i in range(6):
+            add_product(self.hub, i, "12UUA", day(i))
+
+        stream = self.sync.sync(self.entry)
+        taken = [next(stream)[0] for _ in range(2)]
+        stream.close()
+        self.assertIsNone(self.sync.mark("alberta"))
+
+        rest = [uuid for uuid, _ in self.sync.sync(self.entry)]
+
+        # The product the sync was stopped at is returned again
+        self.assertNotIn(taken[0], rest)
+        self.assertEqual(sorted(taken[:1] + rest), [product_id(i) for i in range(6)])
+        self.assertEqual(self.sync.mark("alberta"), day(5))
+
+    def test_changed_entry_starts_over(self):
+        add_product(self.hub, 1, "12UUA", day(1))
+        list(self.sync.sync(self.entry))
+
+        changed = self.entry._replace(tiles=["12UUA", "12UWA"])
+        self.assertEqual([uuid for uuid, _ in self.sync.sync(changed)], [product_id(1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,47 +1,208 @@
 import os
 import time
-from threading import Thread
-import queue
-import sys
+import threading
+from collections import namedtuple
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+TransferStats = namedtuple(
+    "TransferStats",
+    [
+        "id",
+        "filename",
+        "bytes_transferred",
+        "total_bytes",
+        "elapsed",
+        "instant_rate",
+        "ewma_rate",
+        "eta",
+        "stalled",
+    ],
+)
+
+
+class TransferMonitorService:
+    """Tracks every active transfer in the process without a thread per file.
+
+    Download loops push byte counts into their ``TransferMonitor``, rates are
+    derived from those updates. A single optional reporter thread logs a
+    summary of all active transfers.
+
+    Args:
+        sample_interval (float): Minimum seconds between rate samples.
+        ewma_alpha (float): Weight of the newest sample in the smoothed rate.
+        stall_timeout (float): Seconds without progress before a transfer
+            is reported as stalled.
+    """
+
+    def __init__(self, sample_interval=1.0, ewma_alpha=0.3, stall_timeout=60.0):
+        self.sample_interval = sample_interval
+        self.ewma_alpha = ewma_alpha
+        self.stall_timeout = stall_timeout
+
+        self.transfers = {}
+        self.lock = threading.Lock()
+
+        self.reporter = None
+        self.stop_reporting_event = threading.Event()
+
+    def register(self, transfer):
+        with self.lock:
+            self.transfers[id(transfer)] = transfer
+
+    def unregister(self, transfer):
+        with self.lock:
+            self.transfers.pop(id(transfer), None)
+
+    def active(self):
+        with self.lock:
+            return list(self.transfers.values())
+
+    def report(self):
+        """Return a ``TransferStats`` snapshot for every active transfer."""
+        return [transfer.stats() for transfer in self.active()]
+
+    def stalled(self):
+        return [stats for stats in self.report() if stats.stalled]
+
+    def log_report(self):
+        for stats in self.report():
+            total = convert_bytes(stats.total_bytes) if stats.total_bytes else "?"
+            eta = f"{stats.eta:.0f}s" if stats.eta is not None else "?"
+            logger.info(
+                f"{stats.id} ====> {stats.filename} total transfer: "
+                f"{convert_bytes(stats.bytes_transferred)} of {total}, "
+                f"{convert_bytes(stats.instant_rate)}/s now, "
+                f"{convert_bytes(stats.ewma_rate)}/s average, eta {eta}"
+                f"{' STALLED' if stats.stalled else ''}"
+            )
+
+    def start_reporting(self, interval=30.0):
+        """Log a summary of active transfers every ``interval`` seconds."""
+        if self.reporter is not None and self.reporter.is_alive():
+            return
+
+        self.stop_reporting_event.clear()
+
+        def report_loop():
+            while not self.stop_reporting_event.wait(interval):
+                self.log_report()
+
+        self.reporter = threading.Thread(target=report_loop, daemon=True)
+        self.reporter.start()
+
+    def stop_reporting(self):
+        self.stop_reporting_event.set()
+        if self.reporter is not None:
+            self.reporter.join()
+            self.reporter = None
+
+
+_default_service = TransferMonitorService()
+
+
+def get_monitor_service():
+    return _default_service
+
+
 class TransferMonitor:
-    def __init__(self, filename, id):
+    """Telemetry for a single transfer, updated directly by the download loop.
+
+    ``update(nbytes)`` adds to the running total, ``progress(done, total)``
+    sets it (matching the ``http_download`` progress callback). Neither does
+    any I/O, and ``finish()`` returns immediately.
+    """
+
+    def __init__(self, filename, id, total_bytes=None, service=None):
         self.filename = filename
         self.start_time = datetime.now()
         self.finish_time = None
-        self.stop = False
         self.id = id
 
-        self.thread = Thread(target = self.file_size_monit, args = ( ))
-        self.thread.start()
+        self.total_bytes = total_bytes
+        self.bytes_transferred = 0
+
+        self.service = service or get_monitor_service()
+
+        now = time.monotonic()
+        self.start_clock = now
+        self.last_progress_clock = now
+        self.sample_clock = now
+        self.sample_bytes = 0
+        self.instant_rate = 0.0
+        self.ewma_rate = None
 
+        self.lock = threading.Lock()
+        self.service.register(self)
 
-    def file_size_monit(self):
-        file_size = 0
-        stablized_size = 30 # wait 30 seconds before declaring file stable
-        stable_count = 0
-        time_count = 1
-        step_size = 30
+    def update(self, nbytes):
+        with self.lock:
+            self.record(self.bytes_transferred + nbytes)
 
-        while True:
-            new_file_size = self.get_file_size()
-            humanbytes =  self.convert_bytes(float(new_file_size))
-            avg_speed = self.convert_bytes(float(new_file_size), raw='MB') / time_count
+    def progress(self, done, total=None):
+        with self.lock:
+            if total is not None:
+                self.total_bytes = total
+            self.record(done)
 
-            logger.debug('{} ====> {} total transfer: {}, transfer speed {} MB/s'.format(self.id, self.filename, humanbytes, avg_speed))
-            print('{} ====> {} total transfer: {}, transfer speed {} MB/s'.format(self.id, self.filename, humanbytes, avg_speed))
+    def record(self, done):
+        now = time.monotonic()
 
-            if self.stop:
-                break
+        if done != self.bytes_transferred:
+            self.last_progress_clock = now
+        self.bytes_transferred = done
 
-            file_size = new_file_size
-            time_count += step_size
-            time.sleep(step_size)
+        elapsed = now - self.sample_clock
+        if elapsed >= self.service.sample_interval:
+            self.sample(now, elapsed)
 
+    def sample(self, now, elapsed):
+        self.instant_rate = (self.bytes_transferred - self.sample_bytes) / elapsed
+
+        if self.ewma_rate is None:
+            self.ewma_rate = self.instant_rate
+        else:
+            alpha = self.service.ewma_alpha
+            self.ewma_rate = alpha * self.instant_rate + (1 - alpha) * self.ewma_rate
+
+        self.sample_clock = now
+        self.sample_bytes = self.bytes_transferred
+
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.start_clock
+
+            # Fold idle time into the rates so a stalled transfer decays to zero
+            if now - self.sample_clock >= self.service.sample_interval:
+                self.sample(now, now - self.sample_clock)
+
+            ewma_rate = self.ewma_rate
+            if ewma_rate is None:
+                ewma_rate = self.bytes_transferred / elapsed if elapsed > 0 else 0.0
+
+            eta = None
+            if self.total_bytes and ewma_rate > 0:
+                eta = max(0, self.total_bytes - self.bytes_transferred) / ewma_rate
+
+            stalled = (
+                self.finish_time is None
+                and now - self.last_progress_clock >= self.service.stall_timeout
+            )
+
+            return TransferStats(
+                self.id,
+                str(self.filename),
+                self.bytes_transferred,
+                self.total_bytes,
+                elapsed,
+                self.instant_rate,
+                ewma_rate,
+                eta,
+                stalled,
+            )
 
     def get_file_size(self, human=False):
 
@@ -55,28 +216,40 @@ class TransferMonitor:
             return -1
 
     def convert_bytes(self, num, raw=None):
-        """
-        this function will convert bytes to MB.... GB... etc
-        """
-        if raw:
-            for x in ['bytes', 'KB', 'MB', 'GB', 'TB']:
-                if raw == x:
-                    return num
-                num /= 1024.0
-
-        for x in ['bytes', 'KB', 'MB', 'GB', 'TB']:
-            if num < 1024.0:
-                return "%3.1f %s" % (num, x)
-            num /= 1024.0
+        return convert_bytes(num, raw)
 
     def finish(self):
-        self.stop = True
         self.finish_time = datetime.now()
+        self.service.unregister(self)
 
         self.time_delta = self.finish_time - self.start_time
-        print('Time taken: total {}s, {} hours {} minutes {} seconds'
-                .format(self.time_delta.total_seconds(),
-                self.time_delta.seconds / (60 * 60),
-                self.time_delta.seconds  % (60 * 60) / 60,
-                self.time_delta.seconds % (60 * 60 * 60)))
-        self.thread.join()
+        seconds = self.time_delta.total_seconds()
+        logger.info(
+            "{} ====> {} finished, {} in {:.1f}s ({}/s)".format(
+                self.id,
+                self.filename,
+                convert_bytes(self.bytes_transferred),
+                seconds,
+                convert_bytes(self.bytes_transferred / seconds if seconds > 0 else 0),
+            )
+        )
+
+
+def convert_bytes(num, raw=None):
+    """
+    this function will convert bytes to MB.... GB... etc
+    """
+    num = float(num)
+
+    if raw:
+        for x in ['bytes', 'KB', 'MB', 'GB', 'TB']:
+            if raw == x:
+                return num
+            num /= 1024.0
+
+    for x in ['bytes', 'KB', 'MB', 'GB', 'TB']:
+        if num < 1024.0:
+            return "%3.1f %s" % (num, x)
+        num /= 1024.0
+
+    return "%3.1f %s" % (num * 1024.0, 'TB')
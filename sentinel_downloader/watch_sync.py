@@ -0,0 +1,223 @@
+"""Incremental "what's new since the last run" searches for watch lists.
+
+A scheduler that reruns its tile or AOI searches over the full date range
+every cycle pays for the whole history each time and then has to diff the
+results itself. ``WatchListSync`` keeps a high-water mark per watch list
+entry, the newest ``ingestiondate`` it has emitted, and only asks the hub for
+products ingested after it (less an ``overlap`` for late indexing), yielding
+just the products not emitted before.
+
+Marks and the uuids emitted near them live in a small SQLite file. The mark
+only moves once a sync has run to completion, so a sync stopped part way is
+picked up again next time without losing or repeating products.
+"""
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from .s2_downloader import TILE_QUERY_GROUP_SIZE, TILE_QUERY_LENGTH_RATIO
+from .search_batch import BatchedSearch, tile_clause
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OVERLAP = 60 * 60.0
+
+WatchEntry = namedtuple("WatchEntry", ["name", "tiles", "aoi", "filters"])
+WatchEntry.__new__.__defaults__ = (None, None, None)
+WatchEntry.__doc__ = """A watch list entry.
+
+Args:
+    name (str): Unique name, the key of the entry's high-water mark.
+    tiles (list): MGRS tiles to watch, or None.
+    aoi (str): WKT polygon to watch, or None.
+    filters (dict): Extra ``SentinelAPI.query`` keywords, e.g.
+        ``{"platformname": "Sentinel-2", "producttype": "S2MSI1C",
+        "date": ("20190101", "NOW")}``.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watch_marks (
+    name TEXT PRIMARY KEY,
+    definition TEXT NOT NULL,
+    mark TEXT,
+    last_sync REAL
+);
+CREATE TABLE IF NOT EXISTS watch_seen (
+    name TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    ingestiondate TEXT NOT NULL,
+    PRIMARY KEY (name, uuid)
+);
+"""
+
+
+def entry_definition(entry):
+    """JSON of everything but the name, a changed definition restarts the entry."""
+    definition = entry._asdict()
+    del definition["name"]
+    return json.dumps(definition, sort_keys=True, default=str)
+
+
+class WatchListSync:
+    """Incremental searches for watch list entries through an ``S2Downloader``.
+
+    Args:
+        s2_downloader (S2Downloader): Its api and search rate limit are used.
+        path (str): SQLite file holding the marks, created if missing.
+        overlap (float): Seconds before the mark that are searched again, so
+            products indexed late with an earlier ``ingestiondate`` are found.
+    """
+
+    def __init__(self, s2_downloader, path, overlap=DEFAULT_OVERLAP):
+        self.s2_downloader = s2_downloader
+        self.path = Path(path)
+        self.overlap = datetime.timedelta(seconds=overlap)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def mark(self, name):
+        """The high-water mark of entry ``name``, None before its first sync."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT mark FROM watch_marks WHERE name = ?", (name,)
+            ).fetchone()
+
+        if row is None or row[0] is None:
+            return None
+        return datetime.datetime.fromisoformat(row[0])
+
+    def reset(self, name):
+        with self.lock:
+            self.db.execute("DELETE FROM watch_marks WHERE name = ?", (name,))
+            self.db.execute("DELETE FROM watch_seen WHERE name = ?", (name,))
+            self.db.commit()
+
+    def prepare(self, entry):
+        """Return the entry's mark, resetting it if the entry was redefined."""
+        definition = entry_definition(entry)
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT definition FROM watch_marks WHERE name = ?", (entry.name,)
+            ).fetchone()
+
+        if row is not None and row[0] != definition:
+            logger.info(f"Watch list entry {entry.name} changed, syncing it from scratch")
+            self.reset(entry.name)
+            row = None
+
+        if row is None:
+            with self.lock:
+                self.db.execute(
+                    "INSERT INTO watch_marks (name, definition) VALUES (?, ?)",
+                    (entry.name, definition),
+                )
+                self.db.commit()
+
+        return self.mark(entry.name)
+
+    def seen(self, name):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT uuid FROM watch_seen WHERE name = ?", (name,)
+            ).fetchall()
+        return {uuid for uuid, in rows}
+
+    def remember(self, name, uuid, ingestiondate):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO watch_seen (name, uuid, ingestiondate) "
+                "VALUES (?, ?, ?)",
+                (name, uuid, ingestiondate.isoformat()),
+            )
+            self.db.commit()
+
+    def advance(self, name, mark):
+        """Move the mark and forget uuids too old to be searched again."""
+        with self.lock:
+            self.db.execute(
+                "UPDATE watch_marks SET mark = ?, last_sync = ? WHERE name = ?",
+                (mark.isoformat() if mark else None, time.time(), name),
+            )
+            if mark is not None:
+                self.db.execute(
+                    "DELETE FROM watch_seen WHERE name = ? AND ingestiondate < ?",
+                    (name, (mark - self.overlap).isoformat()),
+                )
+            self.db.commit()
+
+    def search(self, entry, query_kwargs):
+        # Straight to the hub, every sync narrows the query differently so a
+        # query cache would only fill up
+        api = self.s2_downloader.api
+
+        if entry.tiles:
+            query_kwargs.setdefault("platformname", "Sentinel-2")
+            search = BatchedSearch(
+                api,
+                concurrency=self.s2_downloader.search_concurrency,
+                rate_limiter=self.s2_downloader.search_rate_limiter,
+                max_clauses=TILE_QUERY_GROUP_SIZE,
+                max_length_ratio=TILE_QUERY_LENGTH_RATIO,
+            )
+            clauses = [tile_clause(tile) for tile in dict.fromkeys(entry.tiles)]
+            yield from search.iter_query(clauses, **query_kwargs)
+
+        if entry.aoi:
+            self.s2_downloader.search_rate_limiter.acquire()
+            yield from api.query(area=entry.aoi, **query_kwargs).items()
+
+    def sync(self, entry):
+        """Yield (uuid, properties) for products new to ``entry`` since its last sync.
+
+        The first sync of an entry yields everything its filters match.
+        """
+        mark = self.prepare(entry)
+        seen = self.seen(entry.name)
+
+        query_kwargs = dict(entry.filters or {})
+        if mark is not None:
+            query_kwargs["ingestiondate"] = (mark - self.overlap, "NOW")
+
+        logger.info(f"Syncing watch list entry {entry.name} from {mark}")
+
+        new_mark = mark
+        emitted = 0
+        for uuid, properties in self.search(entry, query_kwargs):
+            if uuid in seen:
+                continue
+            seen.add(uuid)
+
+            properties["api_source"] = "esa_scihub"
+            emitted += 1
+            yield uuid, properties
+
+            # Only once the caller took it, a sync stopped during the yield
+            # returns the product again next time
+            ingestiondate = properties.get("ingestiondate")
+            if isinstance(ingestiondate, datetime.datetime):
+                self.remember(entry.name, uuid, ingestiondate)
+                if new_mark is None or ingestiondate > new_mark:
+                    new_mark = ingestiondate
+
+        self.advance(entry.name, new_mark)
+        logger.info(f"Watch list entry {entry.name}: {emitted} new products, mark {new_mark}")
+
+    def sync_all(self, entries):
+        """Yield (entry name, uuid, properties) for the new products of every entry."""
+        for entry in entries:
+            for uuid, properties in self.sync(entry):
+                yield entry.name, uuid, properties